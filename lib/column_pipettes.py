@@ -0,0 +1,552 @@
+"""
+Choosing between the 8-channel and single-channel pipettes for the groups of wells in a plate map.
+
+The 8-channel pipette of the OT-2 can also pick up fewer than 8 tips, counting back from nozzle H1, so a run of
+neighbouring samples in a partially filled column can be pipetted in one go instead of one well at a time. The nozzles
+without tips then reach over the slot behind the labware, so partial pickups are only used where that slot is empty or
+only holds labware low enough for them to pass over. A sample on its own gains nothing from a partial pickup, so it
+always goes to the single-channel pipette, whose racks can go in any free slot.
+
+A full plate needs more tips than the racks on the deck hold, so the steps also tell ``ColumnPipettes`` which groups of
+wells they will pick up tips for, and how many times, when they are added. Before anything runs, ``load_tip_racks()``
+works out how many racks every kind of pickup needs, loads more racks into the free slots, and either stops the protocol
+or announces how often it will pause for the used racks to be replaced. No rack goes behind the labware that partial
+pickups visit, and more racks for partial pickups only go where partial pickups can reach them; when no such slot is
+free, the run pauses for refills instead. If the slots partial pickups rule out would make the run pause for more
+refills than without them, the partially filled columns go to the single-channel pipette instead, and the partial tip
+racks to the pipette that needs them most. While the protocol runs, a step that would run out of tips first pauses to
+have its used racks replaced, together with those of the other kinds of pickups that would run out before the end too,
+and a step that picks up tips another way than the plan counted them, e.g. because it visits other labware than it was
+planned with, is noted in the run log.
+
+Steps that only ever touch the wells of one group can also park their tips: the tips go back to their place in the
+rack after the step, and the next such step for the same group picks them up again instead of new ones. The OT-2 can't
+return tips with a partial nozzle layout, so partial pickups always use new tips. Parked tips are kept in racks of their
+own, which are never replaced, so the racks of new tips can still be replaced when they run out. ``load_tip_racks()``
+loads them into the free slots or takes them from the racks of new tips; when neither is possible, the parked tips share
+the racks of a pipette whose new tips fit alongside them without a refill.
+
+This file is inlined into the protocols by ``tools/bundle.py``; edit it here and re-run the bundler.
+"""
+import math
+
+from opentrons import protocol_api
+
+from lib.plate_map import PLATE_ROWS
+
+# how far a tip slides onto its nozzle, in mm (a little more than the actual overlap, to be safe)
+TIP_OVERLAP = 10
+
+class ColumnPipettes:
+    """
+    Picks the pipette for every group of wells from ``PlateMap.column_plan()``: full columns use all 8 channels of the
+    8-channel pipette, runs of two or more wells in partially filled columns use as many of its channels as the run is
+    long where there is room for it, and the single-channel pipette visits the wells one by one otherwise.
+    """
+
+    def __init__(self, protocol: protocol_api.ProtocolContext, multi: protocol_api.InstrumentContext, single: protocol_api.InstrumentContext, partial_tip_racks: list[protocol_api.Labware]):
+        """
+        :param protocol: The protocol context.
+        :param multi: The 8-channel pipette, loaded with the tip racks for full columns and its starting tip.
+        :param single: The single-channel pipette, loaded with its own tip racks and its starting tip.
+        :param partial_tip_racks: Full tip racks used only for partial pickups, so these never break up the columns of
+            tips the full columns need. Partial pickups are turned off if the list is empty.
+        """
+        self.protocol = protocol
+        self.multi = multi
+        self.single = single
+        self.multi_tip_racks = list(multi.tip_racks)
+        self.multi_starting_tip = multi.starting_tip
+        # "multi" (full columns), "partial" and "single" -> the tip racks of that kind of pickup, and "parked" -> the tip
+        # racks of the parked tips of both pipettes
+        self.tip_racks = {"multi": self.multi_tip_racks, "partial": list(partial_tip_racks), "single": list(single.tip_racks), "parked": []}
+        # the first tip of the parked racks, if one was taken from the racks of new tips with their starting tip in it
+        self.parked_starting_tip = None
+        # the pickups the steps will make, as (kind of pickup or None, wells, labware, tips, parked) tuples recorded by
+        # plan()
+        self.planned = []
+        # (channels, plate, well) -> the place in the rack of the tip parked for a well of a sample plate, with 0
+        # channels for the single-channel pipette
+        self.parked = {}
+        # the wells of a group -> the kinds of pickup load_tip_racks() counted the tips of for the steps of the group, in
+        # the order they run
+        self.planned_kinds = {}
+        # kind of pickup -> the number of tips in every pickup the steps that haven't run yet will make, from
+        # load_tip_racks()
+        self.remaining = {kind: [] for kind in self.tip_racks}
+        # labware that is off the deck while the tips are planned -> the labware on the deck whose place it takes, from
+        # stand_in()
+        self.stand_ins = {}
+        # labware -> whether the nozzles without tips can pass over the slot behind it, worked out the first time
+        self.room = {}
+
+    def stand_in(self, labware: protocol_api.Labware, on_deck: protocol_api.Labware):
+        """
+        Records that a labware that is off the deck while the tips are planned, like a sample plate on the magnetic
+        block, will take the place of a labware that is on the deck. Steps plan and pick with the labware they actually
+        pipette from, and the labware on the deck decides the slot and the room for partial pickups. Its wells are lower,
+        so the room is never overestimated.
+
+        :param labware: The labware that is moved onto the deck by a step.
+        :param on_deck: The labware on the deck whose place it takes.
+        """
+        self.stand_ins[labware] = on_deck
+
+    def slot(self, labware: protocol_api.Labware) -> int:
+        """
+        Returns the slot a labware is pipetted in, which for a labware with a stand-in is the slot of the stand-in.
+
+        :param labware: The labware.
+        """
+        return int(self.stand_ins.get(labware, labware).parent)
+
+    def has_room(self, labware: protocol_api.Labware) -> bool:
+        """
+        Returns whether the nozzles without tips can pass over the slot behind the labware. The answer is worked out once,
+        before any step runs, so the steps pick the pipettes the plan counted the tips of.
+
+        :param labware: The labware to pipette from or to.
+        """
+        if labware not in self.room:
+            placed = self.stand_ins.get(labware, labware)
+            self.room[labware] = self.slot_has_room(int(placed.parent), placed.wells()[0].bottom().point.z)
+        return self.room[labware]
+
+    def slot_has_room(self, slot: int, bottom: float) -> bool:
+        """
+        Returns whether the nozzles without tips can pass over the slot behind a slot, when the tips reach down to a
+        height.
+
+        :param slot: The slot of the labware to pipette from or to.
+        :param bottom: The height of the bottom of its wells, in mm.
+        """
+        # the back row is at the edge of the pipette's reach, and slot 12 behind it holds the trash
+        if slot > 9 or slot + 3 == 12:
+            return False
+        behind = self.protocol.deck[slot + 3]
+        if behind is None:
+            return True
+        tip_length = self.tip_racks["partial"][0].tip_length
+        return behind.highest_z < bottom + tip_length - TIP_OVERLAP
+
+    def channels(self, wells: list[str], labware: tuple[protocol_api.Labware, ...]) -> int:
+        """
+        Returns how many channels of the 8-channel pipette a group of wells is pipetted with, or 0 if it is pipetted with
+        the single-channel pipette.
+
+        :param wells: A group of wells from ``PlateMap.column_plan()``.
+        :param labware: Every labware the pipette visits for this group, apart from the tip racks and the trash.
+        """
+        if len(wells) == 8:
+            return 8
+        if len(wells) > 1 and self.tip_racks["partial"] and all(self.has_room(lw) for lw in labware + tuple(self.tip_racks["partial"])):
+            return len(wells)
+        return 0
+
+    def configure(self, channels: int):
+        """
+        Switches the 8-channel pipette to the given number of channels, counting back from nozzle H1.
+
+        :param channels: The number of channels, from 1 to 8.
+        """
+        if self.multi.active_channels == channels:
+            return
+        if channels == 8:
+            self.multi.configure_nozzle_layout(style=protocol_api.ALL, tip_racks=self.multi_tip_racks)
+            self.multi.starting_tip = self.multi_starting_tip
+            return
+        # a starting tip can't be combined with a partial configuration, and the partial tip racks start full anyway
+        self.multi.starting_tip = None
+        if channels == 1:
+            self.multi.configure_nozzle_layout(style=protocol_api.SINGLE, start="H1", tip_racks=self.tip_racks["partial"])
+        else:
+            end = PLATE_ROWS[8 - channels] + "1"
+            self.multi.configure_nozzle_layout(style=protocol_api.PARTIAL_COLUMN, start="H1", end=end, tip_racks=self.tip_racks["partial"])
+
+    def pick(self, wells: list[str], *labware: protocol_api.Labware, tips=1, parked=None) -> tuple[protocol_api.InstrumentContext, list[str]]:
+        """
+        Returns the pipette for a group of wells and the wells to send it to. With more than one channel that is only
+        the well under the primary nozzle: row A for a full column, and the front well of a partial run.
+
+        :param wells: A group of wells from ``PlateMap.column_plan()``.
+        :param labware: Every labware the pipette visits for this group, apart from the tip racks and the trash.
+        :param tips: How many new tips the step picks up for every well (or column) it sends the pipette to. If the
+            racks don't have that many left, the protocol first pauses to have them replaced.
+        :param parked: The sample plate whose parked tips the step also uses, or None. A parked tip counts as a new tip
+            the first time.
+        """
+        channels = self.channels(wells, labware)
+        kind, visits = pickup_kind(channels), visited_wells(wells, channels)
+        # tips that can be parked come from the parked racks, which load_tip_racks() made big enough for all of them
+        new_parked = 0 if can_park(channels) else len(new_parked_tips(visits, channels, parked, self.parked))
+        self.check_kind(wells, kind)
+        self.ensure_tips(kind, [max(1, channels)] * (len(visits) * tips + new_parked))
+        if channels == 0:
+            return self.single, visits
+        self.configure(channels)
+        return self.multi, visits
+
+    def pick_single(self, wells: list[str], tips=1) -> protocol_api.InstrumentContext:
+        """
+        Returns the single-channel pipette, for steps that always use it, after making sure its racks have enough tips
+        left like ``pick()`` does.
+
+        :param wells: The wells the step visits.
+        :param tips: How many tips the step picks up for every well.
+        """
+        self.check_kind(wells, "single")
+        self.ensure_tips("single", [1] * len(wells) * tips)
+        return self.single
+
+    def check_kind(self, wells: list[str], kind: str):
+        """
+        Notes in the run log when a step picks up tips for a group of wells with another kind of pickup than
+        ``load_tip_racks()`` counted the tips of, e.g. because it visits other labware than it was planned with, since
+        the racks of that kind may then run out of tips the plan didn't count.
+
+        :param wells: A group of wells from ``PlateMap.column_plan()``.
+        :param kind: The kind of pickup the step makes.
+        """
+        planned = self.planned_kinds.get(tuple(wells), [])
+        expected = planned.pop(0) if planned else None
+        if kind != expected:
+            self.protocol.comment("Unplanned pickup: the wells " + ", ".join(wells) + " use a " + kind + " pickup, but " + ("none" if expected is None else "a " + expected + " pickup") + " was planned.")
+
+    def plan(self, wells: list[str], *labware: protocol_api.Labware, tips=1, single=False, parked=None):
+        """
+        Records that a step will pick up tips for a group of wells. Call this when the step is added, with the labware
+        the step passes to ``pick()``.
+
+        :param wells: A group of wells from ``PlateMap.column_plan()``.
+        :param labware: Every labware the pipette visits for this group, apart from the tip racks and the trash.
+        :param tips: How many new tips the step picks up for every well (or column) it visits.
+        :param single: Whether the step uses ``pick_single()`` instead of ``pick()``.
+        :param parked: The sample plate whose parked tips the step also uses, or None.
+        """
+        if tips > 0 or parked is not None:
+            self.planned.append(("single" if single else None, wells, labware, tips, parked))
+
+    def demand(self) -> dict[str, list[int]]:
+        """
+        Returns the number of tips in every pickup the planned steps make, for every kind of pickup, with the first
+        pickups of parked tips under "parked".
+        """
+        demand = {kind: [] for kind in self.tip_racks}
+        # a parked tip is only a new tip the first time
+        seen = set()
+        for kind, wells, labware, tips, parked in self.planned:
+            channels = 0 if kind == "single" else self.channels(wells, labware)
+            visits = visited_wells(wells, channels)
+            new_parked = new_parked_tips(visits, channels, parked, seen)
+            seen.update((channels, parked, well) for well in new_parked)
+            demand[pickup_kind(channels)] += [max(1, channels)] * len(visits) * tips
+            demand["parked" if can_park(channels) else pickup_kind(channels)] += [max(1, channels)] * len(new_parked)
+        return demand
+
+    def next_tip(self, kind: str, channels: int) -> protocol_api.Well:
+        """
+        Returns the tip under the primary nozzle for the next pickup of a kind, or None if there are not enough tips left.
+        Full columns start at row A; partial pickups take the tips at the back of a column first, so the nozzles without
+        tips pass behind the rack, and the primary nozzle H1 is over the front one of them.
+
+        :param kind: "multi", "partial", "single" or "parked".
+        :param channels: The number of tips to pick up.
+        """
+        starting_tip = self.starting_tip(kind)
+        for rack in self.tip_racks[kind]:
+            wells = rack.wells()
+            skipped = wells.index(starting_tip) if starting_tip is not None and starting_tip.parent == rack else 0
+            for column in range(12):
+                left = [wells[i] for i in range(8 * column, 8 * column + 8) if i >= skipped and wells[i].has_tip]
+                if len(left) >= channels:
+                    return left[channels - 1] if kind == "partial" else left[0]
+        return None
+
+    def pick_up_tip(self, pipette: protocol_api.InstrumentContext, well: str, parked=None):
+        """
+        Picks up a new tip (or tips) for a well, or with ``parked``, the tip parked for the well of that plate, which is
+        new the first time and is parked once it is returned with ``drop_tip()``.
+
+        :param pipette: The pipette from ``pick()``.
+        :param well: The well from ``pick()`` the tip is for.
+        :param parked: The sample plate the tip is parked for, or None for a new tip.
+        """
+        if parked is None or not can_park(self.pipette_channels(pipette)):
+            pipette.pick_up_tip()
+            return
+        key = (self.pipette_channels(pipette), parked, well)
+        if key not in self.parked:
+            self.parked[key] = self.next_tip("parked", max(1, key[0]))
+        pipette.pick_up_tip(self.parked[key])
+
+    def pipette_channels(self, pipette: protocol_api.InstrumentContext) -> int:
+        """
+        Returns the number of channels the 8-channel pipette is configured for, or 0 for the single-channel pipette.
+
+        :param pipette: The pipette.
+        """
+        return 0 if pipette == self.single else pipette.active_channels
+
+    def drop_tip(self, pipette: protocol_api.InstrumentContext, parked=None):
+        """
+        Drops the tip in the trash, or with ``parked``, returns it to its place in the rack for the next step.
+
+        :param pipette: The pipette.
+        :param parked: The sample plate the tip is parked for, or None.
+        """
+        if parked is not None and can_park(self.pipette_channels(pipette)):
+            pipette.return_tip()
+        else:
+            pipette.drop_tip()
+
+    def starting_tip(self, kind: str) -> protocol_api.Well:
+        """
+        Returns the first tip a kind of pickup uses, or None to start at the first tip of its racks.
+
+        :param kind: "multi", "partial", "single" or "parked".
+        """
+        return {"multi": self.multi_starting_tip, "partial": None, "single": self.single.starting_tip, "parked": self.parked_starting_tip}[kind]
+
+    def used_tips(self, kind: str) -> list[int]:
+        """
+        Returns the number of tips a kind of pickup can no longer use in every column of its racks: the ones that have
+        been picked up, and the ones before its starting tip.
+
+        :param kind: "multi", "partial", "single" or "parked".
+        """
+        starting_tip = self.starting_tip(kind)
+        used = []
+        for rack in self.tip_racks[kind]:
+            wells = rack.wells()
+            skipped = wells.index(starting_tip) if starting_tip is not None and starting_tip.parent == rack else 0
+            for column in range(12):
+                used.append(sum(1 for i in range(8 * column, 8 * column + 8) if i < skipped or not wells[i].has_tip))
+        return used
+
+    def load_tip_racks(self, refills=True):
+        """
+        Loads more tip racks into the free slots for the kinds of pickups the planned steps need the most refills for,
+        until they need none or the slots run out, then announces how often the protocol will pause to have the used
+        racks replaced. Call this once every step has been planned, before any of them runs.
+
+        :param refills: Whether the protocol may pause to have the racks replaced. If not, a protocol that needs more
+            tips than the racks on the deck hold raises a ``ValueError`` straight away.
+        """
+        free_slots = [str(slot) for slot in range(1, 12) if self.protocol.deck[slot] is None]
+        if self.tip_racks["partial"]:
+            self.weigh_partial_pickups(free_slots)
+        # the parked tips are never replaced, so they get all the racks they need first
+        while len(fill_columns(self.used_tips("parked"), self.demand()["parked"])) > 12 * len(self.tip_racks["parked"]):
+            slots = self.rack_slots("parked", free_slots)
+            if slots:
+                free_slots.remove(slots[0])
+                self.tip_racks["parked"].append(self.protocol.load_labware(self.multi_tip_racks[0].load_name, slots[0]))
+                continue
+            # without a free slot, the last rack of new tips of the pipette with the most racks
+            kind = max(("multi", "single"), key=lambda kind: len(self.tip_racks[kind]))
+            if len(self.tip_racks[kind]) < 2:
+                # without a rack to spare, the parked tips share the racks of a pipette that won't run out of new tips
+                demand = self.demand()
+                # the columns of parked tips that don't fit in the parked racks, if there are any
+                overflow = len(fill_columns(self.used_tips("parked"), demand["parked"])) - 12 * len(self.tip_racks["parked"])
+                shared = [kind for kind in ("multi", "single") if len(fill_columns(self.used_tips(kind), demand[kind])) + overflow <= 12 * len(self.tip_racks[kind])]
+                if not shared or (self.tip_racks["parked"] and self.starting_tip(shared[0]) is not None):
+                    raise ValueError("The run parks more tips than the tip racks on the deck can spare. Turn off parked tips or select fewer samples.")
+                if not self.tip_racks["parked"]:
+                    self.parked_starting_tip = self.starting_tip(shared[0])
+                self.tip_racks["parked"] += self.tip_racks[shared[0]]
+                break
+            rack = self.tip_racks[kind].pop()
+            if self.starting_tip(kind) is not None and self.starting_tip(kind).parent == rack:
+                # the starting tip goes with the rack, and the racks that are left start at their first tip
+                self.parked_starting_tip = self.starting_tip(kind)
+                if kind == "multi":
+                    self.multi_starting_tip = None
+                    self.multi.starting_tip = None
+                else:
+                    self.single.starting_tip = None
+            self.tip_racks["parked"].append(rack)
+        loads, refills_needed = self.rack_plan(free_slots)
+        for kind, slot in loads:
+            self.tip_racks[kind].append(self.protocol.load_labware(self.multi_tip_racks[0].load_name, slot))
+        self.multi.tip_racks = self.multi_tip_racks
+        self.single.tip_racks = self.tip_racks["single"]
+        self.remaining = self.demand()
+        for kind, wells, labware, tips, parked in self.planned:
+            channels = 0 if kind == "single" else self.channels(wells, labware)
+            self.planned_kinds.setdefault(tuple(wells), []).append(pickup_kind(channels))
+        pauses = max(refills_needed.values(), default=0)
+        if pauses > 0:
+            if not refills:
+                raise ValueError("The run needs more tips than the tip racks on the deck hold. Allow tip refills or select fewer samples.")
+            self.protocol.comment("The run needs more tips than the tip racks on the deck hold, so it will pause about " + str(pauses) + " time(s) to have the used tip racks replaced.")
+
+    def weigh_partial_pickups(self, free_slots: list[str]):
+        """
+        Turns partial pickups off if they would make the run pause for more tip refills than leaving the partially filled
+        columns to the single-channel pipette. Partial pickups save passes, but no rack can go behind the labware they
+        visit, so they may leave free slots empty that would otherwise hold racks. Without them, the partial tip racks
+        go to the pipette they save the most refills for.
+
+        :param free_slots: The empty slots.
+        """
+        partial_racks = self.tip_racks["partial"]
+        with_partial = max(self.rack_plan(free_slots)[1].values(), default=0)
+        # channels() leaves the partially filled columns to the single-channel pipette without partial tip racks
+        self.tip_racks["partial"] = []
+        without_partial = {}
+        for kind in ("multi", "single"):
+            # changed in place, since the racks of the 8-channel pipette are also self.multi_tip_racks
+            self.tip_racks[kind].extend(partial_racks)
+            without_partial[kind] = max(self.rack_plan(free_slots)[1].values(), default=0)
+            del self.tip_racks[kind][-len(partial_racks):]
+        kind = min(without_partial, key=without_partial.get)
+        if without_partial[kind] < with_partial:
+            self.tip_racks[kind].extend(partial_racks)
+            self.protocol.comment("Partial tip pickups would need " + str(with_partial - without_partial[kind]) + " more tip refill(s), so the partially filled columns use the single-channel pipette.")
+            return
+        self.tip_racks["partial"] = partial_racks
+
+    def rack_plan(self, free_slots: list[str]) -> tuple[list[tuple[str, str]], dict[str, int]]:
+        """
+        Returns the tip racks to load into the free slots, as (kind of pickup, slot) pairs, for the kinds of pickups the
+        planned steps need the most refills for, until they need none or the slots run out, and how many refills every
+        kind of pickup still needs with those racks.
+
+        :param free_slots: The empty slots.
+        """
+        demand = self.demand()
+        free_slots = list(free_slots)
+        loads = []
+        while True:
+            refills_needed = {}
+            for kind in demand:
+                if demand[kind] and kind != "parked":
+                    racks = len(self.tip_racks[kind]) + sum(1 for load in loads if load[0] == kind)
+                    # a new rack adds 12 columns of unused tips
+                    used = self.used_tips(kind) + [0] * 12 * (racks - len(self.tip_racks[kind]))
+                    refills_needed[kind] = math.ceil(len(fill_columns(used, demand[kind])) / (12 * racks)) - 1
+            # worked out again after every rack, since a rack for partial pickups rules out the slot behind it for the others
+            slots = {kind: self.rack_slots(kind, free_slots, loads) for kind in refills_needed if refills_needed[kind] > 0}
+            # the kind that needs the most refills and has a slot its rack may go in; the others pause for refills
+            kind = max((kind for kind in slots if slots[kind]), key=refills_needed.get, default=None)
+            if kind is None:
+                return loads, refills_needed
+            free_slots.remove(slots[kind][0])
+            loads.append((kind, slots[kind][0]))
+
+    def rack_slots(self, kind: str, free_slots: list[str], loads=()) -> list[str]:
+        """
+        Returns the free slots a tip rack for a kind of pickup may go in. A rack is too tall for the nozzles without tips
+        to pass over, so no rack goes behind labware that partial pickups visit, and a rack for partial pickups only goes
+        where partial pickups have room to reach it.
+
+        :param kind: "multi", "partial", "single" or "parked".
+        :param free_slots: The empty slots.
+        :param loads: The (kind of pickup, slot) pairs of the racks that ``rack_plan()`` is about to load.
+        """
+        visited = {int(rack.parent) for rack in self.tip_racks["partial"]}
+        visited.update(int(slot) for load_kind, slot in loads if load_kind == "partial")
+        for planned_kind, wells, labware, tips, parked in self.planned:
+            if planned_kind != "single" and pickup_kind(self.channels(wells, labware)) == "partial":
+                visited.update(self.slot(lw) for lw in labware)
+        slots = [slot for slot in free_slots if int(slot) - 3 not in visited]
+        if kind == "partial":
+            bottom = self.tip_racks["partial"][0].wells()[0].bottom().point.z
+            return [slot for slot in slots if self.slot_has_room(int(slot), bottom)]
+        return slots
+
+    def ensure_tips(self, kind: str, pickups: list[int]):
+        """
+        Pauses the protocol to have the used tip racks replaced if the racks of a kind of pickup don't have enough tips
+        left for a step. The racks of the other kinds are replaced at the same time only if they don't have enough tips
+        left for the rest of the run either, so the pause saves a later one without throwing good tips away.
+
+        :param kind: "multi", "partial" or "single".
+        :param pickups: The number of tips in every pickup of the step.
+        """
+        for tips in pickups:
+            if tips in self.remaining[kind]:
+                self.remaining[kind].remove(tips)
+        used = self.used_tips(kind)
+        if len(fill_columns(used, pickups)) <= len(used):
+            return
+        short = [other for other in ("multi", "partial", "single") if other == kind or len(fill_columns(self.used_tips(other), self.remaining[other])) > len(self.used_tips(other))]
+        # the racks of parked tips stay, since the tips will be used again
+        racks = [rack for other in short for rack in self.tip_racks[other] if rack not in self.tip_racks["parked"]]
+        used_racks = [rack for i, rack in enumerate(racks) if rack not in racks[:i] and not all(well.has_tip for well in rack.wells())]
+        slots = ", ".join(str(rack.parent) for rack in used_racks)
+        self.protocol.pause("Out of tips. Replace the tip racks in slot(s) " + slots + " with full ones, then resume.")
+        for rack in used_racks:
+            rack.reset()
+        # the new racks are full, so start at their first tip
+        if "multi" in short:
+            self.multi_starting_tip = None
+            if self.multi.active_channels == 8:
+                self.multi.starting_tip = None
+        if "single" in short:
+            self.single.starting_tip = None
+
+def pickup_kind(channels: int) -> str:
+    """
+    Returns the kind of pickup ("multi", "partial" or "single") for a number of channels of the 8-channel pipette, with
+    0 for the single-channel pipette.
+
+    :param channels: The number of channels.
+    """
+    return "single" if channels == 0 else "multi" if channels == 8 else "partial"
+
+def visited_wells(wells: list[str], channels: int) -> list[str]:
+    """
+    Returns the wells of a group the pipette is sent to: row A for a full column, the front well of a partial run, and
+    every well for the single-channel pipette.
+
+    :param wells: A group of wells from ``PlateMap.column_plan()``.
+    :param channels: The number of channels of the 8-channel pipette, or 0 for the single-channel pipette.
+    """
+    if channels == 0:
+        return wells
+    return wells[:1] if channels == 8 else wells[-1:]
+
+def can_park(channels: int) -> bool:
+    """
+    Returns whether tips can be parked with a number of channels of the 8-channel pipette, or 0 for the single-channel
+    pipette. Tips can't be returned with a partial nozzle layout.
+
+    :param channels: The number of channels.
+    """
+    return channels in (0, 8)
+
+def new_parked_tips(visits: list[str], channels: int, parked: protocol_api.Labware, seen) -> list[str]:
+    """
+    Returns the wells a step needs new tips for because it uses parked tips: the wells that don't have a parked tip yet,
+    or every well if tips can't be parked with the number of channels.
+
+    :param visits: The wells the pipette is sent to.
+    :param channels: The number of channels of the 8-channel pipette, or 0 for the single-channel pipette.
+    :param parked: The sample plate whose parked tips the step uses, or None.
+    :param seen: The (channels, plate, well) keys of the tips that are already parked.
+    """
+    if parked is None:
+        return []
+    if not can_park(channels):
+        return visits
+    return [well for well in visits if (channels, parked, well) not in seen]
+
+def fill_columns(used: list[int], pickups: list[int]) -> list[int]:
+    """
+    Returns the number of used tips in every column of tip racks after a list of pickups, each taking its tips from the
+    first column that has enough left, with a new column added whenever none has.
+
+    :param used: The number of used tips in every column so far.
+    :param pickups: The number of tips in every pickup.
+    """
+    used = list(used)
+    for tips in pickups:
+        for column, count in enumerate(used):
+            if count + tips <= 8:
+                used[column] += tips
+                break
+        else:
+            used.append(tips)
+    return used
@@ -0,0 +1,68 @@
+"""
+Mixing for a length of time instead of a fixed number of strokes.
+
+The kits ask to "mix well" or to "mix for 20 minutes", not for a number of strokes, so the protocols give every mix a
+duration. ``mix_repetitions()`` works out how many strokes fit in it from the pipette's flow rates, and ``mix_for()``
+spreads them over a few heights between the bottom of the well and the top of the liquid, clamped to the depth of the
+well, with a single ``mix()`` per height.
+
+When a kit asks to mix for a number of minutes, that is how long every sample has to incubate, so the protocols mix each
+group of wells for ``MIX_WELL_SECONDS`` and have the next step wait out the rest of the time in the ``StepScheduler``,
+counted from when that group was mixed, instead of splitting the time between the groups.
+
+This file is inlined into the protocols by ``tools/bundle.py``; edit it here and re-run the bundler.
+"""
+import math
+
+from opentrons import protocol_api
+
+# how long to mix a group of wells when a kit just says "mix well", in seconds
+MIX_WELL_SECONDS = 60
+# the lowest height to mix at, and how far to stay below the top of the liquid or of the well, in mm
+MIX_CLEARANCE = 1
+
+def mix_repetitions(pipette: protocol_api.InstrumentContext, volume: float, seconds: float) -> int:
+    """
+    Returns how many times the pipette can aspirate and dispense a volume in about the given time, at least once.
+
+    :param pipette: The pipette to mix with, at its current flow rates.
+    :param volume: The volume to aspirate and dispense, in µl.
+    :param seconds: How long to mix for.
+    """
+    stroke = volume / pipette.flow_rate.aspirate + volume / pipette.flow_rate.dispense
+    return max(1, round(seconds / stroke))
+
+def liquid_height(well: protocol_api.Well, volume: float) -> float:
+    """
+    Returns the height of a volume of liquid in a well, in mm, assuming straight walls, but at most the depth of the well.
+
+    :param well: The well.
+    :param volume: The volume of liquid in the well, in µl.
+    """
+    if well.diameter is not None:
+        area = math.pi * (well.diameter / 2) ** 2
+    else:
+        area = well.length * well.width
+    return min(well.depth, volume / area)
+
+def mix_for(pipette: protocol_api.InstrumentContext, well: protocol_api.Well, volume: float, seconds: float, liquid_volume: float, levels=3):
+    """
+    Mixes the liquid in a well by aspirating and dispensing for about the given time, moving from the bottom of the
+    well towards the top of the liquid so that beads that have settled at the bottom are mixed in too. The pipette
+    must already have a tip.
+
+    :param pipette: The pipette to mix with.
+    :param well: The well to mix in.
+    :param volume: The volume to aspirate and dispense, in µl.
+    :param seconds: How long to mix for.
+    :param liquid_volume: The volume of liquid in the well, in µl, which decides the highest height to mix at.
+    :param levels: The number of heights to mix at.
+    """
+    repetitions = mix_repetitions(pipette, volume, seconds)
+    levels = min(levels, repetitions)
+    top = max(MIX_CLEARANCE, liquid_height(well, liquid_volume) - MIX_CLEARANCE)
+    for level in range(levels):
+        height = MIX_CLEARANCE + (top - MIX_CLEARANCE) * level / max(1, levels - 1)
+        # spread the repetitions as evenly as possible, with any extra ones at the bottom
+        count = repetitions // levels + (1 if level < repetitions % levels else 0)
+        pipette.mix(repetitions=count, volume=volume, location=well.bottom(z=height))
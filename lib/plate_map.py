@@ -0,0 +1,193 @@
+"""
+Parsing of 96-well plate maps.
+
+A plate map is the grid users copy from a spreadsheet: a header row with the column numbers 1-12, then one row per plate
+row A-H. A cell is either a boolean (``TRUE``/``FALSE``), a number (e.g. a volume), or blank.
+
+This file is inlined into the protocols by ``tools/bundle.py``; edit it here and re-run the bundler.
+"""
+from array import array
+
+PLATE_ROWS = "ABCDEFGH"
+PLATE_COLS = 12
+
+def well_index(well: str) -> int:
+    """
+    Returns the index of a well in column order (A1, B1, ..., H1, A2, ...), the same order as ``Labware.wells()``.
+
+    :param well: The name of the well, e.g. ``"B3"``.
+    """
+    return (int(well[1:]) - 1) * 8 + PLATE_ROWS.index(well[0].upper())
+
+def well_name(index: int) -> str:
+    """
+    Returns the name of the well at the given column-order index.
+
+    :param index: The index of the well, from 0 (A1) to 95 (H12).
+    """
+    return PLATE_ROWS[index % 8] + str(index // 8 + 1)
+
+def serpentine(wells: list[str]) -> list[str]:
+    """
+    Returns wells in an order with little travel between them: row by row, every row in the opposite direction of the
+    one before, so the pipette moves on to the nearest well of the next row instead of going back to column 1.
+
+    :param wells: The names of the wells, in any order.
+    """
+    rows = {}
+    for well in sorted(wells, key=lambda well: int(well[1:])):
+        rows.setdefault(PLATE_ROWS.index(well[0].upper()), []).append(well)
+    ordered = []
+    for i, row in enumerate(sorted(rows)):
+        ordered += rows[row] if i % 2 == 0 else rows[row][::-1]
+    return ordered
+
+class PlateMap:
+    """
+    A parsed 96-well plate map.
+
+    The occupied wells are stored as a 96-bit mask with bit ``col * 8 + row`` set for every occupied well, so every
+    column is one byte of the mask and can be queried in constant time. The value of every well (1.0 for ``TRUE``, or
+    the number in the cell) is stored in a float array indexed the same way.
+    """
+
+    def __init__(self, mask=0, values=None):
+        """
+        :param mask: The occupancy mask.
+        :param values: A float array of 96 well values, in column order.
+        """
+        self.mask = mask
+        self.values = values if values is not None else array("d", [0.0] * (8 * PLATE_COLS))
+
+    @classmethod
+    def parse(cls, data: str) -> "PlateMap":
+        """
+        Parses a single plate map grid.
+
+        :param data: The grid, comma- or tab-separated, as pasted into a protocol or uploaded as a CSV file.
+        """
+        maps = cls.parse_all(data)
+        if len(maps) != 1:
+            raise ValueError("Expected one plate map, found " + str(len(maps)) + ".")
+        return maps[0]
+
+    @classmethod
+    def parse_all(cls, data: str) -> list["PlateMap"]:
+        """
+        Parses one or more plate map grids that follow each other, each starting with its own header row.
+
+        :param data: The grids, comma- or tab-separated.
+        """
+        maps = []
+        header = None
+        for line in data.lstrip("\ufeff").replace("\t", ",").splitlines():
+            cells = [cell.strip() for cell in line.split(",")]
+            if all(cell == "" for cell in cells):
+                continue
+            if cells[0] == "":
+                # a header row starts a new grid; remember which column every cell belongs to
+                header = [int(cell) - 1 if cell != "" else None for cell in cells[1:]]
+                maps.append(cls())
+                continue
+            if header is None:
+                raise ValueError("The plate map must start with a header row of column numbers.")
+            row = PLATE_ROWS.find(cells[0].upper())
+            if row < 0 or len(cells[0]) != 1:
+                raise ValueError("Unknown plate row " + repr(cells[0]) + ".")
+            plate_map = maps[-1]
+            for col, cell in zip(header, cells[1:]):
+                if col is None or cell == "" or cell.upper() == "FALSE":
+                    continue
+                index = col * 8 + row
+                plate_map.mask |= 1 << index
+                plate_map.values[index] = 1.0 if cell.upper() == "TRUE" else float(cell)
+        return maps
+
+    def __len__(self) -> int:
+        return bin(self.mask).count("1")
+
+    def __contains__(self, well: str) -> bool:
+        return (self.mask >> well_index(well)) & 1 == 1
+
+    def __getitem__(self, well: str) -> float:
+        return self.values[well_index(well)]
+
+    def column_mask(self, col: int) -> int:
+        """
+        Returns the occupancy of a column as an 8-bit mask, with bit 0 for row A and bit 7 for row H.
+
+        :param col: The column index, from 0 to 11.
+        """
+        return (self.mask >> (col * 8)) & 0xFF
+
+    def column_count(self, col: int) -> int:
+        """
+        Returns the number of occupied wells in a column.
+
+        :param col: The column index, from 0 to 11.
+        """
+        return bin(self.column_mask(col)).count("1")
+
+    def is_full(self, col: int) -> bool:
+        """
+        Returns whether every well of a column is occupied.
+
+        :param col: The column index, from 0 to 11.
+        """
+        return self.column_mask(col) == 0xFF
+
+    def occupied_columns(self) -> list[int]:
+        """Returns the indexes of the columns with at least one occupied well."""
+        return [col for col in range(PLATE_COLS) if self.column_mask(col) != 0]
+
+    def full_columns(self) -> list[int]:
+        """Returns the indexes of the columns in which every well is occupied."""
+        return [col for col in range(PLATE_COLS) if self.column_mask(col) == 0xFF]
+
+    def partial_columns(self) -> list[int]:
+        """Returns the indexes of the columns in which some, but not all, wells are occupied."""
+        return [col for col in range(PLATE_COLS) if 0 < self.column_mask(col) < 0xFF]
+
+    def num_columns(self) -> int:
+        """Returns the number of columns up to and including the last occupied one."""
+        return (self.mask.bit_length() + 7) // 8
+
+    def column_wells(self, col: int) -> list[str]:
+        """
+        Returns the names of the occupied wells of a column, from row A to row H.
+
+        :param col: The column index, from 0 to 11.
+        """
+        col_mask = self.column_mask(col)
+        return [PLATE_ROWS[row] + str(col + 1) for row in range(8) if (col_mask >> row) & 1]
+
+    def wells(self, order="column") -> list[str]:
+        """
+        Returns the names of all occupied wells.
+
+        :param order: ``"column"`` (A1, B1, ..., H1, A2, ...) or ``"row"`` (A1, A2, ..., A12, B1, ...).
+        """
+        if order == "row":
+            indexes = [col * 8 + row for row in range(8) for col in range(PLATE_COLS)]
+        else:
+            indexes = range(8 * PLATE_COLS)
+        return [well_name(i) for i in indexes if (self.mask >> i) & 1]
+
+    def column_plan(self) -> list[tuple[int, list[str]]]:
+        """
+        Splits the occupied wells into groups that can each be pipetted in one go by an 8-channel pipette: every full
+        column, and every run of neighbouring occupied wells in a partially filled column. Empty columns are skipped.
+
+        :return: A list of (column index, wells) tuples, in column order, with the wells of each group from back to
+            front.
+        """
+        plan = []
+        for col in self.occupied_columns():
+            wells = []
+            for well in self.column_wells(col):
+                if wells and PLATE_ROWS.index(well[0]) != PLATE_ROWS.index(wells[-1][0]) + 1:
+                    plan.append((col, wells))
+                    wells = []
+                wells.append(well)
+            plan.append((col, wells))
+        return plan
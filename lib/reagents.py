@@ -0,0 +1,185 @@
+"""
+Planning how much of every reagent to load, and where.
+
+Instead of loading fixed volumes into fixed reservoir wells, the purification protocols tell a ``ReagentPlanner``
+which wells each reagent may go in. Every time a step adds a reagent to a group of samples, the planner draws the
+volume from the reagent's current well, one trip of the pipette at a time, and moves on to the next free well once the
+current one can't cover a trip, so a group's draw can be split between two wells. Once all steps are known,
+``load_liquids()`` loads exactly the volume drawn from every well, plus the volume that can't be aspirated from it, so
+the Opentrons app shows how much to pour where.
+
+A run that needs more of a reagent than its free wells hold keeps drawing from the wells it already has. Those are
+loaded as full as they go, and while the protocol runs, ``take()`` keeps track of what is left in every well and
+pauses to have the wells that are running low refilled, all at once, before a step would run one of them dry.
+
+This file is inlined into the protocols by ``tools/bundle.py``; edit it here and re-run the bundler.
+"""
+import math
+
+from opentrons import protocol_api
+
+from lib.well_volumes import split_volume
+
+# the volume that can't be aspirated from a well of these labware, in µl (about 2 mm of liquid in a reservoir)
+DEAD_VOLUMES = {
+    "nest_12_reservoir_15ml": 1200,
+    "nest_1_reservoir_195ml": 15000,
+    "opentrons_24_tuberack_eppendorf_1.5ml_safelock_snapcap": 50,
+}
+# the share of a well's volume that can't be aspirated from it, for other labware
+DEAD_VOLUME_SHARE = 0.1
+
+def dead_volume(well: protocol_api.Well) -> float:
+    """
+    Returns the volume that can't be aspirated from a well, in µl.
+
+    :param well: The well.
+    """
+    return DEAD_VOLUMES.get(well.parent.load_name, well.max_volume * DEAD_VOLUME_SHARE)
+
+def usable_volume(well: protocol_api.Well) -> float:
+    """
+    Returns the most that can be aspirated from a well when it is full, in µl.
+
+    :param well: The well.
+    """
+    return well.max_volume - dead_volume(well)
+
+class ReagentPlanner:
+    """
+    Assigns the reagents of a protocol to reservoir wells, works out how much to load into each, and pauses to have them
+    refilled when a run needs more than they hold.
+    """
+
+    def __init__(self, protocol: protocol_api.ProtocolContext):
+        """
+        :param protocol: The protocol context, used to pause for refills.
+        """
+        self.protocol = protocol
+        # liquid -> the wells it may be loaded into, in the order to use them
+        self.wells = {}
+        # liquid -> the wells in use, with the volume drawn from each over the whole run so far, in order
+        self.drawn = {}
+        # the wells that have been given to a reagent
+        self.taken = []
+        # well -> the volume that can still be aspirated from it, and the volume the steps that haven't run yet will
+        # draw from it, while the protocol runs
+        self.left = {}
+        self.pending = {}
+
+    def add(self, liquid: protocol_api.Liquid, wells: list[protocol_api.Well]):
+        """
+        Adds a reagent. Several reagents can share the same list of wells; each well goes to the first reagent that
+        needs it, but every reagent that may use a list keeps at least one well of it.
+
+        :param liquid: The reagent, from ``protocol.define_liquid()``.
+        :param wells: The wells the reagent may be loaded into, in the order to use them.
+        """
+        self.wells[liquid] = wells
+        self.drawn[liquid] = []
+
+    def free_wells(self, liquid: protocol_api.Liquid) -> list[protocol_api.Well]:
+        """
+        Returns the wells a reagent may take: the ones nobody has taken yet, apart from one for every other reagent
+        that may use them and has none yet.
+
+        :param liquid: The reagent.
+        """
+        free = [well for well in self.wells[liquid] if well not in self.taken]
+        waiting = [
+            other for other, wells in self.wells.items()
+            if other != liquid and not self.drawn[other] and any(well in free for well in wells)
+        ]
+        # a reagent without a well may always take one
+        return free[:max(0 if self.drawn[liquid] else 1, len(free) - len(waiting))]
+
+    def draw(self, liquid: protocol_api.Liquid, volume: float, wells: list[str]) -> protocol_api.Well:
+        """
+        Returns the well to aspirate a reagent from for one trip of the pipette to a group of samples, and records the
+        volume drawn from it.
+
+        :param liquid: The reagent.
+        :param volume: The volume added to each sample in the trip, in µl.
+        :param wells: The names of the sample wells in the group.
+        """
+        needed = volume * len(wells)
+        drawn = self.drawn[liquid]
+        if drawn and drawn[-1][1] + needed <= usable_volume(drawn[-1][0]):
+            drawn[-1][1] += needed
+            return drawn[-1][0]
+        for well in self.free_wells(liquid):
+            if needed <= usable_volume(well):
+                self.taken.append(well)
+                drawn.append([well, needed])
+                return well
+        # no free well is left, so the reagent's wells are refilled while the protocol runs, the emptiest first
+        candidates = [entry for entry in drawn if needed <= usable_volume(entry[0])]
+        if not candidates:
+            raise ValueError("There is no reservoir well large enough for a single trip of " + liquid.name + ".")
+        entry = min(candidates, key=lambda entry: entry[1] / usable_volume(entry[0]))
+        entry[1] += needed
+        # later trips go on drawing from the same well
+        drawn.remove(entry)
+        drawn.append(entry)
+        return entry[0]
+
+    def draw_trips(self, liquid: protocol_api.Liquid, volume: float, wells: list[str], max_volume: float) -> list[protocol_api.Well]:
+        """
+        Returns the wells to aspirate a reagent from for a group of samples, one for each trip of the pipette from
+        ``split_volume()``, and records the volumes drawn from them.
+
+        :param liquid: The reagent.
+        :param volume: The volume added to each sample, in µl.
+        :param wells: The names of the sample wells in the group.
+        :param max_volume: The largest volume the tip holds, in µl.
+        """
+        return [self.draw(liquid, part, wells) for part in split_volume(volume, max_volume)]
+
+    def load_liquids(self):
+        """
+        Loads every reagent into the wells it was assigned, with the volume drawn from each well (or as much as the
+        well holds) and its dead volume, and announces how often the protocol will pause for refills.
+        """
+        refills = 0
+        for liquid, drawn in self.drawn.items():
+            for well, volume in drawn:
+                load = min(volume, usable_volume(well))
+                well.parent.load_liquid(wells=[well], volume=load + dead_volume(well), liquid=liquid)
+                self.left[well] = load
+                self.pending[well] = volume
+                refills = max(refills, math.ceil(volume / usable_volume(well)) - 1)
+        if refills > 0:
+            self.protocol.comment("The run needs more reagents than the reservoirs hold, so it will pause about " + str(refills) + " time(s) to have them refilled.")
+
+    def take(self, wells: list[protocol_api.Well], volume: float):
+        """
+        Records that a step draws a volume from each of a list of wells, like the ones from ``draw_trips()``, pausing
+        the protocol first to have the wells that are running low refilled if one of them doesn't have enough left.
+        Call this when the step runs, before it picks up a tip.
+
+        :param wells: The wells the step aspirates from, once for every trip.
+        :param volume: The volume drawn from a well in every trip, in µl (the volume of a trip times the number of
+            samples in the group).
+        """
+        needed = {}
+        for well in wells:
+            needed[well] = needed.get(well, 0.0) + volume
+        if any(needed[well] > self.left[well] + 1e-6 for well in needed):
+            self.refill()
+        for well in needed:
+            self.left[well] -= needed[well]
+            self.pending[well] -= needed[well]
+
+    def refill(self):
+        """
+        Pauses the protocol to have every reagent well that won't cover the draws still to come topped up, as far as
+        those draws need and the well holds.
+        """
+        names = {well: liquid.name for liquid, drawn in self.drawn.items() for well, volume in drawn}
+        refills = []
+        for well in self.left:
+            volume = min(self.pending[well], usable_volume(well)) - self.left[well]
+            if self.left[well] < self.pending[well] - 1e-6 and volume > 0:
+                refills.append(str(round(volume)) + " µL of " + names[well] + " to " + well.well_name + " in slot " + str(well.parent.parent))
+                self.left[well] += volume
+        self.protocol.pause("The reagents are running low. Add " + ", ".join(refills) + ", then resume.")
@@ -0,0 +1,77 @@
+"""
+Rehearsals of the purification protocols.
+
+Before a real run, the deck layout, the tips and the labware moves can be checked on the robot with a rehearsal: the
+protocol makes every move it would make, but every wait takes a second for every minute and every mix is a single
+stroke, so a run that takes hours is over in minutes. Optionally, the pipettes also stay at the top of the wells
+instead of going down into the liquid, so the rehearsal can be run with empty or reused labware.
+
+This file is inlined into the protocols by ``tools/bundle.py``; edit it here and re-run the bundler.
+"""
+from opentrons import protocol_api
+
+from lib.mixing import mix_for
+
+# how much of every wait is waited in a rehearsal: a second for every minute
+REHEARSAL_TIME_SCALE = 1 / 60
+
+class Rehearsal:
+    """
+    What a rehearsal changes about a run. Outside of a rehearsal, everything is left as it is.
+    """
+
+    def __init__(self, enabled: bool, above_liquid=False):
+        """
+        :param enabled: Whether the run is a rehearsal.
+        :param above_liquid: Whether to aspirate and mix at the top of the wells in a rehearsal.
+        """
+        self.enabled = enabled
+        self.above_liquid = enabled and above_liquid
+
+    @property
+    def time_scale(self) -> float:
+        """How much of every wait to wait, for ``StepScheduler``."""
+        return REHEARSAL_TIME_SCALE if self.enabled else 1.0
+
+    def mix_seconds(self, seconds: float) -> float:
+        """
+        Returns how long to mix for, which in a rehearsal is no time at all, so ``mix_repetitions()`` gives a single
+        stroke.
+
+        :param seconds: How long to mix for in a run.
+        """
+        return 0.0 if self.enabled else seconds
+
+    def repetitions(self, repetitions: int) -> int:
+        """
+        Returns how many times to mix, which in a rehearsal is once.
+
+        :param repetitions: How many times to mix in a run.
+        """
+        return 1 if self.enabled else repetitions
+
+    def location(self, location):
+        """
+        Returns where to aspirate or mix: the given location, or the top of its well in a rehearsal above the liquid.
+
+        :param location: A well, or a location in a well.
+        """
+        if not self.above_liquid:
+            return location
+        well = location if isinstance(location, protocol_api.Well) else location.labware.as_well()
+        return well.top()
+
+    def mix_for(self, pipette: protocol_api.InstrumentContext, well: protocol_api.Well, volume: float, seconds: float, liquid_volume: float):
+        """
+        Mixes like ``mix_for()``, which in a rehearsal is a single stroke.
+
+        :param pipette: The pipette to mix with.
+        :param well: The well to mix in.
+        :param volume: The volume to aspirate and dispense, in µl.
+        :param seconds: How long to mix for in a run.
+        :param liquid_volume: The volume of liquid in the well, in µl.
+        """
+        if self.above_liquid:
+            pipette.mix(repetitions=1, volume=volume, location=well.top())
+        else:
+            mix_for(pipette, well, volume, self.mix_seconds(seconds), liquid_volume)
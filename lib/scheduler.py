@@ -0,0 +1,143 @@
+"""
+Running protocol steps out of order to fill the waits between them.
+
+Instead of pipetting step after step and calling ``protocol.delay()`` whenever the beads need time to pellet or dry,
+a protocol adds its steps to a ``StepScheduler``. Every step names the things it uses (usually the wells of the sample
+plate it touches) and how long those have to rest after the previous step that used them. Steps that share anything
+always run in the order they were added, but while a step is waiting, other steps that don't share anything with it
+go ahead, and the scheduler only calls ``protocol.delay()`` for whatever wait is left.
+
+A protocol with several independent workflows (like the DNA and RNA halves of DNA/RNA Purification) can add them one
+after the other: steps on different plates don't share any wells, so the scheduler interleaves them by itself. When
+more than one step could run, it picks the one with the most waiting still ahead of it, so that long waits start early
+and the other workflows can fill them. Things that only one workflow can have at a time, like the magnetic block, are
+claimed by one step and freed by a later one. If steps are left that wait for a claim no step frees, ``run()`` stops
+with an error that names the claim and the steps waiting for it.
+
+Which step runs next is decided with the scheduler's own clock, which only counts the estimated duration of every step
+and the waits between them. It doesn't depend on how fast the computer running the protocol is, so the steps run in the
+same order when the protocol is analysed as on the robot, and the tips, reagents and waste planned in the order the
+steps were added are used as planned. On the robot, how long to wait is measured with the robot's own clock, so only the
+time that's actually left is waited, even if a step took longer or shorter than estimated. While the protocol is
+simulated or analysed, pipetting takes no time and delays are skipped, so the waits are measured with the scheduler's
+clock instead, and the analysis shows the delays the estimates leave.
+
+This file is inlined into the protocols by ``tools/bundle.py``; edit it here and re-run the bundler.
+"""
+import time
+
+from opentrons import protocol_api
+
+# how long a step takes when it doesn't give an estimate of its own, in seconds: about a tip pickup, a few trips to the
+# wells and a tip drop
+STEP_SECONDS = 30.0
+
+class StepScheduler:
+    """
+    Collects the steps of a protocol and runs them as early as their waits allow.
+    """
+
+    def __init__(self, protocol: protocol_api.ProtocolContext, time_scale=1.0):
+        """
+        :param protocol: The protocol context, used for the delays.
+        :param time_scale: How much of every wait to actually wait, e.g. a second for every minute in a rehearsal (see
+            ``Rehearsal``).
+        """
+        self.protocol = protocol
+        self.time_scale = time_scale
+        # the steps still to run, as (action, uses, wait, claims, frees, duration) tuples, in the order they were added
+        self.steps = []
+        # when the last step that used each thing finished, on the scheduler's clock
+        self.finished = {}
+        # when the last step that used each thing finished, on the clock of now()
+        self.finished_at = {}
+        # the time on the scheduler's clock: the estimated durations of the steps run so far and the waits between them
+        self.clock = 0.0
+        # the things that have been claimed and not freed yet
+        self.claimed = set()
+
+    def add(self, action, uses, wait=0.0, claims=(), frees=(), duration=STEP_SECONDS):
+        """
+        Adds a step. Steps that share anything they use always run in the order they were added.
+
+        :param action: A function without arguments that performs the step.
+        :param uses: The things the step uses, e.g. the wells it pipettes to or from. Anything hashable works.
+        :param wait: The time the things the step uses have to rest after the previous step that used them, before
+            this step can start, in seconds.
+        :param claims: Things that only one workflow can have at a time, e.g. the magnetic block, which the step takes
+            until a later step frees them. The step can't start while another step has them.
+        :param frees: Things claimed by an earlier step that are free again once this step is done.
+        :param duration: About how long the step takes, in seconds, which decides the order the steps run in. It doesn't
+            have to be exact, since the waits themselves are measured.
+        """
+        self.steps.append((action, frozenset(uses), wait, frozenset(claims), frozenset(frees), duration))
+
+    def now(self) -> float:
+        """
+        Returns the current time, in seconds: the robot's clock, or the scheduler's clock while the protocol is
+        simulated or analysed.
+        """
+        return self.clock if self.protocol.is_simulating() else time.monotonic()
+
+    def ready_at(self, finished: dict, uses: frozenset, wait: float) -> float:
+        """
+        Returns the time at which a step can start.
+
+        :param finished: When the last step that used each thing finished, on the clock to give the time on
+            (``self.finished`` or ``self.finished_at``).
+        :param uses: The things the step uses.
+        :param wait: The time the things the step uses have to rest.
+        """
+        return max((finished[thing] + wait * self.time_scale for thing in uses if thing in finished), default=0.0)
+
+    def waiting_ahead(self) -> list[float]:
+        """
+        Returns, for every step still to run, how long it and the later steps that use the same things have to wait.
+        """
+        return [
+            step[2] + sum(later[2] for later in self.steps[i + 1:] if not step[1].isdisjoint(later[1]))
+            for i, step in enumerate(self.steps)
+        ]
+
+    def run(self):
+        """
+        Runs every step that has been added, waiting with ``protocol.delay()`` only when no step is ready.
+        """
+        ahead = self.waiting_ahead()
+        while self.steps:
+            blocked = set()
+            chosen = None
+            for i, (action, uses, wait, claims, frees, duration) in enumerate(self.steps):
+                if blocked.isdisjoint(uses) and self.claimed.isdisjoint(claims):
+                    # of the steps that are ready now, run the one with the most waiting ahead of it; if none is
+                    # ready, run the one that is ready first
+                    ready = self.ready_at(self.finished, uses, wait)
+                    rank = (0, -ahead[i]) if ready <= self.clock else (1, ready, -ahead[i])
+                    if chosen is None or rank < chosen[0]:
+                        chosen = (rank, i)
+                blocked.update(uses)
+            if chosen is None:
+                raise RuntimeError(self.deadlock())
+            action, uses, wait, claims, frees, duration = self.steps.pop(chosen[1])
+            ahead.pop(chosen[1])
+            remaining = round(self.ready_at(self.finished_at, uses, wait) - self.now())
+            if remaining > 0:
+                self.protocol.delay(seconds=remaining)
+            self.clock = max(self.clock, self.ready_at(self.finished, uses, wait)) + duration
+            self.claimed.update(claims)
+            action()
+            self.claimed.difference_update(frees)
+            done = self.now()
+            for thing in uses:
+                self.finished[thing] = self.clock
+                self.finished_at[thing] = done
+
+    def deadlock(self) -> str:
+        """
+        Returns the error message for when no step can run: every step left either claims something that a step that
+        has already run claimed and no step freed, or uses something such a step uses.
+        """
+        waiting = [getattr(action, "__qualname__", repr(action)).replace(".<locals>", "") for action, uses, wait, claims, frees, duration in self.steps if not self.claimed.isdisjoint(claims)]
+        return ("No step can run, because " + ", ".join(sorted(map(str, self.claimed))) + " is still claimed and no step "
+                + "frees it. Waiting for it: " + ", ".join(waiting) + ", and " + str(len(self.steps) - len(waiting))
+                + " step(s) after them.")
@@ -0,0 +1,160 @@
+"""
+Transfer plans worked out ahead of a run.
+
+A transfer plan lists every transfer a protocol makes, as plain JSON, so it can be compiled off the robot from the plate
+maps by ``tools/compile_plan.py``, pasted into the protocol, diffed between batches and kept with the run records. The
+protocol then only replays it. A plan looks like::
+
+    {
+        "format": 1,
+        "protocol": "pooling",
+        "labware": {"tube_rack": "opentrons_24_tuberack_eppendorf_1.5ml_safelock_snapcap", ...},
+        "pipettes": {"left": "p20_single_gen2"},
+        "wells": ["A2", "A4", ...],
+        "steps": [
+            {"pipette": "left", "source": "dna_plate", "dest": "tube_rack", "sources": ["A2", "A4", ...],
+             "dests": ["A2", "A2", ...], "volumes": [1, 1, ...], "new_tip": "always"},
+            ...
+        ]
+    }
+
+Every step is one ``transfer()`` of ``volumes[i]`` from well ``sources[i]`` of the labware ``source`` to well ``dests[i]``
+of the labware ``dest``, blowing out into the destination well. A step with a ``disposal_volume`` is a multi-dispense
+run instead: a ``distribute()`` from a single source well that aspirates for as many destination wells at once as fit in
+the tip, plus the disposal volume, which is blown out back into the source; every volume of such a step has to fit in
+the tip together with the disposal volume. The steps of a multi-channel pipette name the well of its first channel,
+e.g. ``"A3"`` for column 3. ``labware`` and ``pipettes`` give the load names the plan was compiled for, and ``wells``
+the sample wells of the plate map, which the protocol uses to load its liquids.
+A plan can also have ``notes``, e.g. about samples that can't be normalized to the target, which the protocol shows as
+comments in the run log.
+
+This file is inlined into the protocols by ``tools/bundle.py``; edit it here and re-run the bundler.
+"""
+import json
+import math
+import re
+
+# the version of the plan format, changed whenever old plans can no longer be replayed
+PLAN_FORMAT = 1
+WELL_NAME = re.compile(r"[A-P]([1-9]|1[0-9]|2[0-4])")
+NEW_TIP = ("once", "always", "never")
+# the largest volume of one aspiration, in µl
+PIPETTE_MAX_VOLUMES = {
+    "p20_single_gen2": 20,
+    "p20_multi_gen2": 20,
+    "p300_single_gen2": 300,
+    "p300_multi_gen2": 300,
+    "p1000_single_gen2": 1000,
+}
+
+def check_plan(plan: dict, protocol_name: str):
+    """
+    Raises a ValueError if a plan is malformed or was compiled for another protocol.
+
+    :param plan: The plan.
+    :param protocol_name: The name of the protocol that replays it, e.g. ``"pooling"``.
+    """
+    if not isinstance(plan, dict) or plan.get("format") != PLAN_FORMAT:
+        raise ValueError("The transfer plan is not in format " + str(PLAN_FORMAT) + "; compile it again with tools/compile_plan.py.")
+    if plan.get("protocol") != protocol_name:
+        raise ValueError("The transfer plan was compiled for " + repr(plan.get("protocol")) + ", not " + repr(protocol_name) + ".")
+    for key in ("labware", "pipettes"):
+        if not isinstance(plan.get(key), dict):
+            raise ValueError("The transfer plan has no " + key + ".")
+    if not isinstance(plan.get("wells"), list) or not all(isinstance(well, str) and WELL_NAME.fullmatch(well) for well in plan["wells"]):
+        raise ValueError("The wells of the transfer plan must be a list of well names.")
+    if not isinstance(plan.get("notes", []), list) or not all(isinstance(note, str) for note in plan.get("notes", [])):
+        raise ValueError("The notes of the transfer plan must be a list of strings.")
+    if not isinstance(plan.get("steps"), list):
+        raise ValueError("The transfer plan has no steps.")
+    for number, step in enumerate(plan["steps"], 1):
+        where = "Step " + str(number) + " of the transfer plan"
+        if step.get("pipette") not in plan["pipettes"]:
+            raise ValueError(where + " uses an unknown pipette " + repr(step.get("pipette")) + ".")
+        if step.get("source") not in plan["labware"] or step.get("dest") not in plan["labware"]:
+            raise ValueError(where + " uses unknown labware.")
+        if step.get("new_tip") not in NEW_TIP:
+            raise ValueError(where + " has an unknown new_tip " + repr(step.get("new_tip")) + ".")
+        sources, dests, volumes = step.get("sources"), step.get("dests"), step.get("volumes")
+        if not isinstance(sources, list) or not sources or not isinstance(dests, list) or not isinstance(volumes, list) or not len(sources) == len(dests) == len(volumes):
+            raise ValueError(where + " must have as many sources, destinations and volumes, and at least one of each.")
+        for well in sources + dests:
+            if not isinstance(well, str) or not WELL_NAME.fullmatch(well):
+                raise ValueError(where + " has an unknown well " + repr(well) + ".")
+        for volume in volumes + [step.get("disposal_volume", 0)]:
+            if isinstance(volume, bool) or not isinstance(volume, (int, float)) or volume < 0:
+                raise ValueError(where + " has an invalid volume " + repr(volume) + ".")
+        if "disposal_volume" in step and len(set(sources)) != 1:
+            raise ValueError(where + " is a multi-dispense run, so it must have a single source well.")
+        # every aspiration of a multi-dispense run takes the disposal volume on top of the volume of at least one well
+        max_volume = PIPETTE_MAX_VOLUMES.get(plan["pipettes"][step["pipette"]])
+        if "disposal_volume" in step and max_volume is not None and max(volumes) + step["disposal_volume"] > max_volume:
+            raise ValueError(where + " dispenses up to " + str(max(volumes)) + " µl with a disposal volume of " + str(step["disposal_volume"]) + " µl, more than the " + str(max_volume) + " µl the pipette aspirates at once.")
+
+def load_plan(data: str, protocol_name: str) -> dict:
+    """
+    Parses and checks a plan.
+
+    :param data: The plan as JSON.
+    :param protocol_name: The name of the protocol that replays it, e.g. ``"pooling"``.
+    """
+    plan = json.loads(data)
+    check_plan(plan, protocol_name)
+    return plan
+
+def tips_used(step: dict, max_volume: float) -> int:
+    """
+    Returns the number of times a step of a plan picks up a tip, or a column of tips for a multi-channel pipette.
+
+    :param step: The step.
+    :param max_volume: The largest volume the pipette aspirates at once, in µl.
+    """
+    if step["new_tip"] == "once":
+        return 1
+    if step["new_tip"] == "never":
+        return 0
+    # a volume larger than the pipette holds is split into several aspirations, each with its own tip
+    return sum(max(1, math.ceil(volume / max_volume)) for volume in step["volumes"])
+
+def run_plan(plan: dict, pipettes: dict, labware: dict):
+    """
+    Makes the transfers of a plan.
+
+    :param plan: The plan, from ``load_plan()`` or the protocol's ``make_plan()``.
+    :param pipettes: The pipettes named in the plan, by name.
+    :param labware: The labware named in the plan, by name.
+    """
+    # a plan compiled for other labware or pipettes would still replay, but to the wrong heights and volumes
+    for name, load_name in plan["labware"].items():
+        if name not in labware:
+            raise ValueError("The transfer plan uses labware " + repr(name) + ", which the protocol doesn't load; compile it again with tools/compile_plan.py.")
+        if labware[name].load_name != load_name:
+            raise ValueError("The transfer plan expects " + load_name + " as " + name + ", but the protocol loads " + labware[name].load_name + ".")
+    for name, pipette_name in plan["pipettes"].items():
+        if name not in pipettes:
+            raise ValueError("The transfer plan uses a pipette on the " + name + " mount, which the protocol doesn't load.")
+        if pipettes[name].name != pipette_name:
+            raise ValueError("The transfer plan expects " + pipette_name + " as " + name + ", but the protocol loads " + pipettes[name].name + ".")
+
+    for step in plan["steps"]:
+        source = labware[step["source"]]
+        dest = labware[step["dest"]]
+        if "disposal_volume" in step:
+            pipettes[step["pipette"]].distribute(
+                step["volumes"],
+                source[step["sources"][0]],
+                [dest[well] for well in step["dests"]],
+                new_tip=step["new_tip"],
+                disposal_volume=step["disposal_volume"],
+                blow_out=True,
+                blowout_location="source well"
+            )
+            continue
+        pipettes[step["pipette"]].transfer(
+            step["volumes"],
+            [source[well] for well in step["sources"]],
+            [dest[well] for well in step["dests"]],
+            new_tip=step["new_tip"],
+            blow_out=True,
+            blowout_location="destination well"
+        )
@@ -0,0 +1,55 @@
+"""
+The order to visit wells in.
+
+A single-channel pipette that dispenses into many wells with the same tip spends much of that time moving from well
+to well. ``shortest_path()`` orders the wells by their positions on the loaded labware, so the head moves on to the
+nearest well it hasn't visited yet instead of going back across the plate, which matters most on plates with gaps.
+
+Only steps that share a tip without ever touching a sample with it, like dispensing water into empty wells, can be
+reordered freely. Steps that take a new tip for every well go by the tip rack and the trash between wells anyway, so
+their order makes no difference to the travel, and they keep the order of the plate map.
+
+This file is inlined into the protocols by ``tools/bundle.py``; edit it here and re-run the bundler.
+"""
+import math
+
+from opentrons import protocol_api
+
+from lib.plate_map import serpentine
+
+def well_positions(labware: protocol_api.Labware) -> dict[str, tuple[float, float]]:
+    """
+    Returns the position of the top of every well of a labware, in mm.
+
+    :param labware: The loaded labware.
+    """
+    return {well.well_name: (well.top().point.x, well.top().point.y) for well in labware.wells()}
+
+def path_length(wells: list[str], positions: dict[str, tuple[float, float]]) -> float:
+    """
+    Returns the distance the head travels to visit wells in the given order, in mm.
+
+    :param wells: The names of the wells, in the order they are visited.
+    :param positions: The position of every well, from ``well_positions()``.
+    """
+    return sum(math.dist(positions[a], positions[b]) for a, b in zip(wells, wells[1:]))
+
+def shortest_path(wells: list[str], positions: dict[str, tuple[float, float]]) -> list[str]:
+    """
+    Returns wells in the order with the least travel between them that is found: from the first well of the
+    ``serpentine()`` order, always the nearest well not visited yet, unless the serpentine order itself is shorter.
+
+    :param wells: The names of the wells, in any order.
+    :param positions: The position of every well, from ``well_positions()``.
+    """
+    ordered = serpentine(wells)
+    if len(ordered) < 3:
+        return ordered
+    path = [ordered[0]]
+    # ties go to the well that comes first in the serpentine order, so the path is always the same
+    left = ordered[1:]
+    while left:
+        nearest = min(left, key=lambda well: math.dist(positions[path[-1]], positions[well]))
+        path.append(nearest)
+        left.remove(nearest)
+    return path if path_length(path, positions) < path_length(ordered, positions) else ordered
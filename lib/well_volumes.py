@@ -0,0 +1,139 @@
+"""
+Keeping track of how much liquid is in every well of the sample plates.
+
+The purification protocols add buffers to the samples and remove the supernatant again many times. Instead of
+aspirating a fixed number of full tips every time, which aspirates air from wells that hold less and needs extra
+trips for wells that hold more, they record every addition and removal in a ``WellVolumes`` as the steps are added,
+and the removal steps aspirate exactly what is in the well, in as few trips as fit in the tip.
+
+The supernatant of a full plate is more than one liquid waste reservoir holds, so the waste is tracked too. A
+``LiquidWaste`` fills the reservoirs one after another with the supernatant the steps will discard, as they are added,
+and loads another reservoir into a spare slot when the next volume won't fit. Every step learns which reservoirs its
+supernatant may go into, so it can choose its pipette for the labware it will actually visit, and while the protocol
+runs it fills the same reservoirs in the same way. If the planned waste is more than all of them hold, the protocol
+pauses once they are full so they can be emptied.
+
+This file is inlined into the protocols by ``tools/bundle.py``; edit it here and re-run the bundler.
+"""
+import math
+
+from opentrons import protocol_api
+
+# how full a liquid waste reservoir may get, as a share of its volume
+WASTE_FILL_SHARE = 0.8
+
+class WellVolumes:
+    """
+    The volume of liquid in every well of one or more plates, in µl. Wells that nothing was added to are empty.
+    """
+
+    def __init__(self):
+        # (plate, well name) -> volume
+        self.volumes = {}
+
+    def __getitem__(self, key: tuple[protocol_api.Labware, str]) -> float:
+        return self.volumes.get(key, 0.0)
+
+    def add(self, plate: protocol_api.Labware, wells: list[str], volume: float):
+        """
+        Records that the same volume was added to every well in a list.
+
+        :param plate: The plate.
+        :param wells: The names of the wells.
+        :param volume: The volume added to each well, in µl.
+        """
+        for well in wells:
+            self.volumes[(plate, well)] = self[(plate, well)] + volume
+
+    def empty(self, plate: protocol_api.Labware, wells: list[str], residual=0.0) -> dict[str, float]:
+        """
+        Records that all liquid but a residual volume was removed from every well in a list, and returns the volume
+        removed from each well.
+
+        :param plate: The plate.
+        :param wells: The names of the wells.
+        :param residual: The volume to leave in each well, in µl.
+        """
+        removed = {}
+        for well in wells:
+            removed[well] = max(0.0, self[(plate, well)] - residual)
+            self.volumes[(plate, well)] = self[(plate, well)] - removed[well]
+        return removed
+
+class LiquidWaste:
+    """
+    The liquid waste reservoirs of a protocol and how much has been discarded into each.
+    """
+
+    def __init__(self, protocol: protocol_api.ProtocolContext, reservoir: protocol_api.Labware, spare_slots: list[str]):
+        """
+        :param protocol: The protocol context, used to load more reservoirs and to pause.
+        :param reservoir: The liquid waste reservoir that is always loaded. Further reservoirs are of the same kind.
+        :param spare_slots: The slots more reservoirs may be loaded into, in the order to use them.
+        """
+        self.protocol = protocol
+        self.reservoirs = [reservoir]
+        self.spare_slots = list(spare_slots)
+        self.capacity = reservoir.wells()[0].max_volume * WASTE_FILL_SHARE
+        # reservoir -> the volume the steps added so far will have discarded into it since it was last emptied
+        self.planned = {}
+        # reservoir -> the volume discarded into it since it was last emptied, while the protocol runs
+        self.volumes = {}
+
+    def plan(self, volume: float) -> list[protocol_api.Labware]:
+        """
+        Records that a step will discard a volume, loading another reservoir if none of them has room left for it, and
+        returns the reservoirs it may go into: the one it is planned for and the ones before it. Call this when the step
+        is added, and pass the reservoirs to ``dispose()`` when it runs.
+
+        :param volume: The volume, in µl.
+        """
+        reservoir = self.first_with_room(self.planned, volume, self.reservoirs)
+        if reservoir is None and self.spare_slots:
+            reservoir = self.protocol.load_labware(self.reservoirs[0].load_name, self.spare_slots.pop(0))
+            self.reservoirs.append(reservoir)
+        if reservoir is None:
+            # the protocol will pause for the reservoirs to be emptied
+            self.planned = {}
+            reservoir = self.reservoirs[0]
+        self.planned[reservoir] = self.planned.get(reservoir, 0.0) + volume
+        return self.reservoirs[:self.reservoirs.index(reservoir) + 1]
+
+    def dispose(self, volume: float, reservoirs: list[protocol_api.Labware]) -> protocol_api.Well:
+        """
+        Returns the well to discard a volume into and records it, pausing the protocol for the reservoirs to be emptied
+        if none of the given ones has room left. Call this when the step runs.
+
+        :param volume: The volume, in µl.
+        :param reservoirs: The reservoirs from ``plan()``.
+        """
+        reservoir = self.first_with_room(self.volumes, volume, reservoirs)
+        if reservoir is not None:
+            self.volumes[reservoir] = self.volumes.get(reservoir, 0.0) + volume
+            return reservoir.wells()[0]
+        slots = ", ".join(str(reservoir.parent) for reservoir in self.reservoirs)
+        self.protocol.pause("The liquid waste is full. Empty the reservoirs in slot(s) " + slots + ", then resume.")
+        self.volumes = {}
+        return self.dispose(volume, reservoirs)
+
+    def first_with_room(self, volumes: dict, volume: float, reservoirs: list[protocol_api.Labware]) -> protocol_api.Labware:
+        """
+        Returns the first of the reservoirs with room left for a volume, or None.
+
+        :param volumes: Reservoir -> the volume discarded into it so far.
+        :param volume: The volume, in µl.
+        :param reservoirs: The reservoirs, in the order to fill them.
+        """
+        return next((reservoir for reservoir in reservoirs if volumes.get(reservoir, 0.0) + volume <= self.capacity), None)
+
+def split_volume(volume: float, max_volume: float) -> list[float]:
+    """
+    Splits a volume into as few equal parts as possible that each fit in a tip.
+
+    :param volume: The volume, in µl.
+    :param max_volume: The largest volume the tip holds, in µl.
+    """
+    trips = math.ceil(volume / max_volume)
+    if trips == 0:
+        return []
+    return [volume / trips] * trips
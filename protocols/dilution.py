@@ -1,20 +1,95 @@
 # imports
 from opentrons import protocol_api
+import math
 
 # metadata
 metadata = {
     "protocolName": "Dilution",
-    "description": "Dilutes a sample in 5 solutions of different specified volumes.",
+    "description": "Dilutes one or more samples in a series of solutions of different specified volumes, either in a tube rack or column-wise on 96-well plates.",
     "author": "Reya Miller"
 }
 
 requirements = {"robotType": "OT-2", "apiLevel": "2.22"}
 
+# the dilution tubes on the tube rack, in the order they are filled (D1 holds the sample and D2 the diluent)
+TUBE_POSITIONS = [row + str(col) for row in "ABC" for col in range(1, 7)] + ["D3", "D4", "D5", "D6"]
+# deck slots for the destination plates and the tip racks when diluting on plates
+PLATE_SLOTS = ["3", "4", "5"]
+TIP_SLOTS = ["6", "9", "10", "11", "7", "8"]
+
+def dilution_series(num_dilutions: int, first_fold: float, fold_step: float, sample_volume: float, series_type="linear") -> list[tuple[float, float]]:
+    """
+    Generates a dilution series from fold dilutions.
+    
+    :param num_dilutions: The number of dilutions in the series.
+    :param first_fold: The fold dilution of the first solution (e.g. 11 for 1µl of sample in 10µl of diluent).
+    :param fold_step: The amount added to (``"linear"``) or multiplied with (``"geometric"``) the fold dilution for every following solution.
+    :param sample_volume: The volume of sample added to each solution, in µl.
+    :param series_type: Either ``"linear"`` or ``"geometric"``.
+    :return: A list of (diluent volume, sample volume) pairs, one for every solution.
+    """
+    series = []
+    fold = first_fold
+    for i in range(num_dilutions):
+        series.append((round(sample_volume * (fold - 1), 2), sample_volume))
+        if series_type == "geometric":
+            fold *= fold_step
+        else:
+            fold += fold_step
+    return series
+
+def read_dilution_series(rows: list[list[str]]) -> list[tuple[float, float]]:
+    """
+    Reads a dilution series from the rows of an uploaded CSV file.
+    
+    Every row holds the diluent volume and the sample volume of one solution, e.g. ``10,1``.
+    Header rows and blank rows are skipped.
+    
+    :param rows: The rows of the CSV file, as returned by ``parse_as_csv()``.
+    :return: A list of (diluent volume, sample volume) pairs, one for every solution.
+    """
+    series = []
+    for row in rows:
+        cells = [cell.strip() for cell in row if cell.strip() != ""]
+        if len(cells) < 2:
+            continue
+        try:
+            series.append((float(cells[0]), float(cells[1])))
+        except ValueError:
+            continue
+    if len(series) == 0:
+        raise ValueError("The dilution series file does not contain any diluent_volume,sample_volume rows.")
+    return series
+
+def plate_layout(num_samples: int, num_dilutions: int) -> list[tuple[int, int]]:
+    """
+    Lays out the dilution series of every sample on 96-well plates.
+    
+    Samples are handled in blocks of 8, one sample per row, so that the 8-channel pipette dilutes a whole block at once.
+    Each block takes one column per dilution, and a block is never split between two plates.
+    
+    :param num_samples: The number of samples to dilute, a multiple of 8, since the 8-channel pipette would aspirate
+        from the empty rows of a partly filled column.
+    :param num_dilutions: The number of dilutions in the series.
+    :return: A list with one (plate index, first column index) pair for every block of 8 samples.
+    """
+    if num_samples % 8 != 0:
+        raise ValueError("The plate layout dilutes whole columns of 8 samples, got " + str(num_samples) + " samples.")
+    if num_dilutions > 12:
+        raise ValueError("A dilution series on a plate can have at most 12 dilutions, got " + str(num_dilutions) + ".")
+    blocks_per_plate = 12 // num_dilutions
+    blocks = []
+    for block in range(math.ceil(num_samples / 8)):
+        blocks.append((block // blocks_per_plate, (block % blocks_per_plate) * num_dilutions))
+    if len(blocks) > 0 and blocks[-1][0] >= len(PLATE_SLOTS):
+        raise ValueError(str(num_samples) + " samples with " + str(num_dilutions) + " dilutions do not fit on " + str(len(PLATE_SLOTS)) + " plates.")
+    return blocks
+
 def add_parameters(parameters: protocol_api.Parameters):
     parameters.add_str(
         variable_name="starting_tip_row",
         display_name="Starting tip row",
-        description="The row of the tip to start with on the tip rack.",
+        description="Tube rack only: the row of the tip to start with. The plate layout always starts on row A.",
         choices=[
             {"display_name": "A", "value": "A"},
             {"display_name": "B", "value": "B"},
@@ -47,23 +122,116 @@ def add_parameters(parameters: protocol_api.Parameters):
         ],
         default="1"
     )
-    for i in range(1, 6):
-        name = "volume_" + (str) (i)
-        display = "Volume " + (str) (i)
-        desc = "The volume of dilutent in solution " + (str) (i) + "."
-        parameters.add_float(
-            variable_name=name,
-            display_name=display,
-            description=desc,
-            default=(i*10),
-            minimum=1,
-            maximum=100,
-            unit="µl"
-        )
+    parameters.add_str(
+        variable_name="layout",
+        display_name="Layout",
+        description="Dilute one sample in the tube rack, or many samples column-wise on plates with the 8-channel.",
+        choices=[
+            {"display_name": "Tube rack", "value": "tubes"},
+            {"display_name": "96-well plates", "value": "plate"}
+        ],
+        default="tubes"
+    )
+    parameters.add_int(
+        variable_name="num_samples",
+        display_name="Number of samples",
+        description="Plate layout only: whole columns of 8 samples, read column-wise from the sample plate in slot 1.",
+        choices=[{"display_name": str(num), "value": num} for num in range(8, 97, 8)],
+        default=8
+    )
+    parameters.add_csv_file(
+        variable_name="dilution_series",
+        display_name="Dilution series",
+        description="Optional CSV, one diluent_volume,sample_volume row per solution. Otherwise uses the fold dilutions."
+    )
+    parameters.add_int(
+        variable_name="num_dilutions",
+        display_name="Number of dilutions",
+        description="The number of solutions in the generated series: at most 22 in the tube rack, 12 on plates.",
+        default=5,
+        minimum=1,
+        maximum=len(TUBE_POSITIONS)
+    )
+    parameters.add_str(
+        variable_name="series_type",
+        display_name="Series type",
+        description="Whether the fold step is added to or multiplied with the previous fold dilution.",
+        choices=[
+            {"display_name": "Linear", "value": "linear"},
+            {"display_name": "Geometric", "value": "geometric"}
+        ],
+        default="linear"
+    )
+    parameters.add_float(
+        variable_name="first_fold",
+        display_name="First fold dilution",
+        description="The fold dilution of the first solution.",
+        default=11,
+        minimum=1,
+        maximum=1000
+    )
+    parameters.add_float(
+        variable_name="fold_step",
+        display_name="Fold step",
+        description="The step between the fold dilutions of consecutive solutions.",
+        default=10,
+        minimum=0,
+        maximum=1000
+    )
+    parameters.add_str(
+        variable_name="dilution_method",
+        display_name="Dilution method",
+        description="Parallel: every solution gets sample. Serial: every solution is made from the previous one.",
+        choices=[
+            {"display_name": "Parallel", "value": "parallel"},
+            {"display_name": "Serial", "value": "serial"}
+        ],
+        default="parallel"
+    )
+    parameters.add_float(
+        variable_name="serial_fold",
+        display_name="Serial fold dilution",
+        description="Serial method only: the fold dilution of every step of the generated series.",
+        default=10,
+        minimum=1.1,
+        maximum=100
+    )
+    parameters.add_float(
+        variable_name="transfer_volume",
+        display_name="Serial transfer volume",
+        description="Serial method only: the volume carried from each solution into the next.",
+        default=10,
+        minimum=1,
+        maximum=100,
+        unit="µl"
+    )
+    parameters.add_int(
+        variable_name="mix_repetitions",
+        display_name="Mix repetitions",
+        description="Serial method only: how many times each solution is mixed before it is carried over.",
+        default=5,
+        minimum=1,
+        maximum=20
+    )
+    parameters.add_bool(
+        variable_name="multi_dispense",
+        display_name="Multi-dispense diluent",
+        description="Aspirate the diluent once and dispense it into as many solutions as the tip can hold.",
+        default=True
+    )
+    parameters.add_float(
+        variable_name="disposal_volume",
+        display_name="Disposal volume",
+        description="Extra diluent aspirated when multi-dispensing, blown back into the diluent source.",
+        default=1,
+        minimum=0,
+        maximum=5,
+        unit="µl"
+    )
     parameters.add_float(
         variable_name="sample_volume",
         display_name="Sample volume",
-        description="The volume of the sample added to each solution.",
+        description="The volume of the sample added to each solution of the generated series.",
         default=1,
         minimum=1,
         maximum=20,
@@ -71,49 +239,158 @@ def add_parameters(parameters: protocol_api.Parameters):
     )
 
 def run(protocol: protocol_api.ProtocolContext):
-    # place a 24 tube rack with 1.5ml safelock snapcap in slot 3 of the robot deck
-    tube_rack = protocol.load_labware("opentrons_24_tuberack_eppendorf_1.5ml_safelock_snapcap", 3)
-    # the diluent (water) goes in slot D2 of the tube rack
-    diluent_tube = tube_rack["D2"]
+    # read the dilution series from the uploaded file, or generate it from the fold dilutions
+    try:
+        series = read_dilution_series(protocol.params.dilution_series.parse_as_csv())
+    except protocol_api.RuntimeParameterRequiredError:
+        if protocol.params.dilution_method == "serial":
+            # a fold step of 0 gives the same fold dilution for every step
+            series = dilution_series(protocol.params.num_dilutions, protocol.params.serial_fold, 0, protocol.params.transfer_volume)
+        else:
+            series = dilution_series(protocol.params.num_dilutions, protocol.params.first_fold, protocol.params.fold_step, protocol.params.sample_volume, protocol.params.series_type)
+    # check the number of solutions against the layout before anything is loaded
+    max_dilutions = 12 if protocol.params.layout == "plate" else len(TUBE_POSITIONS)
+    if len(series) > max_dilutions:
+        raise ValueError("The " + ("plate" if protocol.params.layout == "plate" else "tube rack") + " layout holds at most " + str(max_dilutions) + " dilutions, got " + str(len(series)) + ".")
+    # the 8-channel pipette takes whole columns of tips, so on plates only the starting column can be chosen
+    if protocol.params.layout == "plate" and protocol.params.starting_tip_row != "A":
+        raise ValueError("The plate layout always starts on row A of the tip rack, since the 8-channel pipette picks up whole columns; set the starting tip row to A.")
+    diluent_volumes = [dil for dil, smp in series]
+    sample_volumes = [smp for dil, smp in series]
+    # the volume taken from every sample: in serial mode, only the first solution is made from it
+    sample_drawn = sample_volumes[0] if protocol.params.dilution_method == "serial" else sum(sample_volumes)
+    
     diluent = protocol.define_liquid(
         name="Diluent",
         description="The liquid being used to dilute the sample.",
         display_color="#0051FF"
     )
-    tube_rack.load_liquid(
-        wells=["D2"],
-        volume=150,
-        liquid=diluent
-    )
-    # the sample being diluted goes in slot D1 of the tube rack
-    main_sample_tube = tube_rack["D1"]
     main_sample = protocol.define_liquid(
         name="Main sample",
         description="The sample being diluted.",
         display_color="#FD9381"
     )
-    tube_rack.load_liquid(
-        wells=["D1"],
-        volume=150,
-        liquid=main_sample
-    )
     
-    # place a 96 20µl tip rack in slot 6 of the robot deck
-    tips = protocol.load_labware("opentrons_96_tiprack_20ul", 6)
-    # add a single-channel 20µL pipette to the left mount and use the specified tip rack
-    left_pipette = protocol.load_instrument("p20_single_gen2", "left", tip_racks=[tips])
-    left_pipette.starting_tip = tips[protocol.params.starting_tip_row + protocol.params.starting_tip_col]
+    def add_sample(pipette: protocol_api.InstrumentContext, sample: protocol_api.Well, dests: list[protocol_api.Well]):
+        """
+        Transfers the sample into each of the solutions of diluent.
+        
+        In parallel mode, every solution gets sample straight from the sample well on a new tip.
+        In serial mode, every solution is made from the previous one and mixed, with one tip per step.
+        
+        :param pipette: The pipette to use.
+        :param sample: The well (or first well of the column) containing the sample.
+        :param dests: The wells (or first wells of the columns) containing the diluent, in the order of the series.
+        """
+        if protocol.params.dilution_method == "serial":
+            sources = [sample] + dests[:-1]
+            for (dil, smp), src, dest in zip(series, sources, dests):
+                mix_vol = min(pipette.max_volume, 0.8 * (dil + smp))
+                pipette.transfer(smp, src, dest, new_tip="once", mix_after=(protocol.params.mix_repetitions, mix_vol), blow_out=True, blowout_location="destination well")
+        else:
+            for vol, dest in zip(sample_volumes, dests):
+                pipette.transfer(vol, sample, dest, blow_out=True, blowout_location="destination well")
+    
+    def dilute_in_tubes():
+        """
+        Dilutes the sample in tube D1 of the tube rack into one tube per solution, using the single-channel pipette.
+        """
+        # place a 24 tube rack with 1.5ml safelock snapcap in slot 3 of the robot deck
+        tube_rack = protocol.load_labware("opentrons_24_tuberack_eppendorf_1.5ml_safelock_snapcap", 3)
+        # the diluent (water) goes in slot D2 of the tube rack
+        diluent_tube = tube_rack["D2"]
+        tube_rack.load_liquid(
+            wells=["D2"],
+            volume=max(150, sum(diluent_volumes) + protocol.params.disposal_volume),
+            liquid=diluent
+        )
+        # the sample being diluted goes in slot D1 of the tube rack
+        main_sample_tube = tube_rack["D1"]
+        tube_rack.load_liquid(
+            wells=["D1"],
+            volume=max(150, sample_drawn),
+            liquid=main_sample
+        )
+        dilution_tubes = [tube_rack[pos] for pos in TUBE_POSITIONS[:len(series)]]
+        if max(dil + smp for dil, smp in series) > dilution_tubes[0].max_volume:
+            raise ValueError("A solution of the dilution series does not fit in a tube.")
+        
+        # place a 96 20µl tip rack in slot 6 of the robot deck
+        tips = protocol.load_labware("opentrons_96_tiprack_20ul", 6)
+        # add a single-channel 20µL pipette to the left mount and use the specified tip rack
+        left_pipette = protocol.load_instrument("p20_single_gen2", "left", tip_racks=[tips])
+        left_pipette.starting_tip = tips[protocol.params.starting_tip_row + protocol.params.starting_tip_col]
+        
+        # transfer the diluent into the dilution tubes
+        if protocol.params.multi_dispense:
+            # aspirate once for as many tubes as fit in the tip; the disposal volume goes back into the diluent tube
+            left_pipette.distribute(diluent_volumes, diluent_tube, dilution_tubes, new_tip="once", disposal_volume=protocol.params.disposal_volume, blow_out=True, blowout_location="source well")
+        else:
+            left_pipette.pick_up_tip()
+            for vol, tube in zip(diluent_volumes, dilution_tubes):
+                left_pipette.transfer(vol, diluent_tube, tube, new_tip="never", blow_out=True, blowout_location="destination well")
+            left_pipette.drop_tip()
+        
+        # transfer the sample to each of the tubes of diluent
+        add_sample(left_pipette, main_sample_tube, dilution_tubes)
     
-    # transfer various amounts of the diluent into the first 5 slots of the tube rack
-    left_pipette.pick_up_tip()
-    left_pipette.transfer(protocol.params.volume_1, diluent_tube, tube_rack["A1"], new_tip="never", blow_out=True, blowout_location="destination well")
-    left_pipette.transfer(protocol.params.volume_2, diluent_tube, tube_rack["A2"], new_tip="never", blow_out=True, blowout_location="destination well")
-    left_pipette.transfer(protocol.params.volume_3, diluent_tube, tube_rack["A3"], new_tip="never", blow_out=True, blowout_location="destination well")
-    left_pipette.transfer(protocol.params.volume_4, diluent_tube, tube_rack["A4"], new_tip="never", blow_out=True, blowout_location="destination well")
-    left_pipette.transfer(protocol.params.volume_5, diluent_tube, tube_rack["A5"], new_tip="never", blow_out=True, blowout_location="destination well")
-    left_pipette.drop_tip()
+    def dilute_on_plates():
+        """
+        Dilutes the samples on the sample plate column-wise onto 96-well plates, using the 8-channel pipette.
+        Every block of 8 samples (one column of the sample plate) takes one column of a destination plate per solution.
+        """
+        blocks = plate_layout(protocol.params.num_samples, len(series))
+        num_plates = blocks[-1][0] + 1
+        
+        # the samples go column-wise (A1, B1, ..., H1, A2, ...) into the sample plate in slot 1
+        sample_plate = protocol.load_labware("opentrons_96_wellplate_200ul_pcr_full_skirt", 1)
+        sample_plate.load_liquid(
+            wells=sample_plate.wells()[:protocol.params.num_samples],
+            volume=sample_drawn + 10,
+            liquid=main_sample
+        )
+        # the diluent goes in the first trough of a 12-well reservoir in slot 2
+        reservoir = protocol.load_labware("nest_12_reservoir_15ml", 2)
+        reservoir.load_liquid(
+            wells=["A1"],
+            volume=8 * len(blocks) * sum(diluent_volumes) + 1000,
+            liquid=diluent
+        )
+        dilution_plates = [protocol.load_labware("opentrons_96_wellplate_200ul_pcr_full_skirt", PLATE_SLOTS[i]) for i in range(num_plates)]
+        
+        # one column of tips for the diluent and one for every column of dilutions
+        start_col = int(protocol.params.starting_tip_col)
+        num_racks = math.ceil((start_col - 1 + 1 + len(blocks) * len(series)) / 12)
+        if num_racks > len(TIP_SLOTS):
+            raise ValueError("The dilutions need more than " + str(len(TIP_SLOTS)) + " tip racks.")
+        tips = [protocol.load_labware("opentrons_96_tiprack_20ul", TIP_SLOTS[i]) for i in range(num_racks)]
+        # add an 8-channel 20µL pipette to the right mount; it always starts on row A of the first tip rack
+        right_pipette = protocol.load_instrument("p20_multi_gen2", "right", tip_racks=tips)
+        right_pipette.starting_tip = tips[0]["A" + protocol.params.starting_tip_col]
+        
+        if max(dil + smp for dil, smp in series) > dilution_plates[0].wells()[0].max_volume:
+            raise ValueError("A solution of the dilution series does not fit in a well.")
+        
+        dilution_columns = []
+        for plate, first_col in blocks:
+            dilution_columns.append(dilution_plates[plate].columns()[first_col:first_col+len(series)])
+        
+        # transfer the diluent into every column of dilutions
+        dests = [col[0] for block in dilution_columns for col in block]
+        vols = diluent_volumes * len(blocks)
+        if protocol.params.multi_dispense:
+            right_pipette.distribute(vols, reservoir["A1"], dests, new_tip="once", disposal_volume=protocol.params.disposal_volume, blow_out=True, blowout_location="source well")
+        else:
+            right_pipette.pick_up_tip()
+            for vol, dest in zip(vols, dests):
+                right_pipette.transfer(vol, reservoir["A1"], dest, new_tip="never", blow_out=True, blowout_location="destination well")
+            right_pipette.drop_tip()
+        
+        # transfer each block of samples to each of its columns of diluent
+        for block, cols in enumerate(dilution_columns):
+            add_sample(right_pipette, sample_plate.columns()[block][0], [col[0] for col in cols])
     
-    # transfer [sample_volume]µL of the sample to each of the slots of diluent
-    for i in range(5):
-        loc = "A" + (str) (i+1)
-        left_pipette.transfer(protocol.params.sample_volume, main_sample_tube, tube_rack[loc], blow_out=True, blowout_location="destination well")
\ No newline at end of file
+    if protocol.params.layout == "plate":
+        dilute_on_plates()
+    else:
+        dilute_in_tubes()
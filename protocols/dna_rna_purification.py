@@ -1,7 +1,5 @@
 # imports
 from opentrons import protocol_api
-import csv
-import math
 
 # metadata
 metadata = {
@@ -13,8 +11,1254 @@ metadata = {
 # requirements
 requirements = {"robotType": "OT-2", "apiLevel": "2.22"}
 
+# >>> lib/plate_map.py (inlined by tools/bundle.py, edit the original instead)
+from array import array
+
+PLATE_ROWS = "ABCDEFGH"
+PLATE_COLS = 12
+
+def well_index(well: str) -> int:
+    """
+    Returns the index of a well in column order (A1, B1, ..., H1, A2, ...), the same order as ``Labware.wells()``.
+
+    :param well: The name of the well, e.g. ``"B3"``.
+    """
+    return (int(well[1:]) - 1) * 8 + PLATE_ROWS.index(well[0].upper())
+
+def well_name(index: int) -> str:
+    """
+    Returns the name of the well at the given column-order index.
+
+    :param index: The index of the well, from 0 (A1) to 95 (H12).
+    """
+    return PLATE_ROWS[index % 8] + str(index // 8 + 1)
+
+def serpentine(wells: list[str]) -> list[str]:
+    """
+    Returns wells in an order with little travel between them: row by row, every row in the opposite direction of the
+    one before, so the pipette moves on to the nearest well of the next row instead of going back to column 1.
+
+    :param wells: The names of the wells, in any order.
+    """
+    rows = {}
+    for well in sorted(wells, key=lambda well: int(well[1:])):
+        rows.setdefault(PLATE_ROWS.index(well[0].upper()), []).append(well)
+    ordered = []
+    for i, row in enumerate(sorted(rows)):
+        ordered += rows[row] if i % 2 == 0 else rows[row][::-1]
+    return ordered
+
+class PlateMap:
+    """
+    A parsed 96-well plate map.
+
+    The occupied wells are stored as a 96-bit mask with bit ``col * 8 + row`` set for every occupied well, so every
+    column is one byte of the mask and can be queried in constant time. The value of every well (1.0 for ``TRUE``, or
+    the number in the cell) is stored in a float array indexed the same way.
+    """
+
+    def __init__(self, mask=0, values=None):
+        """
+        :param mask: The occupancy mask.
+        :param values: A float array of 96 well values, in column order.
+        """
+        self.mask = mask
+        self.values = values if values is not None else array("d", [0.0] * (8 * PLATE_COLS))
+
+    @classmethod
+    def parse(cls, data: str) -> "PlateMap":
+        """
+        Parses a single plate map grid.
+
+        :param data: The grid, comma- or tab-separated, as pasted into a protocol or uploaded as a CSV file.
+        """
+        maps = cls.parse_all(data)
+        if len(maps) != 1:
+            raise ValueError("Expected one plate map, found " + str(len(maps)) + ".")
+        return maps[0]
+
+    @classmethod
+    def parse_all(cls, data: str) -> list["PlateMap"]:
+        """
+        Parses one or more plate map grids that follow each other, each starting with its own header row.
+
+        :param data: The grids, comma- or tab-separated.
+        """
+        maps = []
+        header = None
+        for line in data.lstrip("\ufeff").replace("\t", ",").splitlines():
+            cells = [cell.strip() for cell in line.split(",")]
+            if all(cell == "" for cell in cells):
+                continue
+            if cells[0] == "":
+                # a header row starts a new grid; remember which column every cell belongs to
+                header = [int(cell) - 1 if cell != "" else None for cell in cells[1:]]
+                maps.append(cls())
+                continue
+            if header is None:
+                raise ValueError("The plate map must start with a header row of column numbers.")
+            row = PLATE_ROWS.find(cells[0].upper())
+            if row < 0 or len(cells[0]) != 1:
+                raise ValueError("Unknown plate row " + repr(cells[0]) + ".")
+            plate_map = maps[-1]
+            for col, cell in zip(header, cells[1:]):
+                if col is None or cell == "" or cell.upper() == "FALSE":
+                    continue
+                index = col * 8 + row
+                plate_map.mask |= 1 << index
+                plate_map.values[index] = 1.0 if cell.upper() == "TRUE" else float(cell)
+        return maps
+
+    def __len__(self) -> int:
+        return bin(self.mask).count("1")
+
+    def __contains__(self, well: str) -> bool:
+        return (self.mask >> well_index(well)) & 1 == 1
+
+    def __getitem__(self, well: str) -> float:
+        return self.values[well_index(well)]
+
+    def column_mask(self, col: int) -> int:
+        """
+        Returns the occupancy of a column as an 8-bit mask, with bit 0 for row A and bit 7 for row H.
+
+        :param col: The column index, from 0 to 11.
+        """
+        return (self.mask >> (col * 8)) & 0xFF
+
+    def column_count(self, col: int) -> int:
+        """
+        Returns the number of occupied wells in a column.
+
+        :param col: The column index, from 0 to 11.
+        """
+        return bin(self.column_mask(col)).count("1")
+
+    def is_full(self, col: int) -> bool:
+        """
+        Returns whether every well of a column is occupied.
+
+        :param col: The column index, from 0 to 11.
+        """
+        return self.column_mask(col) == 0xFF
+
+    def occupied_columns(self) -> list[int]:
+        """Returns the indexes of the columns with at least one occupied well."""
+        return [col for col in range(PLATE_COLS) if self.column_mask(col) != 0]
+
+    def full_columns(self) -> list[int]:
+        """Returns the indexes of the columns in which every well is occupied."""
+        return [col for col in range(PLATE_COLS) if self.column_mask(col) == 0xFF]
+
+    def partial_columns(self) -> list[int]:
+        """Returns the indexes of the columns in which some, but not all, wells are occupied."""
+        return [col for col in range(PLATE_COLS) if 0 < self.column_mask(col) < 0xFF]
+
+    def num_columns(self) -> int:
+        """Returns the number of columns up to and including the last occupied one."""
+        return (self.mask.bit_length() + 7) // 8
+
+    def column_wells(self, col: int) -> list[str]:
+        """
+        Returns the names of the occupied wells of a column, from row A to row H.
+
+        :param col: The column index, from 0 to 11.
+        """
+        col_mask = self.column_mask(col)
+        return [PLATE_ROWS[row] + str(col + 1) for row in range(8) if (col_mask >> row) & 1]
+
+    def wells(self, order="column") -> list[str]:
+        """
+        Returns the names of all occupied wells.
+
+        :param order: ``"column"`` (A1, B1, ..., H1, A2, ...) or ``"row"`` (A1, A2, ..., A12, B1, ...).
+        """
+        if order == "row":
+            indexes = [col * 8 + row for row in range(8) for col in range(PLATE_COLS)]
+        else:
+            indexes = range(8 * PLATE_COLS)
+        return [well_name(i) for i in indexes if (self.mask >> i) & 1]
+
+    def column_plan(self) -> list[tuple[int, list[str]]]:
+        """
+        Splits the occupied wells into groups that can each be pipetted in one go by an 8-channel pipette: every full
+        column, and every run of neighbouring occupied wells in a partially filled column. Empty columns are skipped.
+
+        :return: A list of (column index, wells) tuples, in column order, with the wells of each group from back to
+            front.
+        """
+        plan = []
+        for col in self.occupied_columns():
+            wells = []
+            for well in self.column_wells(col):
+                if wells and PLATE_ROWS.index(well[0]) != PLATE_ROWS.index(wells[-1][0]) + 1:
+                    plan.append((col, wells))
+                    wells = []
+                wells.append(well)
+            plan.append((col, wells))
+        return plan
+# <<< lib/plate_map.py
+
+# >>> lib/column_pipettes.py (inlined by tools/bundle.py, edit the original instead)
+import math
+
+
+
+# how far a tip slides onto its nozzle, in mm (a little more than the actual overlap, to be safe)
+TIP_OVERLAP = 10
+
+class ColumnPipettes:
+    """
+    Picks the pipette for every group of wells from ``PlateMap.column_plan()``: full columns use all 8 channels of the
+    8-channel pipette, runs of two or more wells in partially filled columns use as many of its channels as the run is
+    long where there is room for it, and the single-channel pipette visits the wells one by one otherwise.
+    """
+
+    def __init__(self, protocol: protocol_api.ProtocolContext, multi: protocol_api.InstrumentContext, single: protocol_api.InstrumentContext, partial_tip_racks: list[protocol_api.Labware]):
+        """
+        :param protocol: The protocol context.
+        :param multi: The 8-channel pipette, loaded with the tip racks for full columns and its starting tip.
+        :param single: The single-channel pipette, loaded with its own tip racks and its starting tip.
+        :param partial_tip_racks: Full tip racks used only for partial pickups, so these never break up the columns of
+            tips the full columns need. Partial pickups are turned off if the list is empty.
+        """
+        self.protocol = protocol
+        self.multi = multi
+        self.single = single
+        self.multi_tip_racks = list(multi.tip_racks)
+        self.multi_starting_tip = multi.starting_tip
+        # "multi" (full columns), "partial" and "single" -> the tip racks of that kind of pickup, and "parked" -> the tip
+        # racks of the parked tips of both pipettes
+        self.tip_racks = {"multi": self.multi_tip_racks, "partial": list(partial_tip_racks), "single": list(single.tip_racks), "parked": []}
+        # the first tip of the parked racks, if one was taken from the racks of new tips with their starting tip in it
+        self.parked_starting_tip = None
+        # the pickups the steps will make, as (kind of pickup or None, wells, labware, tips, parked) tuples recorded by
+        # plan()
+        self.planned = []
+        # (channels, plate, well) -> the place in the rack of the tip parked for a well of a sample plate, with 0
+        # channels for the single-channel pipette
+        self.parked = {}
+        # the wells of a group -> the kinds of pickup load_tip_racks() counted the tips of for the steps of the group, in
+        # the order they run
+        self.planned_kinds = {}
+        # kind of pickup -> the number of tips in every pickup the steps that haven't run yet will make, from
+        # load_tip_racks()
+        self.remaining = {kind: [] for kind in self.tip_racks}
+        # labware that is off the deck while the tips are planned -> the labware on the deck whose place it takes, from
+        # stand_in()
+        self.stand_ins = {}
+        # labware -> whether the nozzles without tips can pass over the slot behind it, worked out the first time
+        self.room = {}
+
+    def stand_in(self, labware: protocol_api.Labware, on_deck: protocol_api.Labware):
+        """
+        Records that a labware that is off the deck while the tips are planned, like a sample plate on the magnetic
+        block, will take the place of a labware that is on the deck. Steps plan and pick with the labware they actually
+        pipette from, and the labware on the deck decides the slot and the room for partial pickups. Its wells are lower,
+        so the room is never overestimated.
+
+        :param labware: The labware that is moved onto the deck by a step.
+        :param on_deck: The labware on the deck whose place it takes.
+        """
+        self.stand_ins[labware] = on_deck
+
+    def slot(self, labware: protocol_api.Labware) -> int:
+        """
+        Returns the slot a labware is pipetted in, which for a labware with a stand-in is the slot of the stand-in.
+
+        :param labware: The labware.
+        """
+        return int(self.stand_ins.get(labware, labware).parent)
+
+    def has_room(self, labware: protocol_api.Labware) -> bool:
+        """
+        Returns whether the nozzles without tips can pass over the slot behind the labware. The answer is worked out once,
+        before any step runs, so the steps pick the pipettes the plan counted the tips of.
+
+        :param labware: The labware to pipette from or to.
+        """
+        if labware not in self.room:
+            placed = self.stand_ins.get(labware, labware)
+            self.room[labware] = self.slot_has_room(int(placed.parent), placed.wells()[0].bottom().point.z)
+        return self.room[labware]
+
+    def slot_has_room(self, slot: int, bottom: float) -> bool:
+        """
+        Returns whether the nozzles without tips can pass over the slot behind a slot, when the tips reach down to a
+        height.
+
+        :param slot: The slot of the labware to pipette from or to.
+        :param bottom: The height of the bottom of its wells, in mm.
+        """
+        # the back row is at the edge of the pipette's reach, and slot 12 behind it holds the trash
+        if slot > 9 or slot + 3 == 12:
+            return False
+        behind = self.protocol.deck[slot + 3]
+        if behind is None:
+            return True
+        tip_length = self.tip_racks["partial"][0].tip_length
+        return behind.highest_z < bottom + tip_length - TIP_OVERLAP
+
+    def channels(self, wells: list[str], labware: tuple[protocol_api.Labware, ...]) -> int:
+        """
+        Returns how many channels of the 8-channel pipette a group of wells is pipetted with, or 0 if it is pipetted with
+        the single-channel pipette.
+
+        :param wells: A group of wells from ``PlateMap.column_plan()``.
+        :param labware: Every labware the pipette visits for this group, apart from the tip racks and the trash.
+        """
+        if len(wells) == 8:
+            return 8
+        if len(wells) > 1 and self.tip_racks["partial"] and all(self.has_room(lw) for lw in labware + tuple(self.tip_racks["partial"])):
+            return len(wells)
+        return 0
+
+    def configure(self, channels: int):
+        """
+        Switches the 8-channel pipette to the given number of channels, counting back from nozzle H1.
+
+        :param channels: The number of channels, from 1 to 8.
+        """
+        if self.multi.active_channels == channels:
+            return
+        if channels == 8:
+            self.multi.configure_nozzle_layout(style=protocol_api.ALL, tip_racks=self.multi_tip_racks)
+            self.multi.starting_tip = self.multi_starting_tip
+            return
+        # a starting tip can't be combined with a partial configuration, and the partial tip racks start full anyway
+        self.multi.starting_tip = None
+        if channels == 1:
+            self.multi.configure_nozzle_layout(style=protocol_api.SINGLE, start="H1", tip_racks=self.tip_racks["partial"])
+        else:
+            end = PLATE_ROWS[8 - channels] + "1"
+            self.multi.configure_nozzle_layout(style=protocol_api.PARTIAL_COLUMN, start="H1", end=end, tip_racks=self.tip_racks["partial"])
+
+    def pick(self, wells: list[str], *labware: protocol_api.Labware, tips=1, parked=None) -> tuple[protocol_api.InstrumentContext, list[str]]:
+        """
+        Returns the pipette for a group of wells and the wells to send it to. With more than one channel that is only
+        the well under the primary nozzle: row A for a full column, and the front well of a partial run.
+
+        :param wells: A group of wells from ``PlateMap.column_plan()``.
+        :param labware: Every labware the pipette visits for this group, apart from the tip racks and the trash.
+        :param tips: How many new tips the step picks up for every well (or column) it sends the pipette to. If the
+            racks don't have that many left, the protocol first pauses to have them replaced.
+        :param parked: The sample plate whose parked tips the step also uses, or None. A parked tip counts as a new tip
+            the first time.
+        """
+        channels = self.channels(wells, labware)
+        kind, visits = pickup_kind(channels), visited_wells(wells, channels)
+        # tips that can be parked come from the parked racks, which load_tip_racks() made big enough for all of them
+        new_parked = 0 if can_park(channels) else len(new_parked_tips(visits, channels, parked, self.parked))
+        self.check_kind(wells, kind)
+        self.ensure_tips(kind, [max(1, channels)] * (len(visits) * tips + new_parked))
+        if channels == 0:
+            return self.single, visits
+        self.configure(channels)
+        return self.multi, visits
+
+    def pick_single(self, wells: list[str], tips=1) -> protocol_api.InstrumentContext:
+        """
+        Returns the single-channel pipette, for steps that always use it, after making sure its racks have enough tips
+        left like ``pick()`` does.
+
+        :param wells: The wells the step visits.
+        :param tips: How many tips the step picks up for every well.
+        """
+        self.check_kind(wells, "single")
+        self.ensure_tips("single", [1] * len(wells) * tips)
+        return self.single
+
+    def check_kind(self, wells: list[str], kind: str):
+        """
+        Notes in the run log when a step picks up tips for a group of wells with another kind of pickup than
+        ``load_tip_racks()`` counted the tips of, e.g. because it visits other labware than it was planned with, since
+        the racks of that kind may then run out of tips the plan didn't count.
+
+        :param wells: A group of wells from ``PlateMap.column_plan()``.
+        :param kind: The kind of pickup the step makes.
+        """
+        planned = self.planned_kinds.get(tuple(wells), [])
+        expected = planned.pop(0) if planned else None
+        if kind != expected:
+            self.protocol.comment("Unplanned pickup: the wells " + ", ".join(wells) + " use a " + kind + " pickup, but " + ("none" if expected is None else "a " + expected + " pickup") + " was planned.")
+
+    def plan(self, wells: list[str], *labware: protocol_api.Labware, tips=1, single=False, parked=None):
+        """
+        Records that a step will pick up tips for a group of wells. Call this when the step is added, with the labware
+        the step passes to ``pick()``.
+
+        :param wells: A group of wells from ``PlateMap.column_plan()``.
+        :param labware: Every labware the pipette visits for this group, apart from the tip racks and the trash.
+        :param tips: How many new tips the step picks up for every well (or column) it visits.
+        :param single: Whether the step uses ``pick_single()`` instead of ``pick()``.
+        :param parked: The sample plate whose parked tips the step also uses, or None.
+        """
+        if tips > 0 or parked is not None:
+            self.planned.append(("single" if single else None, wells, labware, tips, parked))
+
+    def demand(self) -> dict[str, list[int]]:
+        """
+        Returns the number of tips in every pickup the planned steps make, for every kind of pickup, with the first
+        pickups of parked tips under "parked".
+        """
+        demand = {kind: [] for kind in self.tip_racks}
+        # a parked tip is only a new tip the first time
+        seen = set()
+        for kind, wells, labware, tips, parked in self.planned:
+            channels = 0 if kind == "single" else self.channels(wells, labware)
+            visits = visited_wells(wells, channels)
+            new_parked = new_parked_tips(visits, channels, parked, seen)
+            seen.update((channels, parked, well) for well in new_parked)
+            demand[pickup_kind(channels)] += [max(1, channels)] * len(visits) * tips
+            demand["parked" if can_park(channels) else pickup_kind(channels)] += [max(1, channels)] * len(new_parked)
+        return demand
+
+    def next_tip(self, kind: str, channels: int) -> protocol_api.Well:
+        """
+        Returns the tip under the primary nozzle for the next pickup of a kind, or None if there are not enough tips left.
+        Full columns start at row A; partial pickups take the tips at the back of a column first, so the nozzles without
+        tips pass behind the rack, and the primary nozzle H1 is over the front one of them.
+
+        :param kind: "multi", "partial", "single" or "parked".
+        :param channels: The number of tips to pick up.
+        """
+        starting_tip = self.starting_tip(kind)
+        for rack in self.tip_racks[kind]:
+            wells = rack.wells()
+            skipped = wells.index(starting_tip) if starting_tip is not None and starting_tip.parent == rack else 0
+            for column in range(12):
+                left = [wells[i] for i in range(8 * column, 8 * column + 8) if i >= skipped and wells[i].has_tip]
+                if len(left) >= channels:
+                    return left[channels - 1] if kind == "partial" else left[0]
+        return None
+
+    def pick_up_tip(self, pipette: protocol_api.InstrumentContext, well: str, parked=None):
+        """
+        Picks up a new tip (or tips) for a well, or with ``parked``, the tip parked for the well of that plate, which is
+        new the first time and is parked once it is returned with ``drop_tip()``.
+
+        :param pipette: The pipette from ``pick()``.
+        :param well: The well from ``pick()`` the tip is for.
+        :param parked: The sample plate the tip is parked for, or None for a new tip.
+        """
+        if parked is None or not can_park(self.pipette_channels(pipette)):
+            pipette.pick_up_tip()
+            return
+        key = (self.pipette_channels(pipette), parked, well)
+        if key not in self.parked:
+            self.parked[key] = self.next_tip("parked", max(1, key[0]))
+        pipette.pick_up_tip(self.parked[key])
+
+    def pipette_channels(self, pipette: protocol_api.InstrumentContext) -> int:
+        """
+        Returns the number of channels the 8-channel pipette is configured for, or 0 for the single-channel pipette.
+
+        :param pipette: The pipette.
+        """
+        return 0 if pipette == self.single else pipette.active_channels
+
+    def drop_tip(self, pipette: protocol_api.InstrumentContext, parked=None):
+        """
+        Drops the tip in the trash, or with ``parked``, returns it to its place in the rack for the next step.
+
+        :param pipette: The pipette.
+        :param parked: The sample plate the tip is parked for, or None.
+        """
+        if parked is not None and can_park(self.pipette_channels(pipette)):
+            pipette.return_tip()
+        else:
+            pipette.drop_tip()
+
+    def starting_tip(self, kind: str) -> protocol_api.Well:
+        """
+        Returns the first tip a kind of pickup uses, or None to start at the first tip of its racks.
+
+        :param kind: "multi", "partial", "single" or "parked".
+        """
+        return {"multi": self.multi_starting_tip, "partial": None, "single": self.single.starting_tip, "parked": self.parked_starting_tip}[kind]
+
+    def used_tips(self, kind: str) -> list[int]:
+        """
+        Returns the number of tips a kind of pickup can no longer use in every column of its racks: the ones that have
+        been picked up, and the ones before its starting tip.
+
+        :param kind: "multi", "partial", "single" or "parked".
+        """
+        starting_tip = self.starting_tip(kind)
+        used = []
+        for rack in self.tip_racks[kind]:
+            wells = rack.wells()
+            skipped = wells.index(starting_tip) if starting_tip is not None and starting_tip.parent == rack else 0
+            for column in range(12):
+                used.append(sum(1 for i in range(8 * column, 8 * column + 8) if i < skipped or not wells[i].has_tip))
+        return used
+
+    def load_tip_racks(self, refills=True):
+        """
+        Loads more tip racks into the free slots for the kinds of pickups the planned steps need the most refills for,
+        until they need none or the slots run out, then announces how often the protocol will pause to have the used
+        racks replaced. Call this once every step has been planned, before any of them runs.
+
+        :param refills: Whether the protocol may pause to have the racks replaced. If not, a protocol that needs more
+            tips than the racks on the deck hold raises a ``ValueError`` straight away.
+        """
+        free_slots = [str(slot) for slot in range(1, 12) if self.protocol.deck[slot] is None]
+        if self.tip_racks["partial"]:
+            self.weigh_partial_pickups(free_slots)
+        # the parked tips are never replaced, so they get all the racks they need first
+        while len(fill_columns(self.used_tips("parked"), self.demand()["parked"])) > 12 * len(self.tip_racks["parked"]):
+            slots = self.rack_slots("parked", free_slots)
+            if slots:
+                free_slots.remove(slots[0])
+                self.tip_racks["parked"].append(self.protocol.load_labware(self.multi_tip_racks[0].load_name, slots[0]))
+                continue
+            # without a free slot, the last rack of new tips of the pipette with the most racks
+            kind = max(("multi", "single"), key=lambda kind: len(self.tip_racks[kind]))
+            if len(self.tip_racks[kind]) < 2:
+                # without a rack to spare, the parked tips share the racks of a pipette that won't run out of new tips
+                demand = self.demand()
+                # the columns of parked tips that don't fit in the parked racks, if there are any
+                overflow = len(fill_columns(self.used_tips("parked"), demand["parked"])) - 12 * len(self.tip_racks["parked"])
+                shared = [kind for kind in ("multi", "single") if len(fill_columns(self.used_tips(kind), demand[kind])) + overflow <= 12 * len(self.tip_racks[kind])]
+                if not shared or (self.tip_racks["parked"] and self.starting_tip(shared[0]) is not None):
+                    raise ValueError("The run parks more tips than the tip racks on the deck can spare. Turn off parked tips or select fewer samples.")
+                if not self.tip_racks["parked"]:
+                    self.parked_starting_tip = self.starting_tip(shared[0])
+                self.tip_racks["parked"] += self.tip_racks[shared[0]]
+                break
+            rack = self.tip_racks[kind].pop()
+            if self.starting_tip(kind) is not None and self.starting_tip(kind).parent == rack:
+                # the starting tip goes with the rack, and the racks that are left start at their first tip
+                self.parked_starting_tip = self.starting_tip(kind)
+                if kind == "multi":
+                    self.multi_starting_tip = None
+                    self.multi.starting_tip = None
+                else:
+                    self.single.starting_tip = None
+            self.tip_racks["parked"].append(rack)
+        loads, refills_needed = self.rack_plan(free_slots)
+        for kind, slot in loads:
+            self.tip_racks[kind].append(self.protocol.load_labware(self.multi_tip_racks[0].load_name, slot))
+        self.multi.tip_racks = self.multi_tip_racks
+        self.single.tip_racks = self.tip_racks["single"]
+        self.remaining = self.demand()
+        for kind, wells, labware, tips, parked in self.planned:
+            channels = 0 if kind == "single" else self.channels(wells, labware)
+            self.planned_kinds.setdefault(tuple(wells), []).append(pickup_kind(channels))
+        pauses = max(refills_needed.values(), default=0)
+        if pauses > 0:
+            if not refills:
+                raise ValueError("The run needs more tips than the tip racks on the deck hold. Allow tip refills or select fewer samples.")
+            self.protocol.comment("The run needs more tips than the tip racks on the deck hold, so it will pause about " + str(pauses) + " time(s) to have the used tip racks replaced.")
+
+    def weigh_partial_pickups(self, free_slots: list[str]):
+        """
+        Turns partial pickups off if they would make the run pause for more tip refills than leaving the partially filled
+        columns to the single-channel pipette. Partial pickups save passes, but no rack can go behind the labware they
+        visit, so they may leave free slots empty that would otherwise hold racks. Without them, the partial tip racks
+        go to the pipette they save the most refills for.
+
+        :param free_slots: The empty slots.
+        """
+        partial_racks = self.tip_racks["partial"]
+        with_partial = max(self.rack_plan(free_slots)[1].values(), default=0)
+        # channels() leaves the partially filled columns to the single-channel pipette without partial tip racks
+        self.tip_racks["partial"] = []
+        without_partial = {}
+        for kind in ("multi", "single"):
+            # changed in place, since the racks of the 8-channel pipette are also self.multi_tip_racks
+            self.tip_racks[kind].extend(partial_racks)
+            without_partial[kind] = max(self.rack_plan(free_slots)[1].values(), default=0)
+            del self.tip_racks[kind][-len(partial_racks):]
+        kind = min(without_partial, key=without_partial.get)
+        if without_partial[kind] < with_partial:
+            self.tip_racks[kind].extend(partial_racks)
+            self.protocol.comment("Partial tip pickups would need " + str(with_partial - without_partial[kind]) + " more tip refill(s), so the partially filled columns use the single-channel pipette.")
+            return
+        self.tip_racks["partial"] = partial_racks
+
+    def rack_plan(self, free_slots: list[str]) -> tuple[list[tuple[str, str]], dict[str, int]]:
+        """
+        Returns the tip racks to load into the free slots, as (kind of pickup, slot) pairs, for the kinds of pickups the
+        planned steps need the most refills for, until they need none or the slots run out, and how many refills every
+        kind of pickup still needs with those racks.
+
+        :param free_slots: The empty slots.
+        """
+        demand = self.demand()
+        free_slots = list(free_slots)
+        loads = []
+        while True:
+            refills_needed = {}
+            for kind in demand:
+                if demand[kind] and kind != "parked":
+                    racks = len(self.tip_racks[kind]) + sum(1 for load in loads if load[0] == kind)
+                    # a new rack adds 12 columns of unused tips
+                    used = self.used_tips(kind) + [0] * 12 * (racks - len(self.tip_racks[kind]))
+                    refills_needed[kind] = math.ceil(len(fill_columns(used, demand[kind])) / (12 * racks)) - 1
+            # worked out again after every rack, since a rack for partial pickups rules out the slot behind it for the others
+            slots = {kind: self.rack_slots(kind, free_slots, loads) for kind in refills_needed if refills_needed[kind] > 0}
+            # the kind that needs the most refills and has a slot its rack may go in; the others pause for refills
+            kind = max((kind for kind in slots if slots[kind]), key=refills_needed.get, default=None)
+            if kind is None:
+                return loads, refills_needed
+            free_slots.remove(slots[kind][0])
+            loads.append((kind, slots[kind][0]))
+
+    def rack_slots(self, kind: str, free_slots: list[str], loads=()) -> list[str]:
+        """
+        Returns the free slots a tip rack for a kind of pickup may go in. A rack is too tall for the nozzles without tips
+        to pass over, so no rack goes behind labware that partial pickups visit, and a rack for partial pickups only goes
+        where partial pickups have room to reach it.
+
+        :param kind: "multi", "partial", "single" or "parked".
+        :param free_slots: The empty slots.
+        :param loads: The (kind of pickup, slot) pairs of the racks that ``rack_plan()`` is about to load.
+        """
+        visited = {int(rack.parent) for rack in self.tip_racks["partial"]}
+        visited.update(int(slot) for load_kind, slot in loads if load_kind == "partial")
+        for planned_kind, wells, labware, tips, parked in self.planned:
+            if planned_kind != "single" and pickup_kind(self.channels(wells, labware)) == "partial":
+                visited.update(self.slot(lw) for lw in labware)
+        slots = [slot for slot in free_slots if int(slot) - 3 not in visited]
+        if kind == "partial":
+            bottom = self.tip_racks["partial"][0].wells()[0].bottom().point.z
+            return [slot for slot in slots if self.slot_has_room(int(slot), bottom)]
+        return slots
+
+    def ensure_tips(self, kind: str, pickups: list[int]):
+        """
+        Pauses the protocol to have the used tip racks replaced if the racks of a kind of pickup don't have enough tips
+        left for a step. The racks of the other kinds are replaced at the same time only if they don't have enough tips
+        left for the rest of the run either, so the pause saves a later one without throwing good tips away.
+
+        :param kind: "multi", "partial" or "single".
+        :param pickups: The number of tips in every pickup of the step.
+        """
+        for tips in pickups:
+            if tips in self.remaining[kind]:
+                self.remaining[kind].remove(tips)
+        used = self.used_tips(kind)
+        if len(fill_columns(used, pickups)) <= len(used):
+            return
+        short = [other for other in ("multi", "partial", "single") if other == kind or len(fill_columns(self.used_tips(other), self.remaining[other])) > len(self.used_tips(other))]
+        # the racks of parked tips stay, since the tips will be used again
+        racks = [rack for other in short for rack in self.tip_racks[other] if rack not in self.tip_racks["parked"]]
+        used_racks = [rack for i, rack in enumerate(racks) if rack not in racks[:i] and not all(well.has_tip for well in rack.wells())]
+        slots = ", ".join(str(rack.parent) for rack in used_racks)
+        self.protocol.pause("Out of tips. Replace the tip racks in slot(s) " + slots + " with full ones, then resume.")
+        for rack in used_racks:
+            rack.reset()
+        # the new racks are full, so start at their first tip
+        if "multi" in short:
+            self.multi_starting_tip = None
+            if self.multi.active_channels == 8:
+                self.multi.starting_tip = None
+        if "single" in short:
+            self.single.starting_tip = None
+
+def pickup_kind(channels: int) -> str:
+    """
+    Returns the kind of pickup ("multi", "partial" or "single") for a number of channels of the 8-channel pipette, with
+    0 for the single-channel pipette.
+
+    :param channels: The number of channels.
+    """
+    return "single" if channels == 0 else "multi" if channels == 8 else "partial"
+
+def visited_wells(wells: list[str], channels: int) -> list[str]:
+    """
+    Returns the wells of a group the pipette is sent to: row A for a full column, the front well of a partial run, and
+    every well for the single-channel pipette.
+
+    :param wells: A group of wells from ``PlateMap.column_plan()``.
+    :param channels: The number of channels of the 8-channel pipette, or 0 for the single-channel pipette.
+    """
+    if channels == 0:
+        return wells
+    return wells[:1] if channels == 8 else wells[-1:]
+
+def can_park(channels: int) -> bool:
+    """
+    Returns whether tips can be parked with a number of channels of the 8-channel pipette, or 0 for the single-channel
+    pipette. Tips can't be returned with a partial nozzle layout.
+
+    :param channels: The number of channels.
+    """
+    return channels in (0, 8)
+
+def new_parked_tips(visits: list[str], channels: int, parked: protocol_api.Labware, seen) -> list[str]:
+    """
+    Returns the wells a step needs new tips for because it uses parked tips: the wells that don't have a parked tip yet,
+    or every well if tips can't be parked with the number of channels.
+
+    :param visits: The wells the pipette is sent to.
+    :param channels: The number of channels of the 8-channel pipette, or 0 for the single-channel pipette.
+    :param parked: The sample plate whose parked tips the step uses, or None.
+    :param seen: The (channels, plate, well) keys of the tips that are already parked.
+    """
+    if parked is None:
+        return []
+    if not can_park(channels):
+        return visits
+    return [well for well in visits if (channels, parked, well) not in seen]
+
+def fill_columns(used: list[int], pickups: list[int]) -> list[int]:
+    """
+    Returns the number of used tips in every column of tip racks after a list of pickups, each taking its tips from the
+    first column that has enough left, with a new column added whenever none has.
+
+    :param used: The number of used tips in every column so far.
+    :param pickups: The number of tips in every pickup.
+    """
+    used = list(used)
+    for tips in pickups:
+        for column, count in enumerate(used):
+            if count + tips <= 8:
+                used[column] += tips
+                break
+        else:
+            used.append(tips)
+    return used
+# <<< lib/column_pipettes.py
+
+# >>> lib/mixing.py (inlined by tools/bundle.py, edit the original instead)
+import math
+
+
+# how long to mix a group of wells when a kit just says "mix well", in seconds
+MIX_WELL_SECONDS = 60
+# the lowest height to mix at, and how far to stay below the top of the liquid or of the well, in mm
+MIX_CLEARANCE = 1
+
+def mix_repetitions(pipette: protocol_api.InstrumentContext, volume: float, seconds: float) -> int:
+    """
+    Returns how many times the pipette can aspirate and dispense a volume in about the given time, at least once.
+
+    :param pipette: The pipette to mix with, at its current flow rates.
+    :param volume: The volume to aspirate and dispense, in µl.
+    :param seconds: How long to mix for.
+    """
+    stroke = volume / pipette.flow_rate.aspirate + volume / pipette.flow_rate.dispense
+    return max(1, round(seconds / stroke))
+
+def liquid_height(well: protocol_api.Well, volume: float) -> float:
+    """
+    Returns the height of a volume of liquid in a well, in mm, assuming straight walls, but at most the depth of the well.
+
+    :param well: The well.
+    :param volume: The volume of liquid in the well, in µl.
+    """
+    if well.diameter is not None:
+        area = math.pi * (well.diameter / 2) ** 2
+    else:
+        area = well.length * well.width
+    return min(well.depth, volume / area)
+
+def mix_for(pipette: protocol_api.InstrumentContext, well: protocol_api.Well, volume: float, seconds: float, liquid_volume: float, levels=3):
+    """
+    Mixes the liquid in a well by aspirating and dispensing for about the given time, moving from the bottom of the
+    well towards the top of the liquid so that beads that have settled at the bottom are mixed in too. The pipette
+    must already have a tip.
+
+    :param pipette: The pipette to mix with.
+    :param well: The well to mix in.
+    :param volume: The volume to aspirate and dispense, in µl.
+    :param seconds: How long to mix for.
+    :param liquid_volume: The volume of liquid in the well, in µl, which decides the highest height to mix at.
+    :param levels: The number of heights to mix at.
+    """
+    repetitions = mix_repetitions(pipette, volume, seconds)
+    levels = min(levels, repetitions)
+    top = max(MIX_CLEARANCE, liquid_height(well, liquid_volume) - MIX_CLEARANCE)
+    for level in range(levels):
+        height = MIX_CLEARANCE + (top - MIX_CLEARANCE) * level / max(1, levels - 1)
+        # spread the repetitions as evenly as possible, with any extra ones at the bottom
+        count = repetitions // levels + (1 if level < repetitions % levels else 0)
+        pipette.mix(repetitions=count, volume=volume, location=well.bottom(z=height))
+# <<< lib/mixing.py
+
+# >>> lib/scheduler.py (inlined by tools/bundle.py, edit the original instead)
+import time
+
+
+# how long a step takes when it doesn't give an estimate of its own, in seconds: about a tip pickup, a few trips to the
+# wells and a tip drop
+STEP_SECONDS = 30.0
+
+class StepScheduler:
+    """
+    Collects the steps of a protocol and runs them as early as their waits allow.
+    """
+
+    def __init__(self, protocol: protocol_api.ProtocolContext, time_scale=1.0):
+        """
+        :param protocol: The protocol context, used for the delays.
+        :param time_scale: How much of every wait to actually wait, e.g. a second for every minute in a rehearsal (see
+            ``Rehearsal``).
+        """
+        self.protocol = protocol
+        self.time_scale = time_scale
+        # the steps still to run, as (action, uses, wait, claims, frees, duration) tuples, in the order they were added
+        self.steps = []
+        # when the last step that used each thing finished, on the scheduler's clock
+        self.finished = {}
+        # when the last step that used each thing finished, on the clock of now()
+        self.finished_at = {}
+        # the time on the scheduler's clock: the estimated durations of the steps run so far and the waits between them
+        self.clock = 0.0
+        # the things that have been claimed and not freed yet
+        self.claimed = set()
+
+    def add(self, action, uses, wait=0.0, claims=(), frees=(), duration=STEP_SECONDS):
+        """
+        Adds a step. Steps that share anything they use always run in the order they were added.
+
+        :param action: A function without arguments that performs the step.
+        :param uses: The things the step uses, e.g. the wells it pipettes to or from. Anything hashable works.
+        :param wait: The time the things the step uses have to rest after the previous step that used them, before
+            this step can start, in seconds.
+        :param claims: Things that only one workflow can have at a time, e.g. the magnetic block, which the step takes
+            until a later step frees them. The step can't start while another step has them.
+        :param frees: Things claimed by an earlier step that are free again once this step is done.
+        :param duration: About how long the step takes, in seconds, which decides the order the steps run in. It doesn't
+            have to be exact, since the waits themselves are measured.
+        """
+        self.steps.append((action, frozenset(uses), wait, frozenset(claims), frozenset(frees), duration))
+
+    def now(self) -> float:
+        """
+        Returns the current time, in seconds: the robot's clock, or the scheduler's clock while the protocol is
+        simulated or analysed.
+        """
+        return self.clock if self.protocol.is_simulating() else time.monotonic()
+
+    def ready_at(self, finished: dict, uses: frozenset, wait: float) -> float:
+        """
+        Returns the time at which a step can start.
+
+        :param finished: When the last step that used each thing finished, on the clock to give the time on
+            (``self.finished`` or ``self.finished_at``).
+        :param uses: The things the step uses.
+        :param wait: The time the things the step uses have to rest.
+        """
+        return max((finished[thing] + wait * self.time_scale for thing in uses if thing in finished), default=0.0)
+
+    def waiting_ahead(self) -> list[float]:
+        """
+        Returns, for every step still to run, how long it and the later steps that use the same things have to wait.
+        """
+        return [
+            step[2] + sum(later[2] for later in self.steps[i + 1:] if not step[1].isdisjoint(later[1]))
+            for i, step in enumerate(self.steps)
+        ]
+
+    def run(self):
+        """
+        Runs every step that has been added, waiting with ``protocol.delay()`` only when no step is ready.
+        """
+        ahead = self.waiting_ahead()
+        while self.steps:
+            blocked = set()
+            chosen = None
+            for i, (action, uses, wait, claims, frees, duration) in enumerate(self.steps):
+                if blocked.isdisjoint(uses) and self.claimed.isdisjoint(claims):
+                    # of the steps that are ready now, run the one with the most waiting ahead of it; if none is
+                    # ready, run the one that is ready first
+                    ready = self.ready_at(self.finished, uses, wait)
+                    rank = (0, -ahead[i]) if ready <= self.clock else (1, ready, -ahead[i])
+                    if chosen is None or rank < chosen[0]:
+                        chosen = (rank, i)
+                blocked.update(uses)
+            if chosen is None:
+                raise RuntimeError(self.deadlock())
+            action, uses, wait, claims, frees, duration = self.steps.pop(chosen[1])
+            ahead.pop(chosen[1])
+            remaining = round(self.ready_at(self.finished_at, uses, wait) - self.now())
+            if remaining > 0:
+                self.protocol.delay(seconds=remaining)
+            self.clock = max(self.clock, self.ready_at(self.finished, uses, wait)) + duration
+            self.claimed.update(claims)
+            action()
+            self.claimed.difference_update(frees)
+            done = self.now()
+            for thing in uses:
+                self.finished[thing] = self.clock
+                self.finished_at[thing] = done
+
+    def deadlock(self) -> str:
+        """
+        Returns the error message for when no step can run: every step left either claims something that a step that
+        has already run claimed and no step freed, or uses something such a step uses.
+        """
+        waiting = [getattr(action, "__qualname__", repr(action)).replace(".<locals>", "") for action, uses, wait, claims, frees, duration in self.steps if not self.claimed.isdisjoint(claims)]
+        return ("No step can run, because " + ", ".join(sorted(map(str, self.claimed))) + " is still claimed and no step "
+                + "frees it. Waiting for it: " + ", ".join(waiting) + ", and " + str(len(self.steps) - len(waiting))
+                + " step(s) after them.")
+# <<< lib/scheduler.py
+
+# >>> lib/well_volumes.py (inlined by tools/bundle.py, edit the original instead)
+import math
+
+
+# how full a liquid waste reservoir may get, as a share of its volume
+WASTE_FILL_SHARE = 0.8
+
+class WellVolumes:
+    """
+    The volume of liquid in every well of one or more plates, in µl. Wells that nothing was added to are empty.
+    """
+
+    def __init__(self):
+        # (plate, well name) -> volume
+        self.volumes = {}
+
+    def __getitem__(self, key: tuple[protocol_api.Labware, str]) -> float:
+        return self.volumes.get(key, 0.0)
+
+    def add(self, plate: protocol_api.Labware, wells: list[str], volume: float):
+        """
+        Records that the same volume was added to every well in a list.
+
+        :param plate: The plate.
+        :param wells: The names of the wells.
+        :param volume: The volume added to each well, in µl.
+        """
+        for well in wells:
+            self.volumes[(plate, well)] = self[(plate, well)] + volume
+
+    def empty(self, plate: protocol_api.Labware, wells: list[str], residual=0.0) -> dict[str, float]:
+        """
+        Records that all liquid but a residual volume was removed from every well in a list, and returns the volume
+        removed from each well.
+
+        :param plate: The plate.
+        :param wells: The names of the wells.
+        :param residual: The volume to leave in each well, in µl.
+        """
+        removed = {}
+        for well in wells:
+            removed[well] = max(0.0, self[(plate, well)] - residual)
+            self.volumes[(plate, well)] = self[(plate, well)] - removed[well]
+        return removed
+
+class LiquidWaste:
+    """
+    The liquid waste reservoirs of a protocol and how much has been discarded into each.
+    """
+
+    def __init__(self, protocol: protocol_api.ProtocolContext, reservoir: protocol_api.Labware, spare_slots: list[str]):
+        """
+        :param protocol: The protocol context, used to load more reservoirs and to pause.
+        :param reservoir: The liquid waste reservoir that is always loaded. Further reservoirs are of the same kind.
+        :param spare_slots: The slots more reservoirs may be loaded into, in the order to use them.
+        """
+        self.protocol = protocol
+        self.reservoirs = [reservoir]
+        self.spare_slots = list(spare_slots)
+        self.capacity = reservoir.wells()[0].max_volume * WASTE_FILL_SHARE
+        # reservoir -> the volume the steps added so far will have discarded into it since it was last emptied
+        self.planned = {}
+        # reservoir -> the volume discarded into it since it was last emptied, while the protocol runs
+        self.volumes = {}
+
+    def plan(self, volume: float) -> list[protocol_api.Labware]:
+        """
+        Records that a step will discard a volume, loading another reservoir if none of them has room left for it, and
+        returns the reservoirs it may go into: the one it is planned for and the ones before it. Call this when the step
+        is added, and pass the reservoirs to ``dispose()`` when it runs.
+
+        :param volume: The volume, in µl.
+        """
+        reservoir = self.first_with_room(self.planned, volume, self.reservoirs)
+        if reservoir is None and self.spare_slots:
+            reservoir = self.protocol.load_labware(self.reservoirs[0].load_name, self.spare_slots.pop(0))
+            self.reservoirs.append(reservoir)
+        if reservoir is None:
+            # the protocol will pause for the reservoirs to be emptied
+            self.planned = {}
+            reservoir = self.reservoirs[0]
+        self.planned[reservoir] = self.planned.get(reservoir, 0.0) + volume
+        return self.reservoirs[:self.reservoirs.index(reservoir) + 1]
+
+    def dispose(self, volume: float, reservoirs: list[protocol_api.Labware]) -> protocol_api.Well:
+        """
+        Returns the well to discard a volume into and records it, pausing the protocol for the reservoirs to be emptied
+        if none of the given ones has room left. Call this when the step runs.
+
+        :param volume: The volume, in µl.
+        :param reservoirs: The reservoirs from ``plan()``.
+        """
+        reservoir = self.first_with_room(self.volumes, volume, reservoirs)
+        if reservoir is not None:
+            self.volumes[reservoir] = self.volumes.get(reservoir, 0.0) + volume
+            return reservoir.wells()[0]
+        slots = ", ".join(str(reservoir.parent) for reservoir in self.reservoirs)
+        self.protocol.pause("The liquid waste is full. Empty the reservoirs in slot(s) " + slots + ", then resume.")
+        self.volumes = {}
+        return self.dispose(volume, reservoirs)
+
+    def first_with_room(self, volumes: dict, volume: float, reservoirs: list[protocol_api.Labware]) -> protocol_api.Labware:
+        """
+        Returns the first of the reservoirs with room left for a volume, or None.
+
+        :param volumes: Reservoir -> the volume discarded into it so far.
+        :param volume: The volume, in µl.
+        :param reservoirs: The reservoirs, in the order to fill them.
+        """
+        return next((reservoir for reservoir in reservoirs if volumes.get(reservoir, 0.0) + volume <= self.capacity), None)
+
+def split_volume(volume: float, max_volume: float) -> list[float]:
+    """
+    Splits a volume into as few equal parts as possible that each fit in a tip.
+
+    :param volume: The volume, in µl.
+    :param max_volume: The largest volume the tip holds, in µl.
+    """
+    trips = math.ceil(volume / max_volume)
+    if trips == 0:
+        return []
+    return [volume / trips] * trips
+# <<< lib/well_volumes.py
+
+# >>> lib/reagents.py (inlined by tools/bundle.py, edit the original instead)
+import math
+
+
+
+# the volume that can't be aspirated from a well of these labware, in µl (about 2 mm of liquid in a reservoir)
+DEAD_VOLUMES = {
+    "nest_12_reservoir_15ml": 1200,
+    "nest_1_reservoir_195ml": 15000,
+    "opentrons_24_tuberack_eppendorf_1.5ml_safelock_snapcap": 50,
+}
+# the share of a well's volume that can't be aspirated from it, for other labware
+DEAD_VOLUME_SHARE = 0.1
+
+def dead_volume(well: protocol_api.Well) -> float:
+    """
+    Returns the volume that can't be aspirated from a well, in µl.
+
+    :param well: The well.
+    """
+    return DEAD_VOLUMES.get(well.parent.load_name, well.max_volume * DEAD_VOLUME_SHARE)
+
+def usable_volume(well: protocol_api.Well) -> float:
+    """
+    Returns the most that can be aspirated from a well when it is full, in µl.
+
+    :param well: The well.
+    """
+    return well.max_volume - dead_volume(well)
+
+class ReagentPlanner:
+    """
+    Assigns the reagents of a protocol to reservoir wells, works out how much to load into each, and pauses to have them
+    refilled when a run needs more than they hold.
+    """
+
+    def __init__(self, protocol: protocol_api.ProtocolContext):
+        """
+        :param protocol: The protocol context, used to pause for refills.
+        """
+        self.protocol = protocol
+        # liquid -> the wells it may be loaded into, in the order to use them
+        self.wells = {}
+        # liquid -> the wells in use, with the volume drawn from each over the whole run so far, in order
+        self.drawn = {}
+        # the wells that have been given to a reagent
+        self.taken = []
+        # well -> the volume that can still be aspirated from it, and the volume the steps that haven't run yet will
+        # draw from it, while the protocol runs
+        self.left = {}
+        self.pending = {}
+
+    def add(self, liquid: protocol_api.Liquid, wells: list[protocol_api.Well]):
+        """
+        Adds a reagent. Several reagents can share the same list of wells; each well goes to the first reagent that
+        needs it, but every reagent that may use a list keeps at least one well of it.
+
+        :param liquid: The reagent, from ``protocol.define_liquid()``.
+        :param wells: The wells the reagent may be loaded into, in the order to use them.
+        """
+        self.wells[liquid] = wells
+        self.drawn[liquid] = []
+
+    def free_wells(self, liquid: protocol_api.Liquid) -> list[protocol_api.Well]:
+        """
+        Returns the wells a reagent may take: the ones nobody has taken yet, apart from one for every other reagent
+        that may use them and has none yet.
+
+        :param liquid: The reagent.
+        """
+        free = [well for well in self.wells[liquid] if well not in self.taken]
+        waiting = [
+            other for other, wells in self.wells.items()
+            if other != liquid and not self.drawn[other] and any(well in free for well in wells)
+        ]
+        # a reagent without a well may always take one
+        return free[:max(0 if self.drawn[liquid] else 1, len(free) - len(waiting))]
+
+    def draw(self, liquid: protocol_api.Liquid, volume: float, wells: list[str]) -> protocol_api.Well:
+        """
+        Returns the well to aspirate a reagent from for one trip of the pipette to a group of samples, and records the
+        volume drawn from it.
+
+        :param liquid: The reagent.
+        :param volume: The volume added to each sample in the trip, in µl.
+        :param wells: The names of the sample wells in the group.
+        """
+        needed = volume * len(wells)
+        drawn = self.drawn[liquid]
+        if drawn and drawn[-1][1] + needed <= usable_volume(drawn[-1][0]):
+            drawn[-1][1] += needed
+            return drawn[-1][0]
+        for well in self.free_wells(liquid):
+            if needed <= usable_volume(well):
+                self.taken.append(well)
+                drawn.append([well, needed])
+                return well
+        # no free well is left, so the reagent's wells are refilled while the protocol runs, the emptiest first
+        candidates = [entry for entry in drawn if needed <= usable_volume(entry[0])]
+        if not candidates:
+            raise ValueError("There is no reservoir well large enough for a single trip of " + liquid.name + ".")
+        entry = min(candidates, key=lambda entry: entry[1] / usable_volume(entry[0]))
+        entry[1] += needed
+        # later trips go on drawing from the same well
+        drawn.remove(entry)
+        drawn.append(entry)
+        return entry[0]
+
+    def draw_trips(self, liquid: protocol_api.Liquid, volume: float, wells: list[str], max_volume: float) -> list[protocol_api.Well]:
+        """
+        Returns the wells to aspirate a reagent from for a group of samples, one for each trip of the pipette from
+        ``split_volume()``, and records the volumes drawn from them.
+
+        :param liquid: The reagent.
+        :param volume: The volume added to each sample, in µl.
+        :param wells: The names of the sample wells in the group.
+        :param max_volume: The largest volume the tip holds, in µl.
+        """
+        return [self.draw(liquid, part, wells) for part in split_volume(volume, max_volume)]
+
+    def load_liquids(self):
+        """
+        Loads every reagent into the wells it was assigned, with the volume drawn from each well (or as much as the
+        well holds) and its dead volume, and announces how often the protocol will pause for refills.
+        """
+        refills = 0
+        for liquid, drawn in self.drawn.items():
+            for well, volume in drawn:
+                load = min(volume, usable_volume(well))
+                well.parent.load_liquid(wells=[well], volume=load + dead_volume(well), liquid=liquid)
+                self.left[well] = load
+                self.pending[well] = volume
+                refills = max(refills, math.ceil(volume / usable_volume(well)) - 1)
+        if refills > 0:
+            self.protocol.comment("The run needs more reagents than the reservoirs hold, so it will pause about " + str(refills) + " time(s) to have them refilled.")
+
+    def take(self, wells: list[protocol_api.Well], volume: float):
+        """
+        Records that a step draws a volume from each of a list of wells, like the ones from ``draw_trips()``, pausing
+        the protocol first to have the wells that are running low refilled if one of them doesn't have enough left.
+        Call this when the step runs, before it picks up a tip.
+
+        :param wells: The wells the step aspirates from, once for every trip.
+        :param volume: The volume drawn from a well in every trip, in µl (the volume of a trip times the number of
+            samples in the group).
+        """
+        needed = {}
+        for well in wells:
+            needed[well] = needed.get(well, 0.0) + volume
+        if any(needed[well] > self.left[well] + 1e-6 for well in needed):
+            self.refill()
+        for well in needed:
+            self.left[well] -= needed[well]
+            self.pending[well] -= needed[well]
+
+    def refill(self):
+        """
+        Pauses the protocol to have every reagent well that won't cover the draws still to come topped up, as far as
+        those draws need and the well holds.
+        """
+        names = {well: liquid.name for liquid, drawn in self.drawn.items() for well, volume in drawn}
+        refills = []
+        for well in self.left:
+            volume = min(self.pending[well], usable_volume(well)) - self.left[well]
+            if self.left[well] < self.pending[well] - 1e-6 and volume > 0:
+                refills.append(str(round(volume)) + " µL of " + names[well] + " to " + well.well_name + " in slot " + str(well.parent.parent))
+                self.left[well] += volume
+        self.protocol.pause("The reagents are running low. Add " + ", ".join(refills) + ", then resume.")
+# <<< lib/reagents.py
+
+# >>> lib/rehearsal.py (inlined by tools/bundle.py, edit the original instead)
+# how much of every wait is waited in a rehearsal: a second for every minute
+REHEARSAL_TIME_SCALE = 1 / 60
+
+class Rehearsal:
+    """
+    What a rehearsal changes about a run. Outside of a rehearsal, everything is left as it is.
+    """
+
+    def __init__(self, enabled: bool, above_liquid=False):
+        """
+        :param enabled: Whether the run is a rehearsal.
+        :param above_liquid: Whether to aspirate and mix at the top of the wells in a rehearsal.
+        """
+        self.enabled = enabled
+        self.above_liquid = enabled and above_liquid
+
+    @property
+    def time_scale(self) -> float:
+        """How much of every wait to wait, for ``StepScheduler``."""
+        return REHEARSAL_TIME_SCALE if self.enabled else 1.0
+
+    def mix_seconds(self, seconds: float) -> float:
+        """
+        Returns how long to mix for, which in a rehearsal is no time at all, so ``mix_repetitions()`` gives a single
+        stroke.
+
+        :param seconds: How long to mix for in a run.
+        """
+        return 0.0 if self.enabled else seconds
+
+    def repetitions(self, repetitions: int) -> int:
+        """
+        Returns how many times to mix, which in a rehearsal is once.
+
+        :param repetitions: How many times to mix in a run.
+        """
+        return 1 if self.enabled else repetitions
+
+    def location(self, location):
+        """
+        Returns where to aspirate or mix: the given location, or the top of its well in a rehearsal above the liquid.
+
+        :param location: A well, or a location in a well.
+        """
+        if not self.above_liquid:
+            return location
+        well = location if isinstance(location, protocol_api.Well) else location.labware.as_well()
+        return well.top()
+
+    def mix_for(self, pipette: protocol_api.InstrumentContext, well: protocol_api.Well, volume: float, seconds: float, liquid_volume: float):
+        """
+        Mixes like ``mix_for()``, which in a rehearsal is a single stroke.
+
+        :param pipette: The pipette to mix with.
+        :param well: The well to mix in.
+        :param volume: The volume to aspirate and dispense, in µl.
+        :param seconds: How long to mix for in a run.
+        :param liquid_volume: The volume of liquid in the well, in µl.
+        """
+        if self.above_liquid:
+            pipette.mix(repetitions=1, volume=volume, location=well.top())
+        else:
+            mix_for(pipette, well, volume, self.mix_seconds(seconds), liquid_volume)
+# <<< lib/rehearsal.py
+
 # copy and paste from a spreadsheet or manually change values here to specify which wells contain samples
-# IMPORTANT: ensure that one column is fully filled before moving on to the next one
+# this is only used if no CSV file is uploaded for the "sample_wells_csv" parameter
 sample_wells_data = """
 	1	2	3	4	5	6	7	8	9	10	11	12
 A	TRUE	FALSE	FALSE	FALSE	FALSE	FALSE	FALSE	FALSE	FALSE	FALSE	FALSE	FALSE
@@ -26,37 +1270,62 @@ F	FALSE	FALSE	FALSE	FALSE	FALSE	FALSE	FALSE	FALSE	FALSE	FALSE	FALSE	FALSE
 G	FALSE	FALSE	FALSE	FALSE	FALSE	FALSE	FALSE	FALSE	FALSE	FALSE	FALSE	FALSE
 H	FALSE	FALSE	FALSE	FALSE	FALSE	FALSE	FALSE	FALSE	FALSE	FALSE	FALSE	FALSE
 """
-sample_wells_data = sample_wells_data.replace('\t', ',')
+
+def add_parameters(parameters: protocol_api.Parameters):
+    parameters.add_bool(
+        variable_name="partial_tips",
+        display_name="Partial tip pickup",
+        description="Pick up fewer tips with the 8-channel pipette for partially filled columns.",
+        default=True
+    )
+    parameters.add_bool(
+        variable_name="tip_refills",
+        display_name="Tip refills",
+        description="Pause to replace used tip racks if the run needs more tips than the deck holds.",
+        default=True
+    )
+    parameters.add_bool(
+        variable_name="park_tips",
+        display_name="Parked tips",
+        description="Return each column's tip to its rack and reuse it to mix and remove supernatant.",
+        default=False
+    )
+    parameters.add_bool(
+        variable_name="rehearsal_mode",
+        display_name="Rehearsal",
+        description="Make every move to check the deck, but wait a second per minute and mix only once.",
+        default=False
+    )
+    parameters.add_bool(
+        variable_name="rehearsal_above_liquid",
+        display_name="Rehearse above liquid",
+        description="In a rehearsal, aspirate and mix at the top of the wells instead of in the liquid.",
+        default=False
+    )
+    parameters.add_float(
+        variable_name="supernatant_residual",
+        display_name="Supernatant residual",
+        description="The volume of liquid to leave in each well when removing the supernatant.",
+        default=5,
+        minimum=0,
+        maximum=50,
+        unit="µL"
+    )
+    parameters.add_csv_file(
+        variable_name="sample_wells_csv",
+        display_name="Sample wells",
+        description="Optional CSV plate map of the wells with samples. Otherwise uses the map in the file."
+    )
 
 # the actual protocol
 def run(protocol: protocol_api.ProtocolContext):
     # get all the necessary information about which wells contain samples
-    csv_wells_data = sample_wells_data.splitlines()[1:]
-    wells_data_reader = csv.DictReader(csv_wells_data)
-    
-    selected_wells = []
-    for row in wells_data_reader:
-        r = row[""]
-        for i in range(1,13):
-            new_key = r + str(i)
-            row[new_key] = row.pop(f'{i}')
-        del row[""]
-        keys = list(row.keys())
-        true_keys = []
-        for key in keys:
-            if row[key] == "TRUE":
-                true_keys.append(key)
-        selected_wells.extend(true_keys)
-    
-    cols = math.ceil(len(selected_wells) / 8)
-    
-    sample_wells = []
-    for i in range(cols):
-        start_index = 8 * i
-        if i == cols-1:
-            sample_wells.insert(i, selected_wells[start_index:])
-        else:
-            sample_wells.insert(i, selected_wells[start_index:start_index+8])
+    # use the uploaded plate map if there is one, otherwise the one pasted into this file
+    try:
+        plate_map = PlateMap.parse(protocol.params.sample_wells_csv.contents)
+    except protocol_api.RuntimeParameterRequiredError:
+        plate_map = PlateMap.parse(sample_wells_data)
+    selected_wells = plate_map.wells()
     
     dna_plate = protocol.load_labware("greinerbioonegmbh_96_wellplate_2000ul", 5)
     rna_plate = protocol.load_labware("greinerbioonegmbh_96_wellplate_2000ul", 6)
@@ -71,79 +1340,51 @@ def run(protocol: protocol_api.ProtocolContext):
     )
     
     reservoir_1 = protocol.load_labware("nest_12_reservoir_15ml", 2)
+    reservoir_2 = protocol.load_labware("nest_12_reservoir_15ml", 3)
+    # the reagents are given reservoir wells as the steps need them, and loaded with the volumes the steps use
+    # (see ReagentPlanner); a full plate needs more than both reservoirs hold, so every reagent may use the wells of
+    # either, and they are refilled while the protocol runs
+    reagents = ReagentPlanner(protocol)
     dna_rna_lysis_buffer = protocol.define_liquid(
         name="DNA/RNA Lysis Buffer",
         display_color="#FBB4AE"
     )
-    reservoir_1.load_liquid(
-        wells=reservoir_1.wells()[0:4],
-        volume=500,
-        liquid=dna_rna_lysis_buffer
-    )
+    reagents.add(dna_rna_lysis_buffer, reservoir_1.wells() + reservoir_2.wells())
     wash_1 = protocol.define_liquid(
         name="Wash 1",
         display_color="#B3CDE3"
     )
-    reservoir_1.load_liquid(
-        wells=reservoir_1.wells()[4:8],
-        volume=500,
-        liquid=wash_1
-    )
+    reagents.add(wash_1, reservoir_1.wells() + reservoir_2.wells())
     wash_2 = protocol.define_liquid(
         name="Wash 2",
         display_color="#DECBE4"
     )
-    reservoir_1.load_liquid(
-        wells=reservoir_1.wells()[8:12],
-        volume=500,
-        liquid=wash_2
-    )
-    reservoir_2 = protocol.load_labware("nest_12_reservoir_15ml", 3)
+    reagents.add(wash_2, reservoir_1.wells() + reservoir_2.wells())
     dnase_rnase_free_water = protocol.define_liquid(
         name="DNase/RNase-Free Water",
         display_color="#FAE68E"
     )
-    reservoir_2.load_liquid(
-        wells=reservoir_2.wells()[0:2],
-        volume=500,
-        liquid=dnase_rnase_free_water
-    )
+    reagents.add(dnase_rnase_free_water, reservoir_2.wells() + reservoir_1.wells())
     ethanol = protocol.define_liquid(
         name="Ethanol (95-100%)",
         display_color="#FF9AD0"
     )
-    reservoir_2.load_liquid(
-        wells=reservoir_2.wells()[2:6],
-        volume=500,
-        liquid=ethanol
-    )
+    reagents.add(ethanol, reservoir_2.wells() + reservoir_1.wells())
     dnase_i_reaction_mix = protocol.define_liquid(
         name="DNase I Reaction Mix",
         display_color="#9BE3D7"
     )
-    reservoir_2.load_liquid(
-        wells=[reservoir_2.wells()[6]],
-        volume=500,
-        liquid=dnase_i_reaction_mix
-    )
+    reagents.add(dnase_i_reaction_mix, reservoir_2.wells() + reservoir_1.wells())
     dna_rna_prep_buffer = protocol.define_liquid(
         name="DNA/RNA Prep Buffer",
         display_color="#FEC794"
     )
-    reservoir_2.load_liquid(
-        wells=reservoir_2.wells()[7:9],
-        volume=500,
-        liquid=dna_rna_prep_buffer
-    )
+    reagents.add(dna_rna_prep_buffer, reservoir_2.wells() + reservoir_1.wells())
     beads = protocol.define_liquid(
         name="MagBeads",
         display_color="#727272"
     )
-    reservoir_2.load_liquid(
-        wells=[reservoir_2.wells()[9]],
-        volume=100,
-        liquid=beads
-    )
+    reagents.add(beads, reservoir_2.wells() + reservoir_1.wells())
     
     dna_magnet_plate = protocol.load_labware("96well_plate_2000ul_on_magnet_plate", protocol_api.OFF_DECK)
     rna_magnet_plate = protocol.load_labware("96well_plate_2000ul_on_magnet_plate", protocol_api.OFF_DECK)
@@ -154,210 +1395,277 @@ def run(protocol: protocol_api.ProtocolContext):
     
     tips_1 = protocol.load_labware("opentrons_96_tiprack_300ul", 1)
     left_pipette = protocol.load_instrument("p300_single_gen2", "left", tip_racks=[tips_1])
-    tips_2 = protocol.load_labware("opentrons_96_tiprack_300ul", 4)
+    tips_2 = protocol.load_labware("opentrons_96_tiprack_300ul", 11)
     right_pipette = protocol.load_instrument("p300_multi_gen2", "right", tip_racks=[tips_2])
     
-    def add_and_mix(vol: float, source: list[protocol_api.Well], dest: protocol_api.Labware, mix_vol=250.0):
+    # the groups of wells that are pipetted together: full columns, and runs of samples in partially filled columns,
+    # which are pipetted with fewer tips on the 8-channel pipette where there is room for it (see ColumnPipettes)
+    column_plan = plate_map.column_plan()
+    if protocol.params.partial_tips and any(1 < len(wells) < 8 for col, wells in column_plan):
+        partial_tip_racks = [protocol.load_labware("opentrons_96_tiprack_300ul", 4)]
+    else:
+        partial_tip_racks = []
+    pipettes = ColumnPipettes(protocol, right_pipette, left_pipette, partial_tip_racks)
+    
+    # in a rehearsal, every move is made, but the waits and mixes are cut short (see Rehearsal)
+    rehearsal = Rehearsal(protocol.params.rehearsal_mode, protocol.params.rehearsal_above_liquid)
+    
+    # the steps of both workflows are added to a scheduler, which interleaves them: while the beads of one plate
+    # pellet or dry, it works on the other plate (see StepScheduler)
+    scheduler = StepScheduler(protocol, rehearsal.time_scale)
+    # the labware each sample plate becomes when it's put on the magnetic block
+    magnet_plates = {dna_plate: dna_magnet_plate, rna_plate: rna_magnet_plate}
+    # the steps on the magnet plan and pick with the labware the plate becomes, which takes the plate's place
+    for plate, magnet_plate in magnet_plates.items():
+        pipettes.stand_in(magnet_plate, plate)
+    # the volume of liquid in every well of the plates, which decides how much supernatant to remove
+    volumes = WellVolumes()
+    volumes.add(dna_plate, selected_wells, 200)
+    # the supernatant goes into another liquid waste reservoir in slot 10 if one isn't enough (see LiquidWaste)
+    waste = LiquidWaste(protocol, liquid_waste, ["10"])
+    
+    def for_each_group(step, plates: list[protocol_api.Labware], wait=0.0, duration=STEP_SECONDS):
+        """
+        Adds a step for every group of wells in `column_plan` to the scheduler.
+        
+        :param step: A function that takes the column index and the wells of a group and performs the step for them.
+        :param plates: The sample plates whose wells the step uses. The scheduler tells the wells of different plates
+            apart as (plate, well name) pairs.
+        :param wait: The time the wells have to rest after the previous step before this one, in seconds.
+        :param duration: About how long the step takes for a group, in seconds, which decides the order the scheduler
+            runs the steps in.
+        """
+        for col, wells in column_plan:
+            scheduler.add(lambda col=col, wells=wells: step(col, wells), [(plate, well) for plate in plates for well in wells], wait, duration=duration)
+    
+    def add_and_mix(vol: float, source: protocol_api.Liquid, dest: protocol_api.Labware, mix_vol=250.0, mix_seconds=MIX_WELL_SECONDS, wait=0.0, parked_tip=True):
         """
         Transfers the specified volume of liquid from the specified source to the sample plate and mixes.
         
         :param vol: The volume to be transferred, in µl.
-        :param source: A list of wells containing the liquid to be aspirated. `add_and_mix` automatically calculates the index of the source to access.
+        :param source: The reagent to be transferred. `reagents` decides which reservoir well to aspirate it from.
         :param dest: The destination plate in which to dispense the liquid.
         :param mix_vol: The amount to pipette up and down when mixing.
+        :param mix_seconds: How long to mix each well (or column) for, in seconds.
+        :param wait: The time the wells have to rest after the previous step before adding the liquid, in seconds.
+        :param parked_tip: Whether to mix with the parked tips of the plate if the "park_tips" parameter is on.
         """
-        for i in range(cols):
-            src = source[i // (12 // len(source))]
-            if i == cols-1:
-                for well in sample_wells[i]:
-                    left_pipette.transfer(volume=vol, source=src, dest=dest[well], blow_out=True, blowout_location="destination well", new_tip="always", mix_after=(50, mix_vol))
-            else:
-                loc = "A" + str(i+1)
-                right_pipette.transfer(volume=vol, source=src, dest=dest[loc], blow_out=True, blowout_location="destination well", new_tip="always", mix_after=(50, mix_vol))
+        volumes.add(dest, selected_wells, vol)
+        # `transfer()` makes a trip for every part of the volume, and each trip may come from another well
+        parts = split_volume(vol, right_pipette.max_volume)
+        sources = {wells[0]: reagents.draw_trips(source, vol, wells, right_pipette.max_volume) for col, wells in column_plan}
+        park = dest if protocol.params.park_tips and parked_tip else None
+        # `transfer()` picks up a new tip for every trip, but with a parked tip the liquid is dispensed from above with
+        # a single tip that never touches the sample, and mixed in with the parked tip
+        tips = len(parts) if park is None else 1
+        for col, wells in column_plan:
+            pipettes.plan(wells, *[src.parent for src in sources[wells[0]]], dest, tips=tips, parked=park)
+        def step(col: int, wells: list[str]):
+            srcs = sources[wells[0]]
+            reagents.take(srcs, parts[0] * len(wells))
+            pipette, wells = pipettes.pick(wells, *[src.parent for src in srcs], dest, tips=tips, parked=park)
+            src_locations = [rehearsal.location(src) for src in srcs]
+            for well in wells:
+                if park is None:
+                    pipette.transfer(volume=parts, source=src_locations, dest=[rehearsal.location(dest[well])] * len(parts), blow_out=True, blowout_location="destination well", new_tip="always", mix_after=(mix_repetitions(pipette, mix_vol, rehearsal.mix_seconds(mix_seconds)), mix_vol))
+                else:
+                    pipette.transfer(volume=parts, source=src_locations, dest=[dest[well].top()] * len(parts), blow_out=True, blowout_location="destination well", new_tip="once")
+                    pipettes.pick_up_tip(pipette, well, park)
+                    pipette.mix(repetitions=mix_repetitions(pipette, mix_vol, rehearsal.mix_seconds(mix_seconds)), volume=mix_vol, location=rehearsal.location(dest[well]))
+                    pipettes.drop_tip(pipette, park)
+        for_each_group(step, [dest], wait, duration=STEP_SECONDS + rehearsal.mix_seconds(mix_seconds))
     
-    def aspirate_supernatant(num_aspirations: int, source: protocol_api.Labware, dest: protocol_api.Labware):
+    def aspirate_supernatant(source: protocol_api.Labware, dest: protocol_api.Labware, wait=60.0, residual=None):
         """
         Aspirates and discards the supernatant after the MagBeads have been pelleted from the solution.
         
-        :param num_aspirations: The number of times to aspirate the supernatant from any one well.
-        :param source: The plate from which to aspirate the supernatant.
+        :param source: The sample plate from which to aspirate the supernatant. It has to be on the magnetic block.
         :param dest: The location in which to dispense the supernatant.
+        :param wait: The time to let the beads pellet before aspirating, in seconds.
+        :param residual: The volume of liquid to leave in each well, in µl. By default the "supernatant_residual"
+            parameter.
+        """
+        if residual is None:
+            residual = protocol.params.supernatant_residual
+        removed = volumes.empty(source, selected_wells, residual)
+        # the wells of a group are emptied together, so aspirate what the fullest one holds
+        group_volumes = {wells[0]: max(removed[well] for well in wells) for col, wells in column_plan}
+        if dest != liquid_waste:
+            for well in selected_wells:
+                volumes.add(dest, [well], removed[well])
+        # the supernatant only goes into the waste with the parked tips, never into another plate
+        park = source if protocol.params.park_tips and dest == liquid_waste else None
+        # the labware every group dispenses into: the waste reservoirs it may discard into, which it is planned and
+        # picked with, so a group that may go into a spare reservoir partial pickups can't reach is counted for the
+        # pipette it will use
+        dests = {}
+        magnet_plate = magnet_plates[source]
+        for col, wells in column_plan:
+            if group_volumes[wells[0]] > 0:
+                dests[wells[0]] = waste.plan(group_volumes[wells[0]] * len(wells)) if dest == liquid_waste else [dest]
+                pipettes.plan(wells, magnet_plate, *dests[wells[0]], tips=1 if park is None else 0, parked=park)
+        def step(col: int, wells: list[str]):
+            volume = group_volumes[wells[0]]
+            if volume == 0:
+                return
+            # the liquid waste reservoirs only have one well
+            waste_well = waste.dispose(volume * len(wells), dests[wells[0]]) if dest == liquid_waste else None
+            pipette, wells = pipettes.pick(wells, magnet_plate, *dests[wells[0]], tips=1 if park is None else 0, parked=park)
+            for well in wells:
+                dest_well = waste_well if waste_well else dest[well]
+                pipettes.pick_up_tip(pipette, well, park)
+                for part in split_volume(volume, pipette.max_volume):
+                    pipette.aspirate(location=rehearsal.location(magnet_plate[well].bottom()), volume=part)
+                    # a parked tip stays clear of the waste
+                    pipette.dispense(location=dest_well.bottom(z=5) if park is None else dest_well.top())
+                pipettes.drop_tip(pipette, park)
+        for_each_group(step, [plate for plate in magnet_plates if plate in (source, dest)], wait)
+    
+    def to_magnet(plate: protocol_api.Labware, wait=0.0):
+        """
+        Transfers a sample plate to the magnetic block, in the slot the plate is in. The block stays taken until the
+        plate is removed again with `off_magnet`.
+        
+        :param plate: The sample plate.
+        :param wait: The time to let the wells sit after the last step before moving the plate, in seconds.
+        """
+        def step():
+            slot = plate.parent
+            protocol.move_labware(plate, new_location=protocol_api.OFF_DECK)
+            protocol.move_labware(magnet_plates[plate], new_location=slot)
+        scheduler.add(step, [(plate, well) for well in selected_wells], wait, claims=["magnetic block"])
+    
+    def off_magnet(plate: protocol_api.Labware, wait=0.0, put_back=True):
         """
-        for i in range(cols):
-            if i == cols-1:
-                for well in sample_wells[i]:
-                    left_pipette.pick_up_tip()
-                    for j in range(num_aspirations):
-                        left_pipette.aspirate(location=source[well].bottom(z=-1), volume=250)
-                        left_pipette.dispense(location=dest[well].bottom(z=5))
-                    left_pipette.drop_tip()
-            else:
-                loc = "A" + str(i+1)
-                right_pipette.pick_up_tip()
-                for j in range(num_aspirations):
-                    right_pipette.aspirate(location=source[loc].bottom(z=-1), volume=250)
-                    right_pipette.dispense(location=dest[loc].bottom(z=5))
-                right_pipette.drop_tip()
+        Removes a sample plate from the magnetic block.
+        
+        :param plate: The sample plate.
+        :param wait: The time to leave the plate on the magnetic block after the last step, in seconds.
+        :param put_back: Whether to put the sample plate back in its slot, or to leave it off the deck.
+        """
+        def step():
+            slot = magnet_plates[plate].parent
+            protocol.move_labware(magnet_plates[plate], new_location=protocol_api.OFF_DECK)
+            if put_back:
+                protocol.move_labware(plate, new_location=slot)
+        scheduler.add(step, [(plate, well) for well in selected_wells], wait, frees=["magnetic block"])
     
-    def add_mix_pellet_aspirate(vol: float, source: list[protocol_api.Well], dest: protocol_api.Labware, num_aspirations: int, source_2: protocol_api.Labware, dest_2: protocol_api.Labware, remove_magnet=True):
+    def add_mix_pellet_aspirate(vol: float, source: protocol_api.Liquid, dest: protocol_api.Labware, dest_2: protocol_api.Labware, remove_magnet=True, wait=0.0, incubate=0.0):
         """
         Calls `add_and_mix`, transfers the sample plate to the magnetic block, calls `aspirate_supernatant`, and
         removes the sample plate from the magnetic block.
         
         :param vol: The volume to be transferred, in µl, for `add_and_mix`.
-        :param source: A list of wells containing the liquid to be aspirated for `add_and_mix`. The index of the source to access is automatically calculated.
+        :param source: The reagent to be transferred for `add_and_mix`.
         :param dest: The destination plate in which to dispense the liquid for `add_and_mix`.
-        :param num_aspirations: The number of times to aspirate the supernatant from any one well for `aspirate_supernatant`.
-        :param source_2: The plate from which to aspirate the supernatant for `aspirate_supernatant`.
         :param dest_2: The location in which to dispense the supernatant for `aspirate_supernatant`.
         :param remove_magnet: Whether or not to remove the plate from the magnet at the end of the function.
+        :param wait: The time the wells have to rest after the previous step before the reagent is added, in seconds.
+        :param incubate: The time to let the wells incubate after they are mixed before moving the plate to the magnetic
+            block, in seconds.
         """
-        add_and_mix(vol, source, dest)
-        new_loc = "5"
-        if dest == rna_plate:
-            new_loc = "6"
-        protocol.move_labware(dest, new_location=protocol_api.OFF_DECK)
-        protocol.move_labware(source_2, new_location=new_loc)
-        protocol.delay(minutes=1)
-        aspirate_supernatant(num_aspirations, source_2, dest_2)
+        add_and_mix(vol, source, dest, wait=wait)
+        to_magnet(dest, incubate)
+        aspirate_supernatant(dest, dest_2)
         if remove_magnet:
-            protocol.move_labware(source_2, new_location=protocol_api.OFF_DECK)
-            protocol.move_labware(dest, new_location=new_loc)
+            off_magnet(dest)
     
-    def mix_beads(pipette: protocol_api.InstrumentContext, well: protocol_api.Well):
-        if pipette == left_pipette:
-            height = 0
-            for j in range(50):
-                left_pipette.aspirate(volume=250, location=dna_plate[well].bottom(z=height))
-                left_pipette.dispense(location=dna_plate[well].bottom(z=height))
-                height += 2
-        else:
-            height = 0
-            for j in range(50):
-                right_pipette.aspirate(volume=250, location=dna_plate[well].bottom(z=height))
-                right_pipette.dispense(location=dna_plate[well].bottom(z=height))
-                height += 2
+    def add_beads(dest: protocol_api.Labware):
+        """
+        Adds 30µl MagBinding Beads to every sample and mixes them in. The wells incubate with the beads until the plate
+        goes on the magnetic block, so the kit's mixing time is the wait of `to_magnet`.
+        
+        :param dest: The sample plate.
+        """
+        volumes.add(dest, selected_wells, 30)
+        liquid_volumes = {well: volumes[(dest, well)] for well in selected_wells}
+        sources = {wells[0]: reagents.draw(beads, 30, wells) for col, wells in column_plan}
+        for col, wells in column_plan:
+            pipettes.plan(wells, sources[wells[0]].parent, dest)
+        def step(col: int, wells: list[str]):
+            src = sources[wells[0]]
+            reagents.take([src], 30 * len(wells))
+            pipette, wells = pipettes.pick(wells, src.parent, dest)
+            for well in wells:
+                pipette.pick_up_tip()
+                pipette.mix(repetitions=rehearsal.repetitions(5), volume=40, location=rehearsal.location(src))
+                pipette.aspirate(30, location=rehearsal.location(src))
+                pipette.dispense(location=dest[well])
+                rehearsal.mix_for(pipette, dest[well], 250, MIX_WELL_SECONDS, liquid_volumes[well])
+                pipette.drop_tip()
+        for_each_group(step, [dest], duration=STEP_SECONDS + rehearsal.mix_seconds(MIX_WELL_SECONDS))
     
     # 1. add 500µl (2.5 volumes) DNA/RNA Lysis Buffer to the 200µl sample and mix well
-    add_and_mix(500, reservoir_1.wells()[0:4], dna_plate)
+    add_and_mix(500, dna_rna_lysis_buffer, dna_plate)
     
     # 2. add 30µl MagBinding Beads and mix well for 20 minutes
-    for i in range(cols):
-        if i == cols-1:
-            for well in sample_wells[i]:
-                left_pipette.pick_up_tip()
-                left_pipette.mix(repetitions=5, volume=40, location=reservoir_2.wells()[9])
-                left_pipette.aspirate(30, location=reservoir_2.wells()[9])
-                left_pipette.dispense(location=dna_plate[well])
-                mix_beads(left_pipette, well)
-                left_pipette.drop_tip()
-        else:
-            loc = "A" + str(i+1)
-            right_pipette.pick_up_tip()
-            right_pipette.mix(repetitions=5, volume=40, location=reservoir_2.wells()[9])
-            right_pipette.aspirate(30, location=reservoir_2.wells()[9])
-            right_pipette.dispense(location=dna_plate[loc])
-            mix_beads(right_pipette, loc)
-            right_pipette.drop_tip()
+    add_beads(dna_plate)
     
     # 3. transfer the plate to the magnetic stand until beads (DNA) have pelleted, then transfer the cleared
     # supernatant (RNA) into a new plate.
-    protocol.move_labware(dna_plate, new_location=protocol_api.OFF_DECK)
-    protocol.move_labware(dna_magnet_plate, new_location="5")
-    protocol.delay(minutes=1)
-    aspirate_supernatant(3, dna_magnet_plate, rna_plate)
-    protocol.move_labware(dna_magnet_plate, new_location=protocol_api.OFF_DECK)
-    protocol.move_labware(dna_plate, new_location="5")
-    
-    # 4. [DNA Purification] Add 500µl MagBead DNA/RNA Wash 1 and mix well. Pellet the beads and discard the supernatant.
-    add_mix_pellet_aspirate(500, reservoir_1.wells()[4:8], dna_plate, 3, dna_magnet_plate, liquid_waste)
-    
-    # 4. [RNA Purification] Add 700µl (1 volume) ethanol (95-100%) (1:1) to the supernatant and mix well.
-    add_and_mix(700, reservoir_2.wells()[2:6], rna_plate)
-    
-    # 5. [DNA Purification] Add 500µl MagBead DNA/RNA Wash 2 and mix well. Pellet the beads and discard the supernatant.
-    add_mix_pellet_aspirate(500, reservoir_1.wells()[8:12], dna_plate, 3, dna_magnet_plate, liquid_waste)
-    
-    # 5. [RNA Purification] Add 30µl/well MagBinding Beads and mix well for 10 minutes.
-    for i in range(cols):
-        if i == cols-1:
-            for well in sample_wells[i]:
-                left_pipette.pick_up_tip()
-                left_pipette.mix(repetitions=5, volume=40, location=reservoir_2.wells()[9])
-                left_pipette.aspirate(30, location=reservoir_2.wells()[9])
-                left_pipette.dispense(location=rna_plate[well])
-                left_pipette.mix(repetitions=10, volume=250, location=rna_plate[well])
-                left_pipette.drop_tip()
-        else:
-            loc = "A" + str(i+1)
-            right_pipette.pick_up_tip()
-            right_pipette.mix(repetitions=5, volume=40, location=reservoir_2.wells()[9])
-            right_pipette.aspirate(30, location=reservoir_2.wells()[9])
-            right_pipette.dispense(location=rna_plate[loc])
-            right_pipette.mix(repetitions=10, volume=250, location=rna_plate[loc])
-            right_pipette.drop_tip()
-    
-    # 6. [DNA Purification] Add 500µl ethanol (95-100%) and mix well. Pellet the beads and discard the supernatant.
-    add_mix_pellet_aspirate(500, reservoir_2.wells()[2:6], dna_plate, 3, dna_magnet_plate, liquid_waste)
-    
-    # 6. [RNA Purification] Transfer the plate to the magnetic stand until beads have pelleted, then aspirate and
-    # discard the supernatant.
-    protocol.move_labware(rna_plate, new_location=protocol_api.OFF_DECK)
-    protocol.move_labware(rna_magnet_plate, new_location="6")
-    protocol.delay(minutes=1)
-    aspirate_supernatant(4, rna_magnet_plate, liquid_waste)
-    protocol.move_labware(rna_magnet_plate, new_location=protocol_api.OFF_DECK)
-    protocol.move_labware(rna_plate, new_location="6")
-    
-    # 7. [DNA Purification] Repeat step 6.
-    add_mix_pellet_aspirate(500, reservoir_2.wells()[2:6], dna_plate, 3, dna_magnet_plate, liquid_waste)
-    
-    # 7. [RNA Purification] Add 500µl MagBead DNA/RNA Wash 1 and mix well. Pellet the beads and discard the supernatant.
-    add_mix_pellet_aspirate(500, reservoir_1.wells()[4:8], rna_plate, 3, rna_magnet_plate, liquid_waste)
-    
-    # 8. [DNA Purification] Dry the beads for 10 minutes or until dry.
-    protocol.delay(minutes=10)
+    to_magnet(dna_plate, wait=20 * 60 - MIX_WELL_SECONDS)
+    aspirate_supernatant(dna_plate, rna_plate)
+    off_magnet(dna_plate)
     
-    # 8. [RNA Purification] Add 500µl MagBead DNA/RNA Wash 2 and mix well. Pellet the beads and discard the supernatant.
-    add_mix_pellet_aspirate(500, reservoir_1.wells()[8:12], rna_plate, 3, rna_magnet_plate, liquid_waste)
+    # from here on the DNA and the RNA are purified separately; the steps of each are listed in the order of their
+    # guide, and the scheduler decides how to interleave them
     
-    # 9. [DNA Purification] Add 50µl DNase/RNase-Free Water and mix well for 5 minutes.
-    add_and_mix(50, reservoir_2.wells()[0:2], dna_plate, 30)
+    # [DNA Purification]
+    # 4. Add 500µl MagBead DNA/RNA Wash 1 and mix well. Pellet the beads and discard the supernatant.
+    add_mix_pellet_aspirate(500, wash_1, dna_plate, liquid_waste)
+    # 5. Add 500µl MagBead DNA/RNA Wash 2 and mix well. Pellet the beads and discard the supernatant.
+    add_mix_pellet_aspirate(500, wash_2, dna_plate, liquid_waste)
+    # 6. Add 500µl ethanol (95-100%) and mix well. Pellet the beads and discard the supernatant.
+    add_mix_pellet_aspirate(500, ethanol, dna_plate, liquid_waste)
+    # 7. Repeat step 6.
+    add_mix_pellet_aspirate(500, ethanol, dna_plate, liquid_waste)
+    # 8. Dry the beads for 10 minutes or until dry.
+    # 9. Add 50µl DNase/RNase-Free Water and mix well for 5 minutes.
+    # (with fresh tips, so the eluate doesn't pick up what's left on the parked ones)
+    add_and_mix(50, dnase_rnase_free_water, dna_plate, 30, wait=10 * 60, parked_tip=False)
+    # 10. Transfer the plate to the magnetic stand until beads have pelleted, then aspirate and dispense the eluted
+    # DNA to a new plate/tube.
+    to_magnet(dna_plate, wait=5 * 60 - MIX_WELL_SECONDS)
+    aspirate_supernatant(dna_plate, eluted_dna_plate)
+    off_magnet(dna_plate, put_back=False)
     
-    # 9. [RNA Purification] Add 500µl ethanol (95-100%) and mix well. Pellet the beads and discard the supernatant.
-    add_mix_pellet_aspirate(500, reservoir_2.wells()[2:6], rna_plate, 3, rna_magnet_plate, liquid_waste)
-    
-    # 10. [DNA Purification] Transfer the plate to the magnetic stand until beads have pelleted, then aspirate and
-    # dispense the eluted DNA to a new plate/tube.
-    protocol.move_labware(dna_plate, new_location=protocol_api.OFF_DECK)
-    protocol.move_labware(dna_magnet_plate, new_location="5")
-    protocol.delay(minutes=1)
-    aspirate_supernatant(1, dna_magnet_plate, eluted_dna_plate)
-    protocol.move_labware(dna_magnet_plate, new_location=protocol_api.OFF_DECK)
-    
-    # 10. [RNA Purification] Repeat step 9.
-    add_mix_pellet_aspirate(500, reservoir_2.wells()[2:6], rna_plate, 3, rna_magnet_plate, liquid_waste)
-    
-    # 11. [RNA Purification] DNase I treatment
+    # [RNA Purification]
+    # 4. Add 700µl (1 volume) ethanol (95-100%) (1:1) to the supernatant and mix well.
+    add_and_mix(700, ethanol, rna_plate)
+    # 5. Add 30µl/well MagBinding Beads and mix well for 10 minutes.
+    add_beads(rna_plate)
+    # 6. Transfer the plate to the magnetic stand until beads have pelleted, then aspirate and discard the supernatant.
+    to_magnet(rna_plate, wait=10 * 60 - MIX_WELL_SECONDS)
+    aspirate_supernatant(rna_plate, liquid_waste)
+    off_magnet(rna_plate)
+    # 7. Add 500µl MagBead DNA/RNA Wash 1 and mix well. Pellet the beads and discard the supernatant.
+    add_mix_pellet_aspirate(500, wash_1, rna_plate, liquid_waste)
+    # 8. Add 500µl MagBead DNA/RNA Wash 2 and mix well. Pellet the beads and discard the supernatant.
+    add_mix_pellet_aspirate(500, wash_2, rna_plate, liquid_waste)
+    # 9. Add 500µl ethanol (95-100%) and mix well. Pellet the beads and discard the supernatant.
+    add_mix_pellet_aspirate(500, ethanol, rna_plate, liquid_waste)
+    # 10. Repeat step 9.
+    add_mix_pellet_aspirate(500, ethanol, rna_plate, liquid_waste)
+    # 11. DNase I treatment
     # (D1) Add 50µl DNase I Reaction Mix and mix gently for 10 minutes.
-    add_and_mix(50, [reservoir_2.wells()[6]], rna_plate, 30)
+    # (every group is mixed briefly, and the mixing times of D1 and D2 are waited out before the next step)
+    add_and_mix(50, dnase_i_reaction_mix, rna_plate, 30)
     # (D2) Add 500µl DNA/RNA Prep Buffer and mix well for 10 minutes. Pellet the beads and discard the supernatant.
-    add_mix_pellet_aspirate(500, reservoir_2.wells()[7:9], rna_plate, 3, rna_magnet_plate, liquid_waste)
+    add_mix_pellet_aspirate(500, dna_rna_prep_buffer, rna_plate, liquid_waste, wait=10 * 60 - MIX_WELL_SECONDS, incubate=10 * 60 - MIX_WELL_SECONDS)
     # (D3) Repeat steps 9-10.
-    add_mix_pellet_aspirate(500, reservoir_2.wells()[2:6], rna_plate, 3, rna_magnet_plate, liquid_waste)
-    add_mix_pellet_aspirate(500, reservoir_2.wells()[2:6], rna_plate, 3, rna_magnet_plate, liquid_waste, False)
-    
-    # 12. [RNA Purification] Dry the beads for 10 minutes or until dry.
-    protocol.delay(minutes=10)
-    protocol.move_labware(rna_magnet_plate, new_location=protocol_api.OFF_DECK)
-    protocol.move_labware(rna_plate, new_location="6")
-    
-    # 13. [RNA Purification] Add 50µl DNase/RNase-Free Water and mix well for 5 minutes.
-    add_and_mix(50, reservoir_2.wells()[0:2], rna_plate, 30)
+    add_mix_pellet_aspirate(500, ethanol, rna_plate, liquid_waste)
+    add_mix_pellet_aspirate(500, ethanol, rna_plate, liquid_waste, False)
+    # 12. Dry the beads for 10 minutes or until dry.
+    off_magnet(rna_plate, wait=10 * 60)
+    # 13. Add 50µl DNase/RNase-Free Water and mix well for 5 minutes.
+    # (with fresh tips, so the eluate doesn't pick up what's left on the parked ones)
+    add_and_mix(50, dnase_rnase_free_water, rna_plate, 30, parked_tip=False)
+    # 14. Transfer the plate to the magnetic stand until beads have pelleted, then aspirate and dispense the eluted
+    # RNA to a new plate/tube.
+    to_magnet(rna_plate, wait=5 * 60 - MIX_WELL_SECONDS)
+    aspirate_supernatant(rna_plate, eluted_rna_plate)
+    off_magnet(rna_plate, put_back=False)
     
-    # 14. [RNA Purification] Transfer the plate to the magnetic stand until beads have pelleted, then aspirate and
-    # dispense the eluted RNA to a new plate/tube.
-    protocol.move_labware(rna_plate, new_location=protocol_api.OFF_DECK)
-    protocol.move_labware(rna_magnet_plate, new_location="6")
-    protocol.delay(minutes=1)
-    aspirate_supernatant(1, rna_magnet_plate, eluted_rna_plate)
\ No newline at end of file
+    reagents.load_liquids()
+    pipettes.load_tip_racks(protocol.params.tip_refills)
+    scheduler.run()
@@ -1,17 +1,386 @@
 # imports
+import numpy as np
 from opentrons import protocol_api
-import csv
 
 # metadata
 metadata = {
     "protocolName": "Normalization",
-    "description": "Normalizes the amount of a material in the wells of a plate.\nThis protocol requires the user to change some values in the code. Please see the protocol file for more information.",
+    "description": "Normalizes the amount of a material in the wells of a plate.\nThe measured concentrations or the volumes can be uploaded as a CSV file or changed in the code. Please see the protocol file for more information.",
     "author": "Reya Miller"
 }
 
 requirements = {"robotType": "OT-2", "apiLevel": "2.22"}
 
-# copy and paste from a spreadsheet (see https://docs.google.com/spreadsheets/d/1K7OXYfy0i2oJgIokcdIegjBVeeBMqR_-SODV961FI2k/edit?usp=sharing for a template)
+# >>> lib/plate_map.py (inlined by tools/bundle.py, edit the original instead)
+from array import array
+
+PLATE_ROWS = "ABCDEFGH"
+PLATE_COLS = 12
+
+def well_index(well: str) -> int:
+    """
+    Returns the index of a well in column order (A1, B1, ..., H1, A2, ...), the same order as ``Labware.wells()``.
+
+    :param well: The name of the well, e.g. ``"B3"``.
+    """
+    return (int(well[1:]) - 1) * 8 + PLATE_ROWS.index(well[0].upper())
+
+def well_name(index: int) -> str:
+    """
+    Returns the name of the well at the given column-order index.
+
+    :param index: The index of the well, from 0 (A1) to 95 (H12).
+    """
+    return PLATE_ROWS[index % 8] + str(index // 8 + 1)
+
+def serpentine(wells: list[str]) -> list[str]:
+    """
+    Returns wells in an order with little travel between them: row by row, every row in the opposite direction of the
+    one before, so the pipette moves on to the nearest well of the next row instead of going back to column 1.
+
+    :param wells: The names of the wells, in any order.
+    """
+    rows = {}
+    for well in sorted(wells, key=lambda well: int(well[1:])):
+        rows.setdefault(PLATE_ROWS.index(well[0].upper()), []).append(well)
+    ordered = []
+    for i, row in enumerate(sorted(rows)):
+        ordered += rows[row] if i % 2 == 0 else rows[row][::-1]
+    return ordered
+
+class PlateMap:
+    """
+    A parsed 96-well plate map.
+
+    The occupied wells are stored as a 96-bit mask with bit ``col * 8 + row`` set for every occupied well, so every
+    column is one byte of the mask and can be queried in constant time. The value of every well (1.0 for ``TRUE``, or
+    the number in the cell) is stored in a float array indexed the same way.
+    """
+
+    def __init__(self, mask=0, values=None):
+        """
+        :param mask: The occupancy mask.
+        :param values: A float array of 96 well values, in column order.
+        """
+        self.mask = mask
+        self.values = values if values is not None else array("d", [0.0] * (8 * PLATE_COLS))
+
+    @classmethod
+    def parse(cls, data: str) -> "PlateMap":
+        """
+        Parses a single plate map grid.
+
+        :param data: The grid, comma- or tab-separated, as pasted into a protocol or uploaded as a CSV file.
+        """
+        maps = cls.parse_all(data)
+        if len(maps) != 1:
+            raise ValueError("Expected one plate map, found " + str(len(maps)) + ".")
+        return maps[0]
+
+    @classmethod
+    def parse_all(cls, data: str) -> list["PlateMap"]:
+        """
+        Parses one or more plate map grids that follow each other, each starting with its own header row.
+
+        :param data: The grids, comma- or tab-separated.
+        """
+        maps = []
+        header = None
+        for line in data.lstrip("\ufeff").replace("\t", ",").splitlines():
+            cells = [cell.strip() for cell in line.split(",")]
+            if all(cell == "" for cell in cells):
+                continue
+            if cells[0] == "":
+                # a header row starts a new grid; remember which column every cell belongs to
+                header = [int(cell) - 1 if cell != "" else None for cell in cells[1:]]
+                maps.append(cls())
+                continue
+            if header is None:
+                raise ValueError("The plate map must start with a header row of column numbers.")
+            row = PLATE_ROWS.find(cells[0].upper())
+            if row < 0 or len(cells[0]) != 1:
+                raise ValueError("Unknown plate row " + repr(cells[0]) + ".")
+            plate_map = maps[-1]
+            for col, cell in zip(header, cells[1:]):
+                if col is None or cell == "" or cell.upper() == "FALSE":
+                    continue
+                index = col * 8 + row
+                plate_map.mask |= 1 << index
+                plate_map.values[index] = 1.0 if cell.upper() == "TRUE" else float(cell)
+        return maps
+
+    def __len__(self) -> int:
+        return bin(self.mask).count("1")
+
+    def __contains__(self, well: str) -> bool:
+        return (self.mask >> well_index(well)) & 1 == 1
+
+    def __getitem__(self, well: str) -> float:
+        return self.values[well_index(well)]
+
+    def column_mask(self, col: int) -> int:
+        """
+        Returns the occupancy of a column as an 8-bit mask, with bit 0 for row A and bit 7 for row H.
+
+        :param col: The column index, from 0 to 11.
+        """
+        return (self.mask >> (col * 8)) & 0xFF
+
+    def column_count(self, col: int) -> int:
+        """
+        Returns the number of occupied wells in a column.
+
+        :param col: The column index, from 0 to 11.
+        """
+        return bin(self.column_mask(col)).count("1")
+
+    def is_full(self, col: int) -> bool:
+        """
+        Returns whether every well of a column is occupied.
+
+        :param col: The column index, from 0 to 11.
+        """
+        return self.column_mask(col) == 0xFF
+
+    def occupied_columns(self) -> list[int]:
+        """Returns the indexes of the columns with at least one occupied well."""
+        return [col for col in range(PLATE_COLS) if self.column_mask(col) != 0]
+
+    def full_columns(self) -> list[int]:
+        """Returns the indexes of the columns in which every well is occupied."""
+        return [col for col in range(PLATE_COLS) if self.column_mask(col) == 0xFF]
+
+    def partial_columns(self) -> list[int]:
+        """Returns the indexes of the columns in which some, but not all, wells are occupied."""
+        return [col for col in range(PLATE_COLS) if 0 < self.column_mask(col) < 0xFF]
+
+    def num_columns(self) -> int:
+        """Returns the number of columns up to and including the last occupied one."""
+        return (self.mask.bit_length() + 7) // 8
+
+    def column_wells(self, col: int) -> list[str]:
+        """
+        Returns the names of the occupied wells of a column, from row A to row H.
+
+        :param col: The column index, from 0 to 11.
+        """
+        col_mask = self.column_mask(col)
+        return [PLATE_ROWS[row] + str(col + 1) for row in range(8) if (col_mask >> row) & 1]
+
+    def wells(self, order="column") -> list[str]:
+        """
+        Returns the names of all occupied wells.
+
+        :param order: ``"column"`` (A1, B1, ..., H1, A2, ...) or ``"row"`` (A1, A2, ..., A12, B1, ...).
+        """
+        if order == "row":
+            indexes = [col * 8 + row for row in range(8) for col in range(PLATE_COLS)]
+        else:
+            indexes = range(8 * PLATE_COLS)
+        return [well_name(i) for i in indexes if (self.mask >> i) & 1]
+
+    def column_plan(self) -> list[tuple[int, list[str]]]:
+        """
+        Splits the occupied wells into groups that can each be pipetted in one go by an 8-channel pipette: every full
+        column, and every run of neighbouring occupied wells in a partially filled column. Empty columns are skipped.
+
+        :return: A list of (column index, wells) tuples, in column order, with the wells of each group from back to
+            front.
+        """
+        plan = []
+        for col in self.occupied_columns():
+            wells = []
+            for well in self.column_wells(col):
+                if wells and PLATE_ROWS.index(well[0]) != PLATE_ROWS.index(wells[-1][0]) + 1:
+                    plan.append((col, wells))
+                    wells = []
+                wells.append(well)
+            plan.append((col, wells))
+        return plan
+# <<< lib/plate_map.py
+
+# >>> lib/transfer_plan.py (inlined by tools/bundle.py, edit the original instead)
+import json
+import math
+import re
+
+# the version of the plan format, changed whenever old plans can no longer be replayed
+PLAN_FORMAT = 1
+WELL_NAME = re.compile(r"[A-P]([1-9]|1[0-9]|2[0-4])")
+NEW_TIP = ("once", "always", "never")
+# the largest volume of one aspiration, in µl
+PIPETTE_MAX_VOLUMES = {
+    "p20_single_gen2": 20,
+    "p20_multi_gen2": 20,
+    "p300_single_gen2": 300,
+    "p300_multi_gen2": 300,
+    "p1000_single_gen2": 1000,
+}
+
+def check_plan(plan: dict, protocol_name: str):
+    """
+    Raises a ValueError if a plan is malformed or was compiled for another protocol.
+
+    :param plan: The plan.
+    :param protocol_name: The name of the protocol that replays it, e.g. ``"pooling"``.
+    """
+    if not isinstance(plan, dict) or plan.get("format") != PLAN_FORMAT:
+        raise ValueError("The transfer plan is not in format " + str(PLAN_FORMAT) + "; compile it again with tools/compile_plan.py.")
+    if plan.get("protocol") != protocol_name:
+        raise ValueError("The transfer plan was compiled for " + repr(plan.get("protocol")) + ", not " + repr(protocol_name) + ".")
+    for key in ("labware", "pipettes"):
+        if not isinstance(plan.get(key), dict):
+            raise ValueError("The transfer plan has no " + key + ".")
+    if not isinstance(plan.get("wells"), list) or not all(isinstance(well, str) and WELL_NAME.fullmatch(well) for well in plan["wells"]):
+        raise ValueError("The wells of the transfer plan must be a list of well names.")
+    if not isinstance(plan.get("notes", []), list) or not all(isinstance(note, str) for note in plan.get("notes", [])):
+        raise ValueError("The notes of the transfer plan must be a list of strings.")
+    if not isinstance(plan.get("steps"), list):
+        raise ValueError("The transfer plan has no steps.")
+    for number, step in enumerate(plan["steps"], 1):
+        where = "Step " + str(number) + " of the transfer plan"
+        if step.get("pipette") not in plan["pipettes"]:
+            raise ValueError(where + " uses an unknown pipette " + repr(step.get("pipette")) + ".")
+        if step.get("source") not in plan["labware"] or step.get("dest") not in plan["labware"]:
+            raise ValueError(where + " uses unknown labware.")
+        if step.get("new_tip") not in NEW_TIP:
+            raise ValueError(where + " has an unknown new_tip " + repr(step.get("new_tip")) + ".")
+        sources, dests, volumes = step.get("sources"), step.get("dests"), step.get("volumes")
+        if not isinstance(sources, list) or not sources or not isinstance(dests, list) or not isinstance(volumes, list) or not len(sources) == len(dests) == len(volumes):
+            raise ValueError(where + " must have as many sources, destinations and volumes, and at least one of each.")
+        for well in sources + dests:
+            if not isinstance(well, str) or not WELL_NAME.fullmatch(well):
+                raise ValueError(where + " has an unknown well " + repr(well) + ".")
+        for volume in volumes + [step.get("disposal_volume", 0)]:
+            if isinstance(volume, bool) or not isinstance(volume, (int, float)) or volume < 0:
+                raise ValueError(where + " has an invalid volume " + repr(volume) + ".")
+        if "disposal_volume" in step and len(set(sources)) != 1:
+            raise ValueError(where + " is a multi-dispense run, so it must have a single source well.")
+        # every aspiration of a multi-dispense run takes the disposal volume on top of the volume of at least one well
+        max_volume = PIPETTE_MAX_VOLUMES.get(plan["pipettes"][step["pipette"]])
+        if "disposal_volume" in step and max_volume is not None and max(volumes) + step["disposal_volume"] > max_volume:
+            raise ValueError(where + " dispenses up to " + str(max(volumes)) + " µl with a disposal volume of " + str(step["disposal_volume"]) + " µl, more than the " + str(max_volume) + " µl the pipette aspirates at once.")
+
+def load_plan(data: str, protocol_name: str) -> dict:
+    """
+    Parses and checks a plan.
+
+    :param data: The plan as JSON.
+    :param protocol_name: The name of the protocol that replays it, e.g. ``"pooling"``.
+    """
+    plan = json.loads(data)
+    check_plan(plan, protocol_name)
+    return plan
+
+def tips_used(step: dict, max_volume: float) -> int:
+    """
+    Returns the number of times a step of a plan picks up a tip, or a column of tips for a multi-channel pipette.
+
+    :param step: The step.
+    :param max_volume: The largest volume the pipette aspirates at once, in µl.
+    """
+    if step["new_tip"] == "once":
+        return 1
+    if step["new_tip"] == "never":
+        return 0
+    # a volume larger than the pipette holds is split into several aspirations, each with its own tip
+    return sum(max(1, math.ceil(volume / max_volume)) for volume in step["volumes"])
+
+def run_plan(plan: dict, pipettes: dict, labware: dict):
+    """
+    Makes the transfers of a plan.
+
+    :param plan: The plan, from ``load_plan()`` or the protocol's ``make_plan()``.
+    :param pipettes: The pipettes named in the plan, by name.
+    :param labware: The labware named in the plan, by name.
+    """
+    # a plan compiled for other labware or pipettes would still replay, but to the wrong heights and volumes
+    for name, load_name in plan["labware"].items():
+        if name not in labware:
+            raise ValueError("The transfer plan uses labware " + repr(name) + ", which the protocol doesn't load; compile it again with tools/compile_plan.py.")
+        if labware[name].load_name != load_name:
+            raise ValueError("The transfer plan expects " + load_name + " as " + name + ", but the protocol loads " + labware[name].load_name + ".")
+    for name, pipette_name in plan["pipettes"].items():
+        if name not in pipettes:
+            raise ValueError("The transfer plan uses a pipette on the " + name + " mount, which the protocol doesn't load.")
+        if pipettes[name].name != pipette_name:
+            raise ValueError("The transfer plan expects " + pipette_name + " as " + name + ", but the protocol loads " + pipettes[name].name + ".")
+
+    for step in plan["steps"]:
+        source = labware[step["source"]]
+        dest = labware[step["dest"]]
+        if "disposal_volume" in step:
+            pipettes[step["pipette"]].distribute(
+                step["volumes"],
+                source[step["sources"][0]],
+                [dest[well] for well in step["dests"]],
+                new_tip=step["new_tip"],
+                disposal_volume=step["disposal_volume"],
+                blow_out=True,
+                blowout_location="source well"
+            )
+            continue
+        pipettes[step["pipette"]].transfer(
+            step["volumes"],
+            [source[well] for well in step["sources"]],
+            [dest[well] for well in step["dests"]],
+            new_tip=step["new_tip"],
+            blow_out=True,
+            blowout_location="destination well"
+        )
+# <<< lib/transfer_plan.py
+
+# >>> lib/well_order.py (inlined by tools/bundle.py, edit the original instead)
+import math
+
+
+
+def well_positions(labware: protocol_api.Labware) -> dict[str, tuple[float, float]]:
+    """
+    Returns the position of the top of every well of a labware, in mm.
+
+    :param labware: The loaded labware.
+    """
+    return {well.well_name: (well.top().point.x, well.top().point.y) for well in labware.wells()}
+
+def path_length(wells: list[str], positions: dict[str, tuple[float, float]]) -> float:
+    """
+    Returns the distance the head travels to visit wells in the given order, in mm.
+
+    :param wells: The names of the wells, in the order they are visited.
+    :param positions: The position of every well, from ``well_positions()``.
+    """
+    return sum(math.dist(positions[a], positions[b]) for a, b in zip(wells, wells[1:]))
+
+def shortest_path(wells: list[str], positions: dict[str, tuple[float, float]]) -> list[str]:
+    """
+    Returns wells in the order with the least travel between them that is found: from the first well of the
+    ``serpentine()`` order, always the nearest well not visited yet, unless the serpentine order itself is shorter.
+
+    :param wells: The names of the wells, in any order.
+    :param positions: The position of every well, from ``well_positions()``.
+    """
+    ordered = serpentine(wells)
+    if len(ordered) < 3:
+        return ordered
+    path = [ordered[0]]
+    # ties go to the well that comes first in the serpentine order, so the path is always the same
+    left = ordered[1:]
+    while left:
+        nearest = min(left, key=lambda well: math.dist(positions[path[-1]], positions[well]))
+        path.append(nearest)
+        left.remove(nearest)
+    return path if path_length(path, positions) < path_length(ordered, positions) else ordered
+# <<< lib/well_order.py
+
+# copy and paste the measured DNA concentrations in ng/µl from a spreadsheet or the plate reader, in the same layout as
+# the volume grids below; the protocol then works out the volumes of water and DNA for the target set in the parameters
+# this is only used if no CSV file is uploaded for the "volume_data_csv" parameter
+concentration_data = """
+"""
+
+# or copy and paste the volumes from a spreadsheet (see https://docs.google.com/spreadsheets/d/1K7OXYfy0i2oJgIokcdIegjBVeeBMqR_-SODV961FI2k/edit?usp=sharing for a template)
+# these are only used if there are no concentrations above and no CSV file is uploaded
 water_volume_data = """
 	1	2	3	4	5	6	7	8	9	10	11	12
 A	12.4	11.6										
@@ -23,7 +392,6 @@ F	12.3
 G	12.4											
 H	12.2											
 """
-water_volume_data = water_volume_data.replace('\t', ',')
 
 dna_volume_data = """
 	1	2	3	4	5	6	7	8	9	10	11	12
@@ -36,7 +404,278 @@ F	0.7
 G	0.6											
 H	0.9											
 """
-dna_volume_data = dna_volume_data.replace('\t', ',')
+
+# a transfer plan compiled from the volume data with "python tools/compile_plan.py normalization --map volumes.csv --inline"
+# if it isn't empty, it is used instead of the grids above (but an uploaded CSV file still takes precedence)
+compiled_plan_data = """
+"""
+
+# the pipettes, smallest first, as (mount, pipette name, smallest volume it transfers accurately, largest volume it
+# aspirates at once, smallest volume it dispenses accurately in a multi-dispense run) tuples, in µl; the p300 isn't
+# accurate below 20µl even when a run aspirates much more than that
+PIPETTES = [
+    ("left", "p20_single_gen2", 1.0, 20.0, 1.0),
+    ("right", "p300_single_gen2", 20.0, 300.0, 20.0)
+]
+# the 8-channel pipette that takes the place of the P300 with the multichannel parameter, for the columns whose DNA
+# volumes are even, in the same format
+MULTI_PIPETTE = ("right", "p20_multi_gen2", 1.0, 20.0, 1.0)
+# the smallest volume of water the P300 dispenses with the p300_water parameter, in µl; it fills many more wells per
+# aspiration than the P20, at the cost of the accuracy of the volumes below its 20µl. Without the parameter, water is
+# only batched where wells fit in a tip together: in the P20 up to 9.5µl per well, and in the P300 from 20µl, so the
+# common 10-19µl of water take an aspiration per well
+P300_WATER_VOLUME = 10.0
+# the smallest volume the pipettes can transfer accurately, in µl
+MIN_VOLUME = PIPETTES[0][2]
+# the most a well of the water plate holds, in µl
+MAX_WELL_VOLUME = 200.0
+# the reservoir the water is drawn from, the volume that can't be aspirated from one of its wells (about 2 mm of
+# water), and the most water a well gives, in µl
+WATER_RESERVOIR = "nest_12_reservoir_15ml"
+WATER_DEAD_VOLUME = 1200.0
+WATER_WELL_VOLUME = 15000.0 - WATER_DEAD_VOLUME
+# the labware of a plan, by the names the plan gives it
+PLAN_LABWARE = {
+    "reservoir": WATER_RESERVOIR,
+    "water_plate": "opentrons_96_wellplate_200ul_pcr_full_skirt",
+    "dna_plate": "opentrons_96_wellplate_200ul_pcr_full_skirt"
+}
+# the slots left free for more tip racks, if a run needs more tips than the racks in slots 6 and 9 hold
+FREE_SLOTS = [1, 4, 7, 8, 10, 11]
+
+def normalize(concentrations: PlateMap, target_concentration: float, final_volume: float) -> tuple[PlateMap, PlateMap, list[str]]:
+    """
+    Works out how much DNA and water to put in every well to bring it to the target concentration, for all 96 wells at
+    once.
+
+    The DNA volume is clamped between the smallest volume the pipette can transfer and the final volume. A sample
+    whose concentration is below the target gets the final volume of DNA and no water; a sample so concentrated that
+    the smallest volume of it is more DNA than the final volume should hold gets more water instead, up to what the
+    well holds.
+
+    :param concentrations: The measured concentrations of the samples, in ng/µl.
+    :param target_concentration: The concentration to bring every sample to, in ng/µl.
+    :param final_volume: The volume of every well afterwards, in µl.
+    :return: The volumes of water and of DNA, and a note for every sample that can't reach the target.
+    """
+    concentration = np.frombuffer(concentrations.values, dtype=np.float64)
+    with np.errstate(divide="ignore"):
+        dna = np.where(concentration > 0, target_concentration * final_volume / concentration, np.inf)
+    too_low = dna > final_volume
+    dna = np.clip(dna, MIN_VOLUME, final_volume)
+    # the total volume that dilutes the DNA to the target, which is more than the final volume for concentrated samples
+    total = np.where(too_low, final_volume, np.minimum(dna * concentration / target_concentration, MAX_WELL_VOLUME))
+    too_high = dna * concentration / target_concentration > MAX_WELL_VOLUME + 1e-9
+    water = total - dna
+    # the pipette can't add less than its smallest volume, so round to nothing or to that
+    water = np.where(water < MIN_VOLUME / 2, 0.0, np.maximum(water, MIN_VOLUME))
+    dna = np.round(dna, 1)
+    water = np.round(water, 1)
+
+    notes = []
+    for well in concentrations.wells(order="row"):
+        i = well_index(well)
+        if too_low[i]:
+            notes.append(well + ": " + str(concentration[i]) + " ng/µl is below the target, so it gets " + str(dna[i]) + " µl of DNA and no water.")
+        elif too_high[i]:
+            reached = round(concentration[i] * dna[i] / (dna[i] + water[i]), 1)
+            notes.append(well + ": " + str(concentration[i]) + " ng/µl can only be diluted to " + str(reached) + " ng/µl in a " + str(MAX_WELL_VOLUME) + " µl well.")
+    return PlateMap(concentrations.mask, array("d", water.tolist())), PlateMap(concentrations.mask, array("d", dna.tolist())), notes
+
+def quantize(water_volumes: PlateMap, dna_volumes: PlateMap, step: float) -> tuple[PlateMap, PlateMap, list[str]]:
+    """
+    Rounds the DNA volumes to the nearest multiple of a step, so that more columns are even enough for the 8-channel
+    pipette, and scales the water of every well with it so that the concentration stays the same.
+
+    A DNA volume is never rounded below the step or the smallest volume the pipette can transfer. The water is rounded
+    like in ``normalize()``, and limited to what the well holds.
+
+    :param water_volumes: The volumes of water, in µl.
+    :param dna_volumes: The volumes of DNA, in µl.
+    :param step: The step to round the DNA volumes to, in µl.
+    :return: The volumes of water and of DNA, and a note for every well whose concentration changes by more than 1%.
+    """
+    water = np.frombuffer(water_volumes.values, dtype=np.float64)
+    dna = np.frombuffer(dna_volumes.values, dtype=np.float64)
+    rounded = np.where(dna > 0, np.maximum(np.round(dna / step) * step, max(step, MIN_VOLUME)), 0.0)
+    rounded = np.round(rounded, 2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # the total volume grows or shrinks with the DNA, which keeps the share of DNA in it the same
+        total = np.where(dna > 0, np.minimum((water + dna) * rounded / dna, np.maximum(MAX_WELL_VOLUME, rounded)), water)
+    scaled = np.where(dna > 0, total - rounded, water)
+    scaled = np.where(scaled < MIN_VOLUME / 2, 0.0, np.maximum(scaled, MIN_VOLUME))
+    scaled = np.where(dna > 0, np.round(scaled, 1), water)
+
+    notes = []
+    for well in dna_volumes.wells(order="row"):
+        i = well_index(well)
+        if dna[i] > 0 and rounded[i] != dna[i]:
+            change = (rounded[i] / (rounded[i] + scaled[i])) / (dna[i] / (dna[i] + water[i])) - 1
+            if abs(change) > 0.01:
+                notes.append(well + ": rounding " + str(dna[i]) + " µl of DNA to " + str(rounded[i]) + " µl changes its concentration by " + ("+" if change > 0 else "") + str(round(100 * change, 1)) + "%.")
+    return PlateMap(water_volumes.mask, array("d", scaled.tolist())), PlateMap(dna_volumes.mask, array("d", rounded.tolist())), notes
+
+def even_columns(volumes: PlateMap, tolerance: float) -> dict[int, float]:
+    """
+    Finds the full columns whose volumes differ by no more than the tolerance, which the 8-channel pipette can transfer
+    in one go, with the volume halfway between the smallest and the largest of the column in every channel.
+
+    :param volumes: The volumes, in µl.
+    :param tolerance: How much the volumes of a column may differ, in µl.
+    :return: The column indexes, from 0 to 11, and the volume of each.
+    """
+    columns = {}
+    for col in volumes.full_columns():
+        column = [volumes[well] for well in volumes.column_wells(col)]
+        # a little slack for volumes that were rounded to 0.1µl
+        if max(column) - min(column) <= tolerance + 1e-9:
+            columns[col] = round((max(column) + min(column)) / 2, 2)
+    return columns
+
+def pipette_for(volume: float, pipettes=PIPETTES) -> str:
+    """
+    Returns the mount of the smallest pipette that transfers a volume in a single aspiration, or of the largest one if
+    none does.
+
+    :param volume: The volume to transfer, in µl.
+    :param pipettes: The single-channel pipettes of the run, smallest first, as in ``PIPETTES``.
+    """
+    for mount, name, min_volume, max_volume, min_dispense_volume in pipettes:
+        if volume <= max_volume:
+            return mount
+    return pipettes[-1][0]
+
+def water_pipette_for(volume: float, pipettes=PIPETTES) -> str:
+    """
+    Returns the mount of the largest pipette that dispenses a volume accurately in a multi-dispense run, which fills the
+    most wells per aspiration, or of the smallest one if none does.
+
+    :param volume: The volume to dispense, in µl.
+    :param pipettes: The single-channel pipettes of the run, smallest first, as in ``PIPETTES``.
+    """
+    for mount, name, min_volume, max_volume, min_dispense_volume in reversed(pipettes):
+        if volume >= min_dispense_volume:
+            return mount
+    return pipettes[0][0]
+
+def pasted_maps() -> list[PlateMap]:
+    """
+    Returns the plate maps pasted into this file: the concentrations if there are any, otherwise the water volumes and
+    the DNA volumes.
+    """
+    if concentration_data.strip():
+        return [PlateMap.parse(concentration_data)]
+    return [PlateMap.parse(water_volume_data), PlateMap.parse(dna_volume_data)]
+
+def make_plan(maps: list[PlateMap], params, labware: dict[str, protocol_api.Labware]) -> dict:
+    """
+    Works out the transfers of a run (see lib/transfer_plan.py).
+
+    :param maps: Either the measured concentrations, or the water volumes followed by the DNA volumes.
+    :param params: The runtime parameters, with the target to normalize the concentrations to and the settings of the
+        8-channel pipette.
+    :param labware: The loaded reservoir and water plate of ``PLAN_LABWARE``, by name, whose wells decide where the
+        water is drawn from and the order the water plate is filled in.
+    """
+    notes = []
+    if len(maps) == 1:
+        if params.normalize_to == "mass":
+            target_concentration = params.target_mass / params.final_volume
+        else:
+            target_concentration = params.target_concentration
+        water_volumes, dna_volumes, notes = normalize(maps[0], target_concentration, params.final_volume)
+    elif len(maps) == 2:
+        water_volumes, dna_volumes = maps
+    else:
+        raise ValueError("The volume data must contain either the concentration grid, or the water volume grid followed by the DNA volume grid, each with its own header row.")
+    if params.volume_step > 0:
+        water_volumes, dna_volumes, rounding_notes = quantize(water_volumes, dna_volumes, params.volume_step)
+        notes += rounding_notes
+    wells_used = water_volumes.wells(order="row")
+    for well in wells_used:
+        for liquid, volume in (("water", water_volumes[well]), ("DNA", dna_volumes[well])):
+            if 0 < volume < MIN_VOLUME:
+                notes.append(well + ": " + str(volume) + " µl of " + liquid + " is less than the " + str(MIN_VOLUME) + " µl the pipette transfers accurately.")
+    pipettes = PIPETTES
+    # the columns of DNA the 8-channel pipette transfers, by column index
+    columns = {}
+    if params.multichannel:
+        # the 8-channel pipette takes the place of the P300
+        pipettes = [pipette for pipette in PIPETTES if pipette[0] != MULTI_PIPETTE[0]]
+        columns = even_columns(dna_volumes, params.column_tolerance)
+        for col, volume in columns.items():
+            column = [dna_volumes[well] for well in dna_volumes.column_wells(col)]
+            if min(column) != max(column):
+                notes.append("Column " + str(col + 1) + ": " + str(min(column)) + "-" + str(max(column)) + " µl of DNA is transferred as " + str(volume) + " µl with the 8-channel pipette.")
+    water_pipettes = pipettes
+    if params.p300_water:
+        water_pipettes = [pipette[:4] + (min(pipette[4], P300_WATER_VOLUME),) for pipette in pipettes]
+        inaccurate = [well for well in wells_used if water_volumes[well] > 0 and water_pipette_for(water_volumes[well], water_pipettes) != water_pipette_for(water_volumes[well], pipettes)]
+        if inaccurate:
+            notes.append(str(len(inaccurate)) + " wells get " + str(min(water_volumes[well] for well in inaccurate)) + "-" + str(max(water_volumes[well] for well in inaccurate)) + " µl of water from the P300, which isn't accurate below " + str(pipettes[-1][2]) + " µl.")
+    water_plate_positions = well_positions(labware["water_plate"])
+    # the water is drawn from the wells of the reservoir one after another, moving on when a well runs low
+    reservoir_wells = iter([well.well_name for well in labware["reservoir"].wells()])
+    reservoir_well = None
+    water_left = 0.0
+    steps = []
+    # the wells of each pipette are done one after another
+    for mount, name, min_volume, max_volume, min_dispense_volume in water_pipettes:
+        # samples that only get DNA don't need water
+        # the tip only ever touches water, so the wells can be visited in any order
+        water_wells = shortest_path([well for well in wells_used if water_volumes[well] > 0 and water_pipette_for(water_volumes[well], water_pipettes) == mount], water_plate_positions)
+        # a volume larger than the tip is split into equal parts, each from an aspiration of its own
+        water_parts = []
+        for well in water_wells:
+            parts = math.ceil(water_volumes[well] / max_volume)
+            water_parts += [(well, round(water_volumes[well] / parts, 2))] * parts
+        sources = []
+        for well, volume in water_parts:
+            if reservoir_well is None or volume > water_left:
+                reservoir_well = next(reservoir_wells, None)
+                if reservoir_well is None:
+                    raise ValueError("The plate needs more water than the reservoir holds.")
+                water_left = WATER_WELL_VOLUME
+            sources.append(reservoir_well)
+            water_left -= volume
+        # a multi-dispense run has a single source, so there are steps for every well of the reservoir
+        for source in dict.fromkeys(sources):
+            parts = [part for part, part_source in zip(water_parts, sources) if part_source == source]
+            # a part that doesn't fit in the tip with the disposal volume, e.g. 19.5µl in the P20, is transferred in a
+            # single aspiration without one, in a step of its own
+            batched = [part for part in parts if part[1] <= max_volume - min_volume]
+            single = [part for part in parts if part[1] > max_volume - min_volume]
+            if len(batched) < 2:
+                single, batched = batched + single, []
+            # add the specified volumes of water to the plate, all with the same tip
+            for group in (batched, single):
+                if not group:
+                    continue
+                step = {"pipette": mount, "source": "reservoir", "dest": "water_plate", "sources": [source] * len(group), "dests": [well for well, volume in group], "volumes": [volume for well, volume in group], "new_tip": "once"}
+                if group is batched:
+                    # fill as many wells per aspiration as fit in the tip; the disposal volume keeps the last well of
+                    # every aspiration as accurate as the first, and is blown out back into the reservoir
+                    step["disposal_volume"] = min_volume
+                steps.append(step)
+    if columns:
+        # add the DNA of the even columns with all 8 channels at once, with a new column of tips for every column
+        column_wells = ["A" + str(col + 1) for col in sorted(columns)]
+        steps.append({"pipette": MULTI_PIPETTE[0], "source": "dna_plate", "dest": "water_plate", "sources": column_wells, "dests": column_wells, "volumes": [columns[col] for col in sorted(columns)], "new_tip": "always"})
+    # every other DNA transfer goes to the smallest pipette that takes it in one aspiration
+    for mount, name, min_volume, max_volume, min_dispense_volume in pipettes:
+        dna_wells = [well for well in wells_used if well_index(well) // 8 not in columns and pipette_for(dna_volumes[well], pipettes) == mount]
+        if dna_wells:
+            # add the specified volumes of DNA to the plate with water, with a new tip for every well
+            steps.append({"pipette": mount, "source": "dna_plate", "dest": "water_plate", "sources": dna_wells, "dests": dna_wells, "volumes": [dna_volumes[well] for well in dna_wells], "new_tip": "always"})
+    return {
+        "format": PLAN_FORMAT,
+        "protocol": "normalization",
+        "labware": PLAN_LABWARE,
+        "pipettes": {mount: name for mount, name, min_volume, max_volume, min_dispense_volume in pipettes + ([MULTI_PIPETTE] if params.multichannel else [])},
+        "wells": wells_used,
+        "notes": notes,
+        "steps": steps
+    }
 
 def add_parameters(parameters: protocol_api.Parameters):
     # if necessary, tell the robot the location of the first available tip on the tip rack
@@ -76,57 +715,125 @@ def add_parameters(parameters: protocol_api.Parameters):
         ],
         default="1"
     )
+    # the target the measured concentrations are normalized to, if there are any
+    parameters.add_str(
+        variable_name="normalize_to",
+        display_name="Normalize to",
+        description="Bring the samples to a target concentration, or a target mass in the final volume.",
+        choices=[
+            {"display_name": "Concentration", "value": "concentration"},
+            {"display_name": "Mass", "value": "mass"}
+        ],
+        default="concentration"
+    )
+    parameters.add_float(
+        variable_name="target_concentration",
+        display_name="Target concentration",
+        description="The concentration to bring every sample to, in ng/µL.",
+        default=5,
+        minimum=0.1,
+        maximum=500,
+        unit="ng/µL"
+    )
+    parameters.add_float(
+        variable_name="target_mass",
+        display_name="Target mass",
+        description="The mass of DNA to put in every well, in ng.",
+        default=100,
+        minimum=1,
+        maximum=10000,
+        unit="ng"
+    )
+    parameters.add_float(
+        variable_name="final_volume",
+        display_name="Final volume",
+        description="The volume of every well after normalization.",
+        default=20,
+        minimum=2,
+        maximum=200,
+        unit="µL"
+    )
+    # the 8-channel pipette, for plates where whole columns get the same volume of DNA
+    parameters.add_bool(
+        variable_name="multichannel",
+        display_name="8-channel pipette",
+        description="Use a P20 8-Channel GEN2 instead of the P300, for the columns with even DNA volumes.",
+        default=False
+    )
+    parameters.add_float(
+        variable_name="column_tolerance",
+        display_name="Column tolerance",
+        description="How much the DNA volumes of a column may differ for the 8-channel pipette.",
+        default=0.2,
+        minimum=0,
+        maximum=5,
+        unit="µL"
+    )
+    # water from 10µl with the P300, which fills many more wells per aspiration than the P20; off by default, since the
+    # P300 isn't rated below 20µl
+    parameters.add_bool(
+        variable_name="p300_water",
+        display_name="P300 water from 10 µL",
+        description="Off: water is batched only if wells fit a tip together. On: P300 from 10 µL, faster, less accurate.",
+        default=False
+    )
+    parameters.add_float(
+        variable_name="volume_step",
+        display_name="Round DNA volumes to",
+        description="Round the DNA volumes to a multiple of this, to make more columns even. 0 to not round.",
+        default=0,
+        minimum=0,
+        maximum=5,
+        unit="µL"
+    )
+    parameters.add_csv_file(
+        variable_name="volume_data_csv",
+        display_name="Volume data",
+        description="Optional CSV of concentrations, or of water volumes above DNA volumes. Otherwise uses the file."
+    )
 
 def run(protocol: protocol_api.ProtocolContext):
-    tube_rack = protocol.load_labware("opentrons_24_tuberack_eppendorf_1.5ml_safelock_snapcap", 5)
-    water_plate = protocol.load_labware("opentrons_96_wellplate_200ul_pcr_full_skirt", 3)
+    reservoir = protocol.load_labware(PLAN_LABWARE["reservoir"], 5)
+    water_plate = protocol.load_labware(PLAN_LABWARE["water_plate"], 3)
+    plan_labware = {"reservoir": reservoir, "water_plate": water_plate}
     water = protocol.define_liquid(
         name="Water",
         description="The liquid being used to dilute the sample.",
         display_color="#0051FF"
     )
-    tube_rack.load_liquid(
-        wells=["A1"],
-        volume=150,
-        liquid=water
-    )
-    
-    csv_water_volume = water_volume_data.splitlines()[1:]
-    water_volume_reader = csv.DictReader(csv_water_volume)
-    wells_used = []
-    water_volumes = {}
-    for row in water_volume_reader:
-        r = row[""]
-        for i in range(1,13):
-            new_key = r + (str) (i)
-            row[new_key] = row.pop(f'{i}')
-        del row[""]
-        keys = list(row.keys())
-        not_blank = []
-        for key in keys:
-            if row[key] != '':
-                not_blank.append(key)
-        wells_used.extend(not_blank)
-        water_volumes |= row
     
-    water_plate.load_liquid(
-        wells=wells_used,
-        volume=150,
-        liquid=water
-    )
+    # use the uploaded concentrations or volumes if there are any, otherwise the compiled plan or the data pasted into
+    # this file
+    try:
+        # either a single grid of concentrations, or the water volume grid followed by the DNA volume grid, each
+        # starting with its own header row
+        plan = make_plan(PlateMap.parse_all(protocol.params.volume_data_csv.contents), protocol.params, plan_labware)
+    except protocol_api.RuntimeParameterRequiredError:
+        if compiled_plan_data.strip():
+            plan = load_plan(compiled_plan_data, "normalization")
+        else:
+            plan = make_plan(pasted_maps(), protocol.params, plan_labware)
+    wells_used = plan["wells"]
+    # point out the samples that can't be brought to the target
+    for note in plan.get("notes", []):
+        protocol.comment(note)
     
-    dna_plate = protocol.load_labware("opentrons_96_wellplate_200ul_pcr_full_skirt", 2)
+    # fill every well of the reservoir with the water drawn from it, the disposal volume that is blown back into it
+    # and the volume that can't be aspirated
+    water_volume = {}
+    for step in plan["steps"]:
+        if step["source"] == "reservoir":
+            water_volume[step["sources"][0]] = water_volume.get(step["sources"][0], 0.0) + sum(step["volumes"]) + step.get("disposal_volume", 0)
+    for well, volume in water_volume.items():
+        if volume + WATER_DEAD_VOLUME > reservoir[well].max_volume:
+            raise ValueError("The transfer plan draws " + str(round(volume)) + " µl of water from " + well + " of the reservoir, which holds " + str(round(reservoir[well].max_volume - WATER_DEAD_VOLUME)) + " µl that can be aspirated.")
+        reservoir.load_liquid(
+            wells=[well],
+            volume=volume + WATER_DEAD_VOLUME,
+            liquid=water
+        )
     
-    csv_dna_volume = dna_volume_data.splitlines()[1:]
-    dna_volume_reader = csv.DictReader(csv_dna_volume)
-    dna_volumes = {}
-    for row in dna_volume_reader:
-        r = row[""]
-        for i in range(1,13):
-            new_key = r + (str) (i)
-            row[new_key] = row.pop(f'{i}')
-        del row[""]
-        dna_volumes |= row
+    dna_plate = protocol.load_labware(PLAN_LABWARE["dna_plate"], 2)
     
     dna = protocol.define_liquid(
         name="DNA",
@@ -142,13 +849,25 @@ def run(protocol: protocol_api.ProtocolContext):
     tips = protocol.load_labware("opentrons_96_tiprack_20ul", 6)
     left_pipette = protocol.load_instrument("p20_single_gen2", "left", tip_racks=[tips])
     left_pipette.starting_tip = tips[protocol.params.starting_tip_row + protocol.params.starting_tip_col]
+    if protocol.params.multichannel:
+        # the 8-channel pipette takes the even columns of DNA, from a full rack of 20µl tips
+        tips_multi = protocol.load_labware("opentrons_96_tiprack_20ul", 9)
+        right_pipette = protocol.load_instrument("p20_multi_gen2", "right", tip_racks=[tips_multi])
+    else:
+        # the p300 takes the volumes over 20µl, from a full tip rack
+        tips_300 = protocol.load_labware("opentrons_96_tiprack_300ul", 9)
+        right_pipette = protocol.load_instrument("p300_single_gen2", "right", tip_racks=[tips_300])
     
-    # add the specified volumes of water to the plate
-    left_pipette.pick_up_tip()
-    for well in wells_used:
-        left_pipette.transfer((float) (water_volumes[well]), tube_rack["A1"], water_plate[well], new_tip="never", blow_out=True, blowout_location="destination well")
-    left_pipette.drop_tip()
+    # load as many more racks of tips as the plan uses, in the free slots
+    free_slots = list(FREE_SLOTS)
+    for mount, pipette in (("left", left_pipette), ("right", right_pipette)):
+        rack = pipette.tip_racks[0]
+        first_tip = rack.wells().index(pipette.starting_tip) if pipette.starting_tip is not None else 0
+        tips = first_tip + pipette.channels * sum(tips_used(step, pipette.max_volume) for step in plan["steps"] if step["pipette"] == mount)
+        for i in range(math.ceil(tips / len(rack.wells())) - 1):
+            if not free_slots:
+                raise ValueError("The run needs more tips than the racks in the free slots hold.")
+            pipette.tip_racks = pipette.tip_racks + [protocol.load_labware(rack.load_name, free_slots.pop(0))]
     
-    # add the specified volumes of DNA to the plate with water
-    for well in wells_used:
-        left_pipette.transfer((float) (dna_volumes[well]), dna_plate[well], water_plate[well], blow_out=True, blowout_location="destination well")
\ No newline at end of file
+    # add the water to the plate, then the DNA
+    run_plan(plan, {"left": left_pipette, "right": right_pipette}, {"reservoir": reservoir, "water_plate": water_plate, "dna_plate": dna_plate})
\ No newline at end of file
@@ -1,17 +1,336 @@
 # imports
 from opentrons import protocol_api
-import csv
 
 # metadata
 metadata = {
     "protocolName": "Pooling",
-    "description": "Pools liquid from user-specified wells into a single tube.\nThis protocol requires the user to change some values in the code. Please see the protocol file for more information.",
+    "description": "Pools liquid from user-specified wells into a single tube.\nThe wells can be uploaded as a CSV file or changed in the code. Please see the protocol file for more information.",
     "author": "Reya Miller"
 }
 
 requirements = {"robotType": "OT-2", "apiLevel": "2.22"}
 
+# >>> lib/plate_map.py (inlined by tools/bundle.py, edit the original instead)
+from array import array
+
+PLATE_ROWS = "ABCDEFGH"
+PLATE_COLS = 12
+
+def well_index(well: str) -> int:
+    """
+    Returns the index of a well in column order (A1, B1, ..., H1, A2, ...), the same order as ``Labware.wells()``.
+
+    :param well: The name of the well, e.g. ``"B3"``.
+    """
+    return (int(well[1:]) - 1) * 8 + PLATE_ROWS.index(well[0].upper())
+
+def well_name(index: int) -> str:
+    """
+    Returns the name of the well at the given column-order index.
+
+    :param index: The index of the well, from 0 (A1) to 95 (H12).
+    """
+    return PLATE_ROWS[index % 8] + str(index // 8 + 1)
+
+def serpentine(wells: list[str]) -> list[str]:
+    """
+    Returns wells in an order with little travel between them: row by row, every row in the opposite direction of the
+    one before, so the pipette moves on to the nearest well of the next row instead of going back to column 1.
+
+    :param wells: The names of the wells, in any order.
+    """
+    rows = {}
+    for well in sorted(wells, key=lambda well: int(well[1:])):
+        rows.setdefault(PLATE_ROWS.index(well[0].upper()), []).append(well)
+    ordered = []
+    for i, row in enumerate(sorted(rows)):
+        ordered += rows[row] if i % 2 == 0 else rows[row][::-1]
+    return ordered
+
+class PlateMap:
+    """
+    A parsed 96-well plate map.
+
+    The occupied wells are stored as a 96-bit mask with bit ``col * 8 + row`` set for every occupied well, so every
+    column is one byte of the mask and can be queried in constant time. The value of every well (1.0 for ``TRUE``, or
+    the number in the cell) is stored in a float array indexed the same way.
+    """
+
+    def __init__(self, mask=0, values=None):
+        """
+        :param mask: The occupancy mask.
+        :param values: A float array of 96 well values, in column order.
+        """
+        self.mask = mask
+        self.values = values if values is not None else array("d", [0.0] * (8 * PLATE_COLS))
+
+    @classmethod
+    def parse(cls, data: str) -> "PlateMap":
+        """
+        Parses a single plate map grid.
+
+        :param data: The grid, comma- or tab-separated, as pasted into a protocol or uploaded as a CSV file.
+        """
+        maps = cls.parse_all(data)
+        if len(maps) != 1:
+            raise ValueError("Expected one plate map, found " + str(len(maps)) + ".")
+        return maps[0]
+
+    @classmethod
+    def parse_all(cls, data: str) -> list["PlateMap"]:
+        """
+        Parses one or more plate map grids that follow each other, each starting with its own header row.
+
+        :param data: The grids, comma- or tab-separated.
+        """
+        maps = []
+        header = None
+        for line in data.lstrip("\ufeff").replace("\t", ",").splitlines():
+            cells = [cell.strip() for cell in line.split(",")]
+            if all(cell == "" for cell in cells):
+                continue
+            if cells[0] == "":
+                # a header row starts a new grid; remember which column every cell belongs to
+                header = [int(cell) - 1 if cell != "" else None for cell in cells[1:]]
+                maps.append(cls())
+                continue
+            if header is None:
+                raise ValueError("The plate map must start with a header row of column numbers.")
+            row = PLATE_ROWS.find(cells[0].upper())
+            if row < 0 or len(cells[0]) != 1:
+                raise ValueError("Unknown plate row " + repr(cells[0]) + ".")
+            plate_map = maps[-1]
+            for col, cell in zip(header, cells[1:]):
+                if col is None or cell == "" or cell.upper() == "FALSE":
+                    continue
+                index = col * 8 + row
+                plate_map.mask |= 1 << index
+                plate_map.values[index] = 1.0 if cell.upper() == "TRUE" else float(cell)
+        return maps
+
+    def __len__(self) -> int:
+        return bin(self.mask).count("1")
+
+    def __contains__(self, well: str) -> bool:
+        return (self.mask >> well_index(well)) & 1 == 1
+
+    def __getitem__(self, well: str) -> float:
+        return self.values[well_index(well)]
+
+    def column_mask(self, col: int) -> int:
+        """
+        Returns the occupancy of a column as an 8-bit mask, with bit 0 for row A and bit 7 for row H.
+
+        :param col: The column index, from 0 to 11.
+        """
+        return (self.mask >> (col * 8)) & 0xFF
+
+    def column_count(self, col: int) -> int:
+        """
+        Returns the number of occupied wells in a column.
+
+        :param col: The column index, from 0 to 11.
+        """
+        return bin(self.column_mask(col)).count("1")
+
+    def is_full(self, col: int) -> bool:
+        """
+        Returns whether every well of a column is occupied.
+
+        :param col: The column index, from 0 to 11.
+        """
+        return self.column_mask(col) == 0xFF
+
+    def occupied_columns(self) -> list[int]:
+        """Returns the indexes of the columns with at least one occupied well."""
+        return [col for col in range(PLATE_COLS) if self.column_mask(col) != 0]
+
+    def full_columns(self) -> list[int]:
+        """Returns the indexes of the columns in which every well is occupied."""
+        return [col for col in range(PLATE_COLS) if self.column_mask(col) == 0xFF]
+
+    def partial_columns(self) -> list[int]:
+        """Returns the indexes of the columns in which some, but not all, wells are occupied."""
+        return [col for col in range(PLATE_COLS) if 0 < self.column_mask(col) < 0xFF]
+
+    def num_columns(self) -> int:
+        """Returns the number of columns up to and including the last occupied one."""
+        return (self.mask.bit_length() + 7) // 8
+
+    def column_wells(self, col: int) -> list[str]:
+        """
+        Returns the names of the occupied wells of a column, from row A to row H.
+
+        :param col: The column index, from 0 to 11.
+        """
+        col_mask = self.column_mask(col)
+        return [PLATE_ROWS[row] + str(col + 1) for row in range(8) if (col_mask >> row) & 1]
+
+    def wells(self, order="column") -> list[str]:
+        """
+        Returns the names of all occupied wells.
+
+        :param order: ``"column"`` (A1, B1, ..., H1, A2, ...) or ``"row"`` (A1, A2, ..., A12, B1, ...).
+        """
+        if order == "row":
+            indexes = [col * 8 + row for row in range(8) for col in range(PLATE_COLS)]
+        else:
+            indexes = range(8 * PLATE_COLS)
+        return [well_name(i) for i in indexes if (self.mask >> i) & 1]
+
+    def column_plan(self) -> list[tuple[int, list[str]]]:
+        """
+        Splits the occupied wells into groups that can each be pipetted in one go by an 8-channel pipette: every full
+        column, and every run of neighbouring occupied wells in a partially filled column. Empty columns are skipped.
+
+        :return: A list of (column index, wells) tuples, in column order, with the wells of each group from back to
+            front.
+        """
+        plan = []
+        for col in self.occupied_columns():
+            wells = []
+            for well in self.column_wells(col):
+                if wells and PLATE_ROWS.index(well[0]) != PLATE_ROWS.index(wells[-1][0]) + 1:
+                    plan.append((col, wells))
+                    wells = []
+                wells.append(well)
+            plan.append((col, wells))
+        return plan
+# <<< lib/plate_map.py
+
+# >>> lib/transfer_plan.py (inlined by tools/bundle.py, edit the original instead)
+import json
+import math
+import re
+
+# the version of the plan format, changed whenever old plans can no longer be replayed
+PLAN_FORMAT = 1
+WELL_NAME = re.compile(r"[A-P]([1-9]|1[0-9]|2[0-4])")
+NEW_TIP = ("once", "always", "never")
+# the largest volume of one aspiration, in µl
+PIPETTE_MAX_VOLUMES = {
+    "p20_single_gen2": 20,
+    "p20_multi_gen2": 20,
+    "p300_single_gen2": 300,
+    "p300_multi_gen2": 300,
+    "p1000_single_gen2": 1000,
+}
+
+def check_plan(plan: dict, protocol_name: str):
+    """
+    Raises a ValueError if a plan is malformed or was compiled for another protocol.
+
+    :param plan: The plan.
+    :param protocol_name: The name of the protocol that replays it, e.g. ``"pooling"``.
+    """
+    if not isinstance(plan, dict) or plan.get("format") != PLAN_FORMAT:
+        raise ValueError("The transfer plan is not in format " + str(PLAN_FORMAT) + "; compile it again with tools/compile_plan.py.")
+    if plan.get("protocol") != protocol_name:
+        raise ValueError("The transfer plan was compiled for " + repr(plan.get("protocol")) + ", not " + repr(protocol_name) + ".")
+    for key in ("labware", "pipettes"):
+        if not isinstance(plan.get(key), dict):
+            raise ValueError("The transfer plan has no " + key + ".")
+    if not isinstance(plan.get("wells"), list) or not all(isinstance(well, str) and WELL_NAME.fullmatch(well) for well in plan["wells"]):
+        raise ValueError("The wells of the transfer plan must be a list of well names.")
+    if not isinstance(plan.get("notes", []), list) or not all(isinstance(note, str) for note in plan.get("notes", [])):
+        raise ValueError("The notes of the transfer plan must be a list of strings.")
+    if not isinstance(plan.get("steps"), list):
+        raise ValueError("The transfer plan has no steps.")
+    for number, step in enumerate(plan["steps"], 1):
+        where = "Step " + str(number) + " of the transfer plan"
+        if step.get("pipette") not in plan["pipettes"]:
+            raise ValueError(where + " uses an unknown pipette " + repr(step.get("pipette")) + ".")
+        if step.get("source") not in plan["labware"] or step.get("dest") not in plan["labware"]:
+            raise ValueError(where + " uses unknown labware.")
+        if step.get("new_tip") not in NEW_TIP:
+            raise ValueError(where + " has an unknown new_tip " + repr(step.get("new_tip")) + ".")
+        sources, dests, volumes = step.get("sources"), step.get("dests"), step.get("volumes")
+        if not isinstance(sources, list) or not sources or not isinstance(dests, list) or not isinstance(volumes, list) or not len(sources) == len(dests) == len(volumes):
+            raise ValueError(where + " must have as many sources, destinations and volumes, and at least one of each.")
+        for well in sources + dests:
+            if not isinstance(well, str) or not WELL_NAME.fullmatch(well):
+                raise ValueError(where + " has an unknown well " + repr(well) + ".")
+        for volume in volumes + [step.get("disposal_volume", 0)]:
+            if isinstance(volume, bool) or not isinstance(volume, (int, float)) or volume < 0:
+                raise ValueError(where + " has an invalid volume " + repr(volume) + ".")
+        if "disposal_volume" in step and len(set(sources)) != 1:
+            raise ValueError(where + " is a multi-dispense run, so it must have a single source well.")
+        # every aspiration of a multi-dispense run takes the disposal volume on top of the volume of at least one well
+        max_volume = PIPETTE_MAX_VOLUMES.get(plan["pipettes"][step["pipette"]])
+        if "disposal_volume" in step and max_volume is not None and max(volumes) + step["disposal_volume"] > max_volume:
+            raise ValueError(where + " dispenses up to " + str(max(volumes)) + " µl with a disposal volume of " + str(step["disposal_volume"]) + " µl, more than the " + str(max_volume) + " µl the pipette aspirates at once.")
+
+def load_plan(data: str, protocol_name: str) -> dict:
+    """
+    Parses and checks a plan.
+
+    :param data: The plan as JSON.
+    :param protocol_name: The name of the protocol that replays it, e.g. ``"pooling"``.
+    """
+    plan = json.loads(data)
+    check_plan(plan, protocol_name)
+    return plan
+
+def tips_used(step: dict, max_volume: float) -> int:
+    """
+    Returns the number of times a step of a plan picks up a tip, or a column of tips for a multi-channel pipette.
+
+    :param step: The step.
+    :param max_volume: The largest volume the pipette aspirates at once, in µl.
+    """
+    if step["new_tip"] == "once":
+        return 1
+    if step["new_tip"] == "never":
+        return 0
+    # a volume larger than the pipette holds is split into several aspirations, each with its own tip
+    return sum(max(1, math.ceil(volume / max_volume)) for volume in step["volumes"])
+
+def run_plan(plan: dict, pipettes: dict, labware: dict):
+    """
+    Makes the transfers of a plan.
+
+    :param plan: The plan, from ``load_plan()`` or the protocol's ``make_plan()``.
+    :param pipettes: The pipettes named in the plan, by name.
+    :param labware: The labware named in the plan, by name.
+    """
+    # a plan compiled for other labware or pipettes would still replay, but to the wrong heights and volumes
+    for name, load_name in plan["labware"].items():
+        if name not in labware:
+            raise ValueError("The transfer plan uses labware " + repr(name) + ", which the protocol doesn't load; compile it again with tools/compile_plan.py.")
+        if labware[name].load_name != load_name:
+            raise ValueError("The transfer plan expects " + load_name + " as " + name + ", but the protocol loads " + labware[name].load_name + ".")
+    for name, pipette_name in plan["pipettes"].items():
+        if name not in pipettes:
+            raise ValueError("The transfer plan uses a pipette on the " + name + " mount, which the protocol doesn't load.")
+        if pipettes[name].name != pipette_name:
+            raise ValueError("The transfer plan expects " + pipette_name + " as " + name + ", but the protocol loads " + pipettes[name].name + ".")
+
+    for step in plan["steps"]:
+        source = labware[step["source"]]
+        dest = labware[step["dest"]]
+        if "disposal_volume" in step:
+            pipettes[step["pipette"]].distribute(
+                step["volumes"],
+                source[step["sources"][0]],
+                [dest[well] for well in step["dests"]],
+                new_tip=step["new_tip"],
+                disposal_volume=step["disposal_volume"],
+                blow_out=True,
+                blowout_location="source well"
+            )
+            continue
+        pipettes[step["pipette"]].transfer(
+            step["volumes"],
+            [source[well] for well in step["sources"]],
+            [dest[well] for well in step["dests"]],
+            new_tip=step["new_tip"],
+            blow_out=True,
+            blowout_location="destination well"
+        )
+# <<< lib/transfer_plan.py
+
 # copy and paste from a spreadsheet or manually change the values here to specify wells to pool from
+# this is only used if no CSV file is uploaded for the "selected_wells_csv" parameter
 # see https://docs.google.com/spreadsheets/d/1xxteNo-ELEXkcBVYScM2-33683Ea6CttAoCTvS-vjFQ/edit?usp=sharing for template
 selected_wells_data = """
 	1	2	3	4	5	6	7	8	9	10	11	12
@@ -24,7 +343,41 @@ F	FALSE	TRUE	FALSE	TRUE	FALSE	TRUE	FALSE	TRUE	FALSE	TRUE	FALSE	FALSE
 G	FALSE	TRUE	FALSE	TRUE	FALSE	TRUE	FALSE	TRUE	FALSE	TRUE	FALSE	FALSE
 H	FALSE	TRUE	FALSE	TRUE	FALSE	TRUE	FALSE	TRUE	FALSE	TRUE	FALSE	FALSE
 """
-selected_wells_data = selected_wells_data.replace('\t', ',')
+
+# a transfer plan compiled from a plate map with "python tools/compile_plan.py pooling --map wells.csv --inline"
+# if it isn't empty, it is used instead of the plate map above (but an uploaded CSV file still takes precedence)
+compiled_plan_data = """
+"""
+
+def pasted_maps() -> list[PlateMap]:
+    """
+    Returns the plate map pasted into this file.
+    """
+    return [PlateMap.parse(selected_wells_data)]
+
+def make_plan(maps: list[PlateMap], params) -> dict:
+    """
+    Works out the transfers of a run (see lib/transfer_plan.py).
+
+    :param maps: The plate map of the wells to pool from.
+    :param params: The runtime parameters.
+    """
+    if len(maps) != 1:
+        raise ValueError("Expected one plate map, found " + str(len(maps)) + ".")
+    selected_wells = maps[0].wells(order="row")
+    # add x µl of water to the eppendorf tube, where x = (100 - number of samples)
+    steps = [{"pipette": "left", "source": "tube_rack", "dest": "tube_rack", "sources": ["A1"], "dests": ["A2"], "volumes": [100 - len(selected_wells)], "new_tip": "once"}]
+    # pool the DNA from the selected wells of the plate into the eppendorf tube with water, with a new tip for every well
+    if selected_wells:
+        steps.append({"pipette": "left", "source": "dna_plate", "dest": "tube_rack", "sources": selected_wells, "dests": ["A2"] * len(selected_wells), "volumes": [1] * len(selected_wells), "new_tip": "always"})
+    return {
+        "format": PLAN_FORMAT,
+        "protocol": "pooling",
+        "labware": {"tube_rack": "opentrons_24_tuberack_eppendorf_1.5ml_safelock_snapcap", "dna_plate": "opentrons_96_wellplate_200ul_pcr_full_skirt"},
+        "pipettes": {"left": "p20_single_gen2"},
+        "wells": selected_wells,
+        "steps": steps
+    }
 
 def add_parameters(parameters: protocol_api.Parameters):
     # if necessary, tell the robot the location of the first available tip on the tip rack
@@ -64,24 +417,23 @@ def add_parameters(parameters: protocol_api.Parameters):
         ],
         default="1"
     )
+    parameters.add_csv_file(
+        variable_name="selected_wells_csv",
+        display_name="Selected wells",
+        description="Optional CSV plate map of the wells to pool from. Otherwise uses the map in the file."
+    )
 
 def run(protocol: protocol_api.ProtocolContext):
     # read the selected wells data to determine which wells to pool from
-    csv_wells_data = selected_wells_data.splitlines()[1:]
-    wells_data_reader = csv.DictReader(csv_wells_data)
-    selected_wells = []
-    for row in wells_data_reader:
-        r = row[""]
-        for i in range(1,13):
-            new_key = r + str(i)
-            row[new_key] = row.pop(f'{i}')
-        del row[""]
-        keys = list(row.keys())
-        true_keys = []
-        for key in keys:
-            if row[key] == "TRUE":
-                true_keys.append(key)
-        selected_wells.extend(true_keys)
+    # use the uploaded plate map if there is one, otherwise the compiled plan or the plate map pasted into this file
+    try:
+        plan = make_plan(PlateMap.parse_all(protocol.params.selected_wells_csv.contents), protocol.params)
+    except protocol_api.RuntimeParameterRequiredError:
+        if compiled_plan_data.strip():
+            plan = load_plan(compiled_plan_data, "pooling")
+        else:
+            plan = make_plan(pasted_maps(), protocol.params)
+    selected_wells = plan["wells"]
     
     # define the tube rack and indicate where the tube of water is
     tube_rack = protocol.load_labware("opentrons_24_tuberack_eppendorf_1.5ml_safelock_snapcap", 3)
@@ -116,9 +468,5 @@ def run(protocol: protocol_api.ProtocolContext):
     left_pipette = protocol.load_instrument("p20_single_gen2", "left", tip_racks=[tips_1, tips_2, tips_3])
     left_pipette.starting_tip = tips_1[protocol.params.starting_tip_row + protocol.params.starting_tip_col]
     
-    # add x µl of water to the eppendorf tube, where x = (100 - number of samples)
-    left_pipette.transfer(volume=(100 - len(selected_wells)), source=tube_rack["A1"], dest=tube_rack["A2"], blow_out=True, blowout_location="destination well")
-    
-    # pool the DNA from the selected wells of the plate into the eppendorf tube with water
-    for well in selected_wells:
-        left_pipette.transfer(volume=1, source=dna_plate[well], dest=tube_rack["A2"], blow_out=True, blowout_location="destination well")
\ No newline at end of file
+    # add the water to the eppendorf tube and pool the DNA into it
+    run_plan(plan, {"left": left_pipette}, {"tube_rack": tube_rack, "dna_plate": dna_plate})
\ No newline at end of file
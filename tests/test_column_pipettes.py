@@ -0,0 +1,141 @@
+"""
+Tests for ``lib/column_pipettes.py``, on a simulated OT-2 with the deck of DNA Extraction and Purification.
+
+Run them from the repository root with ``python -m pytest``.
+"""
+import json
+from pathlib import Path
+
+import pytest
+from opentrons import protocol_api, simulate
+
+from lib.column_pipettes import ColumnPipettes
+from lib.plate_map import PlateMap
+
+LABWARE = Path(__file__).resolve().parent.parent / "labware"
+
+def make_deck(samples: int, partial=True) -> tuple:
+    """
+    Returns a protocol context with the labware of DNA Extraction and Purification, the ``ColumnPipettes`` for it, the
+    column plan of the first samples of a plate, and the labware as a dict.
+
+    :param samples: The number of samples, filled column by column.
+    :param partial: Whether to load a rack for partial pickups.
+    """
+    extra_labware = {path.stem: json.loads(path.read_text()) for path in LABWARE.glob("*.json")}
+    protocol = simulate.get_protocol_api("2.22", extra_labware=extra_labware)
+    labware = {
+        "reservoir": protocol.load_labware("nest_12_reservoir_15ml", 3),
+        "waste": protocol.load_labware("nest_1_reservoir_195ml", 4),
+        "sample_plate": protocol.load_labware("greinerbioonegmbh_96_wellplate_2000ul", 6),
+        "dna_plate": protocol.load_labware("thermofast_96_wellplate_200ul", 7),
+        "magnet_plate": protocol.load_labware("96well_plate_2000ul_on_magnet_plate", protocol_api.OFF_DECK),
+    }
+    single_tips = protocol.load_labware("opentrons_96_tiprack_300ul", 11)
+    multi_tips = protocol.load_labware("opentrons_96_tiprack_300ul", 8)
+    multi = protocol.load_instrument("p300_multi_gen2", "right", tip_racks=[multi_tips])
+    single = protocol.load_instrument("p300_single_gen2", "left", tip_racks=[single_tips])
+    column_plan = PlateMap((1 << samples) - 1).column_plan()
+    partial_tip_racks = [protocol.load_labware("opentrons_96_tiprack_300ul", 1)] if partial else []
+    pipettes = ColumnPipettes(protocol, multi, single, partial_tip_racks)
+    pipettes.stand_in(labware["magnet_plate"], labware["sample_plate"])
+    return protocol, pipettes, column_plan, labware
+
+def test_demand_counts_every_kind_of_pickup():
+    protocol, pipettes, column_plan, labware = make_deck(12)
+    for col, wells in column_plan:
+        pipettes.plan(wells, labware["reservoir"], labware["sample_plate"], tips=2)
+    pipettes.plan(["A1"], labware["sample_plate"], single=True)
+    demand = pipettes.demand()
+    # a full column, then the other 4 samples in one partial pickup, each twice, and the single well
+    assert demand == {"multi": [8, 8], "partial": [4, 4], "single": [1], "parked": []}
+
+def test_partial_pickups_need_room_behind():
+    protocol, pipettes, column_plan, labware = make_deck(4)
+    # the tip rack in slot 8 is taller than the nozzles without tips clear over a PCR plate in slot 5
+    pcr_plate = protocol.load_labware("thermofast_96_wellplate_200ul", 5)
+    pipettes.plan(column_plan[0][1], pcr_plate)
+    pipettes.plan(column_plan[0][1], labware["sample_plate"])
+    assert pipettes.demand() == {"multi": [], "partial": [4], "single": [1] * 4, "parked": []}
+
+def test_without_partial_racks_partial_columns_go_to_the_single_channel_pipette():
+    protocol, pipettes, column_plan, labware = make_deck(12, partial=False)
+    for col, wells in column_plan:
+        pipettes.plan(wells, labware["sample_plate"])
+    assert pipettes.demand() == {"multi": [8], "partial": [], "single": [1] * 4, "parked": []}
+
+def test_parked_tips_are_counted_once_per_well():
+    protocol, pipettes, column_plan, labware = make_deck(12)
+    for i in range(3):
+        for col, wells in column_plan:
+            pipettes.plan(wells, labware["sample_plate"], tips=0, parked=labware["sample_plate"])
+    # partial pickups can't return tips, so only the full column parks its tips
+    assert pipettes.demand() == {"multi": [], "partial": [4] * 3, "single": [], "parked": [8]}
+
+def test_stand_in_plans_like_the_labware_it_stands_in_for():
+    protocol, pipettes, column_plan, labware = make_deck(12)
+    for col, wells in column_plan:
+        pipettes.plan(wells, labware["magnet_plate"], labware["waste"])
+    pipettes.load_tip_racks()
+    protocol.move_labware(labware["sample_plate"], protocol_api.OFF_DECK)
+    protocol.move_labware(labware["magnet_plate"], "6")
+    for col, wells in column_plan:
+        pipette, visits = pipettes.pick(wells, labware["magnet_plate"], labware["waste"])
+    assert pipettes.remaining == {"multi": [], "partial": [], "single": [], "parked": []}
+    assert not any("Unplanned pickup" in command for command in protocol.commands())
+
+def test_unplanned_pickups_are_noted():
+    protocol, pipettes, column_plan, labware = make_deck(12)
+    pipettes.plan(column_plan[0][1], labware["sample_plate"])
+    pipettes.load_tip_racks()
+    pipettes.pick(column_plan[1][1], labware["sample_plate"])
+    assert any("Unplanned pickup: the wells A2, B2, C2, D2 use a partial pickup" in command for command in protocol.commands())
+
+def test_rack_plan_loads_racks_for_the_pickups_that_run_out():
+    protocol, pipettes, column_plan, labware = make_deck(96, partial=False)
+    # 2 racks' worth of full columns for the 8-channel pipette, which has 1 rack
+    for i in range(2):
+        for col, wells in column_plan:
+            pipettes.plan(wells, labware["sample_plate"], tips=1)
+    free_slots = [str(slot) for slot in range(1, 12) if protocol.deck[slot] is None]
+    loads, refills_needed = pipettes.rack_plan(free_slots)
+    assert [kind for kind, slot in loads] == ["multi"]
+    assert refills_needed == {"multi": 0}
+
+def test_rack_plan_keeps_racks_from_behind_partial_pickups():
+    protocol, pipettes, column_plan, labware = make_deck(12)
+    # the partial pickups visit the reservoir in slot 3, so slot 6 is left for them to reach over; slot 6 holds the
+    # sample plate anyway, and slot 9 is free but behind the sample plate
+    for i in range(20):
+        for col, wells in column_plan:
+            pipettes.plan(wells, labware["reservoir"], labware["sample_plate"], tips=8)
+    free_slots = [str(slot) for slot in range(1, 12) if protocol.deck[slot] is None]
+    loads, refills_needed = pipettes.rack_plan(free_slots)
+    assert loads
+    assert "9" not in [slot for kind, slot in loads]
+
+def test_load_tip_racks_loads_parked_racks_first():
+    protocol, pipettes, column_plan, labware = make_deck(96)
+    for i in range(3):
+        for col, wells in column_plan:
+            pipettes.plan(wells, labware["sample_plate"], tips=0, parked=labware["sample_plate"])
+    pipettes.load_tip_racks()
+    assert len(pipettes.tip_racks["parked"]) == 1
+    # the parked tips have a rack of their own, so the racks of new tips stay as they were
+    assert [int(rack.parent) for rack in pipettes.tip_racks["multi"]] == [8]
+    assert pipettes.remaining["parked"] == [8] * 12
+
+def test_load_tip_racks_without_refills_raises():
+    protocol, pipettes, column_plan, labware = make_deck(96, partial=False)
+    # more full columns than every free slot holds
+    for col, wells in column_plan:
+        pipettes.plan(wells, labware["sample_plate"], tips=12 * 12)
+    with pytest.raises(ValueError):
+        pipettes.load_tip_racks(refills=False)
+
+def test_load_tip_racks_announces_refills():
+    protocol, pipettes, column_plan, labware = make_deck(96, partial=False)
+    for col, wells in column_plan:
+        pipettes.plan(wells, labware["sample_plate"], tips=12 * 12)
+    pipettes.load_tip_racks()
+    assert any("it will pause about" in command for command in protocol.commands())
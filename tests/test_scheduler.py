@@ -0,0 +1,48 @@
+"""
+Tests for ``lib/scheduler.py``, on a simulated OT-2.
+
+Run them from the repository root with ``python -m pytest``.
+"""
+from opentrons import simulate
+
+from lib import scheduler as scheduler_module
+from lib.scheduler import StepScheduler
+
+def run_on_robot(monkeypatch, step_seconds: float) -> list[str]:
+    """
+    Runs four steps as if on the robot, one of which takes the given time on the robot's clock, and returns the order
+    they ran in.
+
+    :param monkeypatch: The pytest fixture, which stands in for the robot's clock.
+    :param step_seconds: How long the slow step takes, in seconds.
+    """
+    protocol = simulate.get_protocol_api("2.22")
+    monkeypatch.setattr(protocol, "is_simulating", lambda: False)
+    robot_clock = [0.0]
+    monkeypatch.setattr(scheduler_module.time, "monotonic", lambda: robot_clock[0])
+    scheduler = StepScheduler(protocol)
+    ran = []
+    def slow():
+        ran.append("slow")
+        robot_clock[0] += step_seconds
+    scheduler.add(lambda: ran.append("first"), ["A1"])
+    scheduler.add(slow, ["A2"])
+    scheduler.add(lambda: ran.append("rest"), ["A1"], wait=60)
+    scheduler.add(lambda: ran.append("other"), ["A3"])
+    scheduler.run()
+    return ran
+
+def test_order_does_not_depend_on_how_long_steps_take(monkeypatch):
+    # by the scheduler's clock, A1 is still resting after the slow step, however long that step actually took
+    assert run_on_robot(monkeypatch, 0) == ["first", "slow", "other", "rest"]
+    assert run_on_robot(monkeypatch, 120) == ["first", "slow", "other", "rest"]
+
+def test_analysis_waits_what_the_estimates_leave():
+    protocol = simulate.get_protocol_api("2.22")
+    scheduler = StepScheduler(protocol)
+    scheduler.add(lambda: None, ["A1"])
+    scheduler.add(lambda: None, ["A1"], wait=60)
+    scheduler.add(lambda: None, ["A2"], duration=40)
+    scheduler.run()
+    # the step on A2 fills 40 of the 60 seconds A1 rests
+    assert [command for command in protocol.commands() if command.startswith("Delaying")] == ["Delaying for 0 minutes and 20.0 seconds"]
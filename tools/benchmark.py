@@ -0,0 +1,473 @@
+"""
+Benchmarks the protocols in the Opentrons simulator over plate occupancies and plate-map shapes.
+
+Every protocol in ``protocols/`` is simulated once for every combination of a plate-map shape and a number of occupied
+wells, with the sample wells written into its pasted plate map (or its parameters, for protocols without one). Each
+run records:
+
+- ``commands``: the number of commands in the run log, including the steps of ``transfer()`` and ``mix()``
+- ``tip_pickups``: the number of tip pickups (a column of tips on the 8-channel pipette counts once)
+- ``partial_pickups``: how many of those take fewer than 8 tips on the 8-channel pipette (see ``count_partial_pickups``)
+- ``partial_fallbacks``: 1 if the protocol left its partially filled columns to the single-channel pipette because
+  partial pickups would have needed more tip refills, otherwise 0
+- ``unplanned_pickups``: the number of tip pickups the purification protocols make another way than their tip plan
+  counted them, from the "Unplanned pickup" comments of ``ColumnPipettes``
+- ``tip_returns``: the number of tips returned to their rack instead of the trash
+- ``labware_moves``: the number of ``move_labware()`` calls
+- ``pauses``: the number of times the protocol pauses for the user
+- ``duration``: the estimated run time in seconds, from the gantry distance between successive locations, the
+  volumes and flow rates of the aspirations and dispenses, and the delays (see ``estimate_duration``)
+
+The results are compared against the baseline in ``tools/benchmark_baseline.json`` and every difference is reported, so
+a change that speeds up one protocol can show that it didn't slow down another. A run of a protocol that picks up fewer
+tips for partially filled columns is also a regression if its plate map has a run of samples in such a column and it
+makes no partial pickups at all, since a deck layout that leaves them no room quietly falls back on the single-channel pipette,
+unless the protocol says it left them out to save tip refills. So is a run with unplanned pickups, since the tip racks
+it loaded and the pauses it announced didn't count them.
+
+Usage::
+
+    python tools/benchmark.py                       # simulate and report the differences from the baseline
+    python tools/benchmark.py --update              # simulate and write the results as the new baseline
+    python tools/benchmark.py --protocols pooling --shapes columns --occupancies 1-96
+
+The runs are spread over one worker process per CPU (``--jobs`` to change that). Simulating takes a few seconds per run
+for the purification protocols, so the default occupancies are a spread from 1 to 96 wells rather than every number.
+Results are cached (see ``tools/simulation_cache.py``), so only the protocols that changed are simulated again;
+``--no-cache`` simulates everything.
+"""
+import argparse
+import concurrent.futures
+import contextlib
+import io
+import json
+import math
+import pathlib
+import random
+import re
+import sys
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from lib.plate_map import PLATE_COLS, PLATE_ROWS, PlateMap, well_index, well_name
+from simulation_cache import SimulationCache, cache_key
+
+BASELINE = ROOT / "tools" / "benchmark_baseline.json"
+METRICS = ["commands", "tip_pickups", "partial_pickups", "partial_fallbacks", "unplanned_pickups", "tip_returns", "labware_moves", "pauses", "duration"]
+# the metrics that are worse when they go up (returning more tips saves new ones)
+COSTS = ["commands", "tip_pickups", "unplanned_pickups", "labware_moves", "pauses", "duration"]
+DEFAULT_OCCUPANCIES = [1, 4, 8, 12, 24, 36, 48, 72, 96]
+
+# the plate-map grids each protocol has pasted in, with the cell values of occupied and empty wells, or for protocols
+# without one, a function that returns the parameter defaults for the occupied wells, and whether the protocol picks up
+# fewer tips with the 8-channel pipette for partially filled columns
+INPUTS = {
+    # the plate layout of the dilution protocol only takes whole columns of samples
+    "dilution": {"params": lambda wells: {"layout": "plate", "num_samples": 8 * math.ceil(len(wells) / 8)}},
+    "dna_extraction_purification": {"grids": {"sample_wells_data": ("TRUE", "FALSE")}, "partial": True},
+    "dna_rna_purification": {"grids": {"sample_wells_data": ("TRUE", "FALSE")}, "partial": True},
+    "normalization": {"grids": {"water_volume_data": ("10.0", ""), "dna_volume_data": ("2.0", "")}},
+    "pooling": {"grids": {"selected_wells_data": ("TRUE", "FALSE")}},
+    "total_rna_purification": {"grids": {"sample_wells_data": ("TRUE", "FALSE")}, "partial": True},
+}
+
+# the OT-2's default gantry speed, in mm/s
+GANTRY_SPEED = 400.0
+# the time to lift the pipette to a safe height and lower it again whenever it moves to another well, in s (the
+# distance the Opentrons duration estimator assumes, at the gantry speed)
+Z_TRAVEL_TIME = 177.8 / GANTRY_SPEED
+# the times of the steps that don't depend on distance or volume, in s, measured on hardware by Opentrons
+PICK_UP_TIP_TIME = 4.0
+DROP_TIP_TIME = 10.0
+BLOW_OUT_TIME = 0.5
+# the centre of the fixed trash in slot 12, which drop tip commands don't give a position for
+TRASH_POSITION = (330.0, 310.0)
+
+def plate_wells(shape: str, occupancy: int) -> list[str]:
+    """
+    Returns the names of the occupied wells of a plate map.
+
+    :param shape: "columns" to fill the plate column by column from A1, "rows" to fill it row by row from A1, or
+        "scattered" for wells spread over the plate at random (always the same ones for the same occupancy).
+    :param occupancy: The number of occupied wells, from 1 to 96.
+    """
+    wells = [well_name(i) for i in range(8 * PLATE_COLS)]
+    if shape == "columns":
+        return wells[:occupancy]
+    if shape == "rows":
+        return [row + str(col) for row in PLATE_ROWS for col in range(1, PLATE_COLS + 1)][:occupancy]
+    if shape == "scattered":
+        return sorted(random.Random(occupancy).sample(wells, occupancy), key=wells.index)
+    raise ValueError("Unknown plate-map shape: " + shape)
+
+def plate_grid(wells: list[str], occupied: str, empty: str) -> str:
+    """
+    Returns a tab-separated plate-map grid, as pasted into a protocol.
+
+    :param wells: The names of the occupied wells.
+    :param occupied: The cell value of an occupied well.
+    :param empty: The cell value of an empty well.
+    """
+    lines = ["\t" + "\t".join(str(col) for col in range(1, PLATE_COLS + 1))]
+    for row in PLATE_ROWS:
+        cells = [occupied if row + str(col) in wells else empty for col in range(1, PLATE_COLS + 1)]
+        lines.append(row + "\t" + "\t".join(cells))
+    return "\n" + "\n".join(lines) + "\n"
+
+def set_grid(source: str, name: str, grid: str) -> str:
+    """
+    Returns the protocol source with a pasted plate-map grid replaced.
+
+    :param source: The protocol source.
+    :param name: The name of the variable holding the grid, e.g. ``"sample_wells_data"``.
+    :param grid: The new grid.
+    """
+    pattern = re.compile(r'^(' + name + r' = """).*?(""")', re.MULTILINE | re.DOTALL)
+    if pattern.search(source) is None:
+        raise ValueError("The protocol has no plate map named " + name + ".")
+    return pattern.sub(lambda match: match.group(1) + grid + match.group(2), source, count=1)
+
+def set_default(source: str, name: str, value) -> str:
+    """
+    Returns the protocol source with the default of a runtime parameter replaced.
+
+    :param source: The protocol source.
+    :param name: The variable name of the parameter.
+    :param value: The new default. It's converted to the type of the parameter, so values from the command line can be
+        given as strings.
+    """
+    kind = re.search(r'add_(\w+)\(\s*variable_name="' + name + '"', source)
+    if kind is None:
+        raise ValueError("The protocol has no parameter named " + name + ".")
+    if kind.group(1) == "bool":
+        value = repr(str(value).lower() in ("true", "1", "yes"))
+    elif kind.group(1) in ("int", "float"):
+        value = repr(int(value) if kind.group(1) == "int" else float(value))
+    else:
+        value = json.dumps(str(value))
+    pattern = re.compile(r'(variable_name="' + name + r'",.*?\n\s*default=)[^\n]*?(,?\n)', re.DOTALL)
+    return pattern.sub(lambda match: match.group(1) + value + match.group(2), source, count=1)
+
+def protocol_source(protocol: str, wells: list[str], params=None) -> str:
+    """
+    Returns the source of a protocol with the given wells occupied.
+
+    :param protocol: The name of the protocol file in ``protocols/``, without ``.py``.
+    :param wells: The names of the occupied wells.
+    :param params: The defaults to give other runtime parameters, by variable name, or None.
+    """
+    if protocol not in INPUTS:
+        raise ValueError("No benchmark inputs for " + protocol + "; add it to INPUTS in tools/benchmark.py.")
+    source = (ROOT / "protocols" / (protocol + ".py")).read_text()
+    for name, (occupied, empty) in INPUTS[protocol].get("grids", {}).items():
+        source = set_grid(source, name, plate_grid(wells, occupied, empty))
+    for name, value in INPUTS[protocol].get("params", lambda wells: {})(wells).items():
+        source = set_default(source, name, value)
+    for name, value in (params or {}).items():
+        source = set_default(source, name, value)
+    return source
+
+def position(location) -> tuple[float, float]:
+    """
+    Returns the x and y coordinates of a location from the run log. Locations without coordinates are in the trash.
+
+    :param location: A ``Location``, a ``Well``, or a trash bin.
+    """
+    if hasattr(location, "point"):
+        return location.point.x, location.point.y
+    if hasattr(location, "top"):
+        with contextlib.suppress(Exception):
+            point = location.top().point
+            return point.x, point.y
+    return TRASH_POSITION
+
+def estimate_duration(runlog: list[dict]) -> float:
+    """
+    Returns the estimated run time of a simulated protocol, in seconds: the time to move the gantry between the
+    locations of successive commands, to aspirate and dispense at the logged flow rates, the fixed times of tip
+    handling, and the delays. Pauses and moving labware by hand aren't counted.
+
+    :param runlog: The run log from ``opentrons.simulate.simulate()``.
+    """
+    duration = 0.0
+    last = TRASH_POSITION
+    for entry in runlog:
+        payload = entry["payload"]
+        text = payload["text"]
+        if text.startswith("Delaying for"):
+            duration += payload.get("minutes", 0) * 60 + payload.get("seconds", 0)
+            continue
+        if "location" not in payload or text.startswith(("Mixing", "Transferring", "Distributing", "Consolidating")):
+            continue
+        here = position(payload["location"])
+        if here != last:
+            duration += math.dist(here, last) / GANTRY_SPEED + Z_TRAVEL_TIME
+            last = here
+        if text.startswith("Picking up tip"):
+            duration += PICK_UP_TIP_TIME
+        elif text.startswith("Dropping tip"):
+            duration += DROP_TIP_TIME
+        elif text.startswith("Blowing out"):
+            duration += BLOW_OUT_TIME
+        elif text.startswith(("Aspirating", "Dispensing")):
+            flow_rate = re.search(r" at ([\d.]+) uL/sec", text)
+            if flow_rate is not None and float(flow_rate.group(1)) > 0:
+                duration += payload["volume"] / float(flow_rate.group(1))
+    return duration
+
+def count_partial_pickups(runlog: list[dict]) -> int:
+    """
+    Returns the number of tip pickups with fewer than 8 tips on the 8-channel pipette. The run log doesn't say how many
+    tips a pickup takes, but partial pickups have tip racks of their own, and they name the tip under the back nozzle,
+    which is behind row A until the last tips of a column, so every rack the 8-channel pipette takes such a tip from is
+    one of them.
+
+    :param runlog: The run log from ``opentrons.simulate.simulate()``.
+    """
+    tips = [
+        entry["payload"]["location"] for entry in runlog
+        if entry["payload"]["text"].startswith("Picking up tip") and getattr(entry["payload"].get("instrument"), "channels", 1) == 8
+    ]
+    partial_racks = {tip.parent for tip in tips if not tip.well_name.startswith("A")}
+    return sum(tip.parent in partial_racks for tip in tips)
+
+def has_partial_runs(wells: list[str]) -> bool:
+    """
+    Returns whether a plate map has a run of two to seven neighbouring samples in a column, which the purification
+    protocols pipette with a partial pickup where there is room for it (single samples always go to the single-channel
+    pipette).
+
+    :param wells: The names of the occupied wells.
+    """
+    plate_map = PlateMap(sum(1 << well_index(well) for well in wells))
+    return any(1 < len(run) < len(PLATE_ROWS) for col, run in plate_map.column_plan())
+
+def measure(runlog: list[dict]) -> dict:
+    """
+    Returns the metrics of a simulated protocol.
+
+    :param runlog: The run log from ``opentrons.simulate.simulate()``.
+    """
+    texts = [entry["payload"]["text"] for entry in runlog]
+    return {
+        "commands": len(runlog),
+        "tip_pickups": sum(text.startswith("Picking up tip") for text in texts),
+        "partial_pickups": count_partial_pickups(runlog),
+        "partial_fallbacks": sum(text.startswith("Partial tip pickups would need") for text in texts),
+        "unplanned_pickups": sum(text.startswith("Unplanned pickup") for text in texts),
+        "tip_returns": sum(text.startswith("Returning tip") for text in texts),
+        "labware_moves": sum(text.startswith("Moving ") for text in texts),
+        "pauses": sum(text.startswith("Pausing robot operation") for text in texts),
+        "duration": round(estimate_duration(runlog), 1),
+    }
+
+def simulate(protocol: str, source: str, params=(), cache=None) -> dict:
+    """
+    Simulates a protocol and returns its metrics, or ``{"error": message}`` if the simulation fails.
+
+    :param protocol: The name of the protocol, used as the file name.
+    :param source: The protocol source.
+    :param params: The (name, value) pairs of the runtime parameters set in the source, for the cache key.
+    :param cache: A ``SimulationCache`` to look the result up in and store it in, or None to always simulate.
+    """
+    if cache is not None:
+        key = cache_key(source, params)
+        cached = cache.get(key)
+        # results cached before a metric was added are simulated again
+        if cached is not None and ("error" in cached["result"] or set(METRICS) <= cached["result"].keys()):
+            return cached["result"]
+    import opentrons.simulate
+
+    commands = []
+    try:
+        # the simulator prints warnings about the missing robot calibration
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            runlog, _ = opentrons.simulate.simulate(io.StringIO(source), file_name=protocol + ".py", custom_labware_paths=[str(ROOT / "labware")])
+        commands = [entry["payload"]["text"] for entry in runlog]
+        result = measure(runlog)
+    except Exception as error:
+        # errors from the protocol engine summarize what went wrong in the protocol
+        if hasattr(error, "to_stderr_string"):
+            result = {"error": error.to_stderr_string()}
+        else:
+            result = {"error": type(error).__name__ + ": " + str(error)}
+    if cache is not None:
+        cache.put(key, {"protocol": protocol, "params": dict(params), "commands": commands, "result": result})
+    return result
+
+def run_case(case: tuple, use_cache=True) -> dict:
+    """
+    Simulates one protocol with one plate map and returns its metrics, or ``{"error": message}``.
+
+    :param case: The protocol, the plate-map shape, the occupancy, and a tuple of (name, value) pairs of runtime
+        parameter defaults.
+    :param use_cache: Whether to reuse the result of an earlier simulation of the same source (see
+        ``tools/simulation_cache.py``).
+    """
+    protocol, shape, occupancy, params = case
+    try:
+        source = protocol_source(protocol, plate_wells(shape, occupancy), dict(params))
+    except ValueError as error:
+        return {"error": str(error)}
+    return simulate(protocol, source, params, SimulationCache() if use_cache else None)
+
+def run_cases(cases: list[tuple], jobs=None, log=None, use_cache=True) -> list[dict]:
+    """
+    Simulates a list of cases (see ``run_case``) on a pool of worker processes, one case per worker at a time, and
+    returns their results in the same order.
+
+    :param cases: The cases.
+    :param jobs: The number of worker processes, by default one per CPU. With 1, the cases run in this process.
+    :param log: A function that's called with the case and its result after every run, or None.
+    :param use_cache: Whether to reuse the results of earlier simulations (see ``run_case``).
+    """
+    if jobs == 1:
+        results = []
+        for case in cases:
+            results.append(run_case(case, use_cache))
+            if log is not None:
+                log(case, results[-1])
+        return results
+    results = [None] * len(cases)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(run_case, case, use_cache): i for i, case in enumerate(cases)}
+        for future in concurrent.futures.as_completed(futures):
+            i = futures[future]
+            results[i] = future.result()
+            if log is not None:
+                log(cases[i], results[i])
+    return results
+
+def benchmark_cases(protocols: list[str], shapes: list[str], occupancies: list[int], params=()) -> list[tuple]:
+    """
+    Returns the cases (see ``run_case``) for every protocol, shape and occupancy.
+
+    :param protocols: The names of the protocols.
+    :param shapes: The plate-map shapes (see ``plate_wells``).
+    :param occupancies: The numbers of occupied wells.
+    :param params: The (name, value) pairs of runtime parameter defaults for every case.
+    """
+    cases = []
+    for protocol in protocols:
+        # protocols without a plate map always take their samples column by column
+        protocol_shapes = shapes if "grids" in INPUTS.get(protocol, {}) else ["columns"]
+        for shape in protocol_shapes:
+            for occupancy in occupancies:
+                cases.append((protocol, shape, occupancy, tuple(params)))
+    return cases
+
+def case_name(case: tuple) -> str:
+    """
+    Returns a short description of a case (see ``run_case``), e.g. ``"pooling columns 24 starting_tip_col=3"``.
+
+    :param case: The case.
+    """
+    protocol, shape, occupancy, params = case
+    return " ".join([protocol, shape, str(occupancy)] + [name + "=" + str(value) for name, value in params])
+
+def run_benchmarks(protocols: list[str], shapes: list[str], occupancies: list[int], jobs=None, log=None, use_cache=True) -> dict:
+    """
+    Simulates every protocol for every shape and occupancy and returns the results, as
+    ``{protocol: {shape: {occupancy: metrics}}}`` with the occupancies as strings.
+
+    :param protocols: The names of the protocols.
+    :param shapes: The plate-map shapes (see ``plate_wells``).
+    :param occupancies: The numbers of occupied wells.
+    :param jobs: The number of worker processes (see ``run_cases``).
+    :param log: A function that's called with a line of progress after every run, or None.
+    :param use_cache: Whether to reuse the results of earlier simulations (see ``run_case``).
+    """
+    cases = benchmark_cases(protocols, shapes, occupancies)
+    progress = None if log is None else lambda case, metrics: log(case_name(case) + ": " + json.dumps(metrics))
+    results = {}
+    for (protocol, shape, occupancy, params), metrics in zip(cases, run_cases(cases, jobs, progress, use_cache)):
+        results.setdefault(protocol, {}).setdefault(shape, {})[str(occupancy)] = metrics
+    return results
+
+def compare(baseline: dict, results: dict, tolerance=0.01) -> tuple[list[str], bool]:
+    """
+    Compares results against a baseline. Returns the lines of a report listing every difference, and whether any of
+    them is a regression: a run that fails that didn't, a cost that went up (the estimated duration only if it went
+    up by more than the tolerance, since the delays depend on how fast the simulator runs), or a run without partial
+    pickups that should have some and didn't leave them out to save tip refills, or a run with unplanned pickups.
+
+    :param baseline: The baseline results, from ``run_benchmarks()``.
+    :param results: The new results.
+    :param tolerance: The share the estimated duration may go up by without counting as a regression.
+    """
+    lines = []
+    regressed = False
+    for protocol, shapes in results.items():
+        for shape, runs in shapes.items():
+            for occupancy, metrics in runs.items():
+                name = protocol + " " + shape + " " + occupancy
+                before = baseline.get(protocol, {}).get(shape, {}).get(occupancy)
+                if before is None:
+                    lines.append(name + ": new")
+                elif "error" in metrics or "error" in before:
+                    if metrics.get("error") != before.get("error"):
+                        lines.append(name + ": " + before.get("error", "ok") + " -> " + metrics.get("error", "ok"))
+                        regressed = regressed or "error" in metrics
+                else:
+                    for metric in METRICS:
+                        old, new = before.get(metric), metrics.get(metric)
+                        # metrics that were added after the baseline was written
+                        if old == new or old is None:
+                            continue
+                        change = " (" + format((new - old) / old, "+.1%") + ")" if old else ""
+                        limit = old * tolerance if metric == "duration" else 0
+                        worse = metric in COSTS and new > old + limit
+                        lines.append(name + ": " + metric + " " + str(old) + " -> " + str(new) + change + (" REGRESSION" if worse else ""))
+                        regressed = regressed or worse
+                if metrics.get("unplanned_pickups"):
+                    lines.append(name + ": " + str(metrics["unplanned_pickups"]) + " unplanned pickups REGRESSION")
+                    regressed = True
+                if INPUTS.get(protocol, {}).get("partial") and metrics.get("partial_pickups") == 0 and not metrics.get("partial_fallbacks") and has_partial_runs(plate_wells(shape, int(occupancy))):
+                    lines.append(name + ": no partial pickups REGRESSION")
+                    regressed = True
+    return lines, regressed
+
+def parse_occupancies(text: str) -> list[int]:
+    """
+    Parses a list of occupancies like ``"1,8,24-48"``.
+
+    :param text: Comma-separated numbers or ranges of numbers.
+    """
+    occupancies = []
+    for part in text.split(","):
+        start, _, end = part.partition("-")
+        occupancies += range(int(start), int(end or start) + 1)
+    if not all(1 <= occupancy <= 8 * PLATE_COLS for occupancy in occupancies):
+        raise argparse.ArgumentTypeError("Occupancies must be between 1 and 96.")
+    return occupancies
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--protocols", default=",".join(sorted(INPUTS)), help="comma-separated protocol names")
+    parser.add_argument("--shapes", default="columns,rows,scattered", help="comma-separated plate-map shapes")
+    parser.add_argument("--occupancies", type=parse_occupancies, default=DEFAULT_OCCUPANCIES, help="e.g. 1,8,24-48")
+    parser.add_argument("--baseline", type=pathlib.Path, default=BASELINE, help="the baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.01, help="the share the duration may go up by")
+    parser.add_argument("--jobs", type=int, default=None, help="the number of worker processes (default: one per CPU)")
+    parser.add_argument("--no-cache", action="store_true", help="simulate again even if the protocols haven't changed")
+    parser.add_argument("--update", action="store_true", help="write the results into the baseline file")
+    parser.add_argument("--quiet", action="store_true", help="don't print every run")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.protocols.split(","), args.shapes.split(","), args.occupancies, args.jobs, None if args.quiet else print, not args.no_cache)
+    baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+    lines, regressed = compare(baseline, results, args.tolerance)
+    print("\n".join(lines) if lines else "No differences from the baseline.")
+    if args.update:
+        # keep the runs that weren't repeated
+        for protocol, shapes in results.items():
+            for shape, runs in shapes.items():
+                baseline.setdefault(protocol, {}).setdefault(shape, {}).update(runs)
+                baseline[protocol][shape] = dict(sorted(baseline[protocol][shape].items(), key=lambda run: int(run[0])))
+        args.baseline.write_text(json.dumps(baseline, indent=2) + "\n")
+        return 0
+    return 1 if regressed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,76 @@
+"""
+Inlines the shared code in ``lib/`` into the protocols.
+
+The Opentrons app only accepts a single protocol file, so protocols can't import the shared code. Instead, every
+protocol that uses a file from ``lib/`` contains a marked region::
+
+    # >>> lib/plate_map.py
+    ...
+    # <<< lib/plate_map.py
+
+and this script replaces everything between the markers with the current contents of that file (without its module
+docstring, without imports of other ``lib/`` files, which are inlined by their own regions, and without imports that
+the protocol already has).
+
+Usage::
+
+    python tools/bundle.py            # update the protocols in place
+    python tools/bundle.py --check    # only list the protocols that are out of date
+"""
+import argparse
+import pathlib
+import re
+import sys
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+REGION = re.compile(r"^# >>> (lib/\w+\.py)[^\n]*\n.*?^# <<< \1[^\n]*$", re.MULTILINE | re.DOTALL)
+
+def inline_source(name: str, imports=frozenset()) -> str:
+    """
+    Returns the source of a file in ``lib/`` as it should appear inside a protocol.
+
+    :param name: The path of the file relative to the repository, e.g. ``"lib/plate_map.py"``.
+    :param imports: The import lines the protocol already has outside its ``lib/`` regions, which are left out.
+    """
+    source = (ROOT / name).read_text()
+    # drop the module docstring
+    docstring = re.match(r'\s*"""(.*?)"""\n', source, re.DOTALL)
+    if docstring is not None:
+        source = source[docstring.end():]
+    lines = [line for line in source.splitlines() if not line.startswith("from lib.") and line not in imports]
+    return "\n".join(lines).strip("\n")
+
+def bundle(text: str) -> str:
+    """
+    Returns the protocol source with every ``lib/`` region replaced by the current contents of its file.
+
+    :param text: The protocol source.
+    """
+    imports = frozenset(line for line in REGION.sub("", text).splitlines() if line.startswith(("import ", "from ")))
+
+    def replace(match: re.Match) -> str:
+        name = match.group(1)
+        return ("# >>> " + name + " (inlined by tools/bundle.py, edit the original instead)\n"
+                + inline_source(name, imports) + "\n"
+                + "# <<< " + name)
+    return REGION.sub(replace, text)
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--check", action="store_true", help="only list the protocols that are out of date")
+    args = parser.parse_args()
+
+    stale = []
+    for path in sorted((ROOT / "protocols").glob("*.py")):
+        text = path.read_text()
+        bundled = bundle(text)
+        if bundled != text:
+            stale.append(path.relative_to(ROOT))
+            if not args.check:
+                path.write_text(bundled)
+    for path in stale:
+        print(("out of date: " if args.check else "updated: ") + str(path))
+    return 1 if args.check and stale else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,316 @@
+"""
+Compiles the transfer plan of a protocol from its plate maps, off the robot.
+
+The plan (see ``lib/transfer_plan.py``) lists every transfer of the run. It is worked out by the protocol's own
+``make_plan()``, so it is exactly what the protocol would do with the same plate maps, and then checked against the
+labware and pipette definitions: every well has to exist, and no well may be filled or drawn from over its capacity.
+The notes of the plan, e.g. about volumes too small for the pipette, are reported as warnings. The plan can be written
+to a file to diff it against the plan of another batch, or pasted into the protocol, which then replays it instead of
+parsing the plate maps on the robot.
+
+Usage::
+
+    python tools/compile_plan.py pooling                                   # print the plan for the pasted plate map
+    python tools/compile_plan.py pooling --map wells.csv --output plan.json
+    python tools/compile_plan.py normalization --map volumes.csv --inline  # paste it into protocols/normalization.py
+    python tools/compile_plan.py normalization --remove                    # go back to the pasted grids
+    python tools/compile_plan.py normalization --map plate_1.csv --map plate_2.csv --param target_concentration=2 --output plans/
+
+``--map`` takes the same CSV file as the protocol's CSV parameter, and can be given once for every plate of a batch,
+with ``--output`` a directory that gets one plan per plate. The runtime parameters have their defaults unless they're
+set with ``--param``.
+"""
+import argparse
+import collections
+import importlib.util
+import json
+import pathlib
+import re
+import sys
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from lib.transfer_plan import PIPETTE_MAX_VOLUMES, tips_used
+
+# the protocols that work out their transfers with make_plan()
+PROTOCOLS = ["normalization", "pooling"]
+# the number of channels of the multi-channel pipettes, which transfer to the wells of a column below the one named
+PIPETTE_CHANNELS = {
+    "p20_multi_gen2": 8,
+    "p300_multi_gen2": 8,
+}
+PLATE_ROWS = "ABCDEFGHIJKLMNOP"
+# a position in mm, like opentrons.types.Point
+Point = collections.namedtuple("Point", ["x", "y", "z"])
+COMPILED_PLAN = re.compile(r'^compiled_plan_data = """\n.*?^"""$', re.MULTILINE | re.DOTALL)
+
+def load_protocol(protocol: str):
+    """
+    Imports a protocol as a module.
+
+    :param protocol: The name of the protocol, e.g. ``"pooling"``.
+    """
+    spec = importlib.util.spec_from_file_location(protocol, ROOT / "protocols" / (protocol + ".py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def labware_definition(load_name: str) -> dict:
+    """
+    Returns the definition of a labware, custom or from the Opentrons package.
+
+    :param load_name: The load name of the labware.
+    """
+    path = ROOT / "labware" / (load_name + ".json")
+    if path.exists():
+        return json.loads(path.read_text())
+    from opentrons.protocols.labware import get_labware_definition
+    return get_labware_definition(load_name)
+
+class DefinedLabware:
+    """
+    Stands in for a loaded labware in ``make_plan()``, with the wells of its definition.
+    """
+
+    def __init__(self, load_name: str):
+        """
+        :param load_name: The load name of the labware.
+        """
+        self.load_name = load_name
+        self.definition = labware_definition(load_name)
+
+    def wells(self) -> list["DefinedWell"]:
+        """Returns the wells, column by column like ``Labware.wells()``."""
+        return [DefinedWell(well, self.definition["wells"][well]) for column in self.definition["ordering"] for well in column]
+
+class DefinedWell:
+    """
+    Stands in for a well of a loaded labware in ``make_plan()``.
+    """
+
+    def __init__(self, well_name: str, shape: dict):
+        """
+        :param well_name: The name of the well, e.g. ``"A1"``.
+        :param shape: The well from the labware definition.
+        """
+        self.well_name = well_name
+        # the top of the well, from the front left corner of the labware
+        self.point = Point(shape["x"], shape["y"], shape["z"] + shape["depth"])
+
+    def top(self) -> "DefinedWell":
+        """Returns the top of the well, whose ``point`` is the only part of a location ``make_plan()`` uses."""
+        return self
+
+def channel_wells(pipette_name: str, well: str) -> list[str]:
+    """
+    Returns the wells a pipette reaches when its first channel is at a well.
+
+    :param pipette_name: The name of the pipette, e.g. ``"p20_multi_gen2"``.
+    :param well: The name of the well of the first channel, e.g. ``"A3"``.
+    """
+    row = PLATE_ROWS.index(well[0])
+    return [PLATE_ROWS[row + channel] + well[1:] for channel in range(PIPETTE_CHANNELS.get(pipette_name, 1))]
+
+class Parameters:
+    """
+    Stands in for ``protocol.params``, with the defaults of the runtime parameters a protocol adds in
+    ``add_parameters()``.
+    """
+
+    def __init__(self, module):
+        """
+        :param module: The protocol, from ``load_protocol()``.
+        """
+        # the type of every parameter, to convert the values given on the command line
+        self._types = {}
+        module.add_parameters(self)
+
+    def _add(self, kind: type, variable_name: str, default):
+        self._types[variable_name] = kind
+        setattr(self, variable_name, default)
+
+    def add_str(self, variable_name: str, default: str, **kwargs):
+        self._add(str, variable_name, default)
+
+    def add_int(self, variable_name: str, default: int, **kwargs):
+        self._add(int, variable_name, default)
+
+    def add_float(self, variable_name: str, default: float, **kwargs):
+        self._add(float, variable_name, default)
+
+    def add_bool(self, variable_name: str, default: bool, **kwargs):
+        self._add(bool, variable_name, default)
+
+    def add_csv_file(self, variable_name: str, **kwargs):
+        # the plate maps are passed to make_plan() directly
+        pass
+
+    def set(self, text: str):
+        """
+        Sets a parameter like ``"target_concentration=2"``.
+
+        :param text: The variable name of the parameter, "=", and the value.
+        """
+        name, equals, value = text.partition("=")
+        if not equals or name not in self._types:
+            raise ValueError("Unknown parameter " + repr(text) + ", expected one of " + ", ".join(sorted(self._types)) + ".")
+        if self._types[name] is bool:
+            setattr(self, name, value.lower() in ("true", "yes", "1"))
+        else:
+            setattr(self, name, self._types[name](value))
+
+def compile_plan(protocol: str, data: str | None = None, params=()) -> dict:
+    """
+    Returns the plan of a protocol.
+
+    :param protocol: The name of the protocol, e.g. ``"pooling"``.
+    :param data: The plate maps as in the protocol's CSV file, or None for the ones pasted into the protocol.
+    :param params: Runtime parameters to set, like ``"target_concentration=2"``.
+    """
+    module = load_protocol(protocol)
+    parameters = Parameters(module)
+    for text in params:
+        parameters.set(text)
+    maps = module.pasted_maps() if data is None else module.PlateMap.parse_all(data)
+    if hasattr(module, "PLAN_LABWARE"):
+        # the protocol works out the plan from the wells of its labware
+        plan = module.make_plan(maps, parameters, {name: DefinedLabware(load_name) for name, load_name in module.PLAN_LABWARE.items()})
+    else:
+        plan = module.make_plan(maps, parameters)
+    module.check_plan(plan, protocol)
+    return plan
+
+def validate(plan: dict) -> tuple[list[str], list[str]]:
+    """
+    Checks a plan against the definitions of its labware and pipettes, and returns the errors and the warnings.
+
+    :param plan: The plan, which has already passed the protocol's ``check_plan()``.
+    """
+    errors = []
+    warnings = []
+    definitions = {name: labware_definition(load_name) for name, load_name in plan["labware"].items()}
+    for name, pipette_name in plan["pipettes"].items():
+        if pipette_name not in PIPETTE_MAX_VOLUMES:
+            errors.append("Unknown pipette " + pipette_name + ".")
+    if errors:
+        return errors, warnings
+
+    added = collections.Counter()
+    drawn = collections.Counter()
+    for number, step in enumerate(plan["steps"], 1):
+        where = "step " + str(number) + ": "
+        pipette_name = plan["pipettes"][step["pipette"]]
+        for source, dest, volume in zip(step["sources"], step["dests"], step["volumes"]):
+            # every channel of a multi-channel pipette transfers the volume
+            for channel_source, channel_dest in zip(channel_wells(pipette_name, source), channel_wells(pipette_name, dest)):
+                for labware, well in ((step["source"], channel_source), (step["dest"], channel_dest)):
+                    if well not in definitions[labware]["wells"]:
+                        errors.append(where + labware + " has no well " + well + ".")
+                added[(step["dest"], channel_dest)] += volume
+                drawn[(step["source"], channel_source)] += volume
+            if volume == 0:
+                warnings.append(where + "transfers nothing from " + source + " to " + dest + " but still uses a tip.")
+        if "disposal_volume" in step:
+            # the disposal volume is blown out back into the source, but it has to be there for the last aspiration
+            for channel_source in channel_wells(pipette_name, step["sources"][0]):
+                drawn[(step["source"], channel_source)] += step["disposal_volume"]
+    for (labware, well), volume in added.items():
+        capacity = definitions[labware]["wells"].get(well, {}).get("totalLiquidVolume")
+        if capacity is not None and volume > capacity:
+            errors.append(str(round(volume, 2)) + " µL is added to " + well + " of " + labware + ", which holds " + str(capacity) + " µL.")
+    for (labware, well), volume in drawn.items():
+        capacity = definitions[labware]["wells"].get(well, {}).get("totalLiquidVolume")
+        if capacity is not None and volume > capacity:
+            errors.append(str(round(volume, 2)) + " µL is taken from " + well + " of " + labware + ", which holds " + str(capacity) + " µL.")
+    warnings += plan.get("notes", [])
+    return errors, warnings
+
+def count_tips(plan: dict) -> int:
+    """
+    Returns the number of tips a plan uses.
+
+    :param plan: The plan.
+    """
+    tips = 0
+    for step in plan["steps"]:
+        pipette_name = plan["pipettes"][step["pipette"]]
+        tips += PIPETTE_CHANNELS.get(pipette_name, 1) * tips_used(step, PIPETTE_MAX_VOLUMES[pipette_name])
+    return tips
+
+def dump_plan(plan: dict) -> str:
+    """
+    Returns a plan as JSON with one step per line, so plans can be diffed line by line.
+
+    :param plan: The plan.
+    """
+    lines = [json.dumps(key) + ": " + json.dumps(value, ensure_ascii=False) for key, value in plan.items() if key != "steps"]
+    steps = ",\n".join("  " + json.dumps(step, ensure_ascii=False) for step in plan["steps"])
+    return "{\n" + "".join(" " + line + ",\n" for line in lines) + ' "steps": [\n' + steps + "\n ]\n}"
+
+def inline(protocol: str, text: str):
+    """
+    Replaces the compiled plan pasted into a protocol.
+
+    :param protocol: The name of the protocol, e.g. ``"pooling"``.
+    :param text: The plan from ``dump_plan()``, or an empty string to remove it.
+    """
+    path = ROOT / "protocols" / (protocol + ".py")
+    source = path.read_text()
+    if COMPILED_PLAN.search(source) is None:
+        raise ValueError(str(path.relative_to(ROOT)) + " has no compiled_plan_data.")
+    replacement = 'compiled_plan_data = """\n' + (text + "\n" if text else "") + '"""'
+    path.write_text(COMPILED_PLAN.sub(lambda match: replacement, source, count=1))
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("protocol", choices=PROTOCOLS, help="the protocol to compile the plan of")
+    parser.add_argument("--map", type=pathlib.Path, action="append", default=[], help="the CSV file of plate maps (default: the ones pasted into the protocol)")
+    parser.add_argument("--param", action="append", default=[], help="a runtime parameter, e.g. target_concentration=2")
+    parser.add_argument("--output", type=pathlib.Path, help="write the plan to this file (or directory, with several maps) instead of printing it")
+    parser.add_argument("--inline", action="store_true", help="paste the plan into the protocol")
+    parser.add_argument("--remove", action="store_true", help="remove the plan pasted into the protocol")
+    args = parser.parse_args()
+
+    if args.remove:
+        inline(args.protocol, "")
+        print("Removed the compiled plan from protocols/" + args.protocol + ".py.", file=sys.stderr)
+        return 0
+    if len(args.map) > 1 and (args.inline or args.output is None):
+        parser.error("several maps need --output to be a directory")
+
+    failed = False
+    for path in args.map or [None]:
+        prefix = path.name + ": " if len(args.map) > 1 else ""
+        try:
+            plan = compile_plan(args.protocol, path.read_text() if path is not None else None, args.param)
+            errors, warnings = validate(plan)
+        except ValueError as error:
+            print(prefix + "error: " + str(error), file=sys.stderr)
+            failed = True
+            continue
+        for warning in warnings:
+            print(prefix + "warning: " + warning, file=sys.stderr)
+        for error in errors:
+            print(prefix + "error: " + error, file=sys.stderr)
+        if errors:
+            failed = True
+            continue
+
+        text = dump_plan(plan)
+        transfers = sum(len(step["volumes"]) for step in plan["steps"])
+        print(prefix + str(len(plan["wells"])) + " wells, " + str(transfers) + " transfers, " + str(count_tips(plan)) + " tips.", file=sys.stderr)
+        if args.inline:
+            inline(args.protocol, text)
+            print("Pasted the plan into protocols/" + args.protocol + ".py.", file=sys.stderr)
+        elif len(args.map) > 1:
+            args.output.mkdir(parents=True, exist_ok=True)
+            (args.output / (path.stem + ".json")).write_text(text + "\n")
+        elif args.output is not None:
+            args.output.write_text(text + "\n")
+        else:
+            print(text)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
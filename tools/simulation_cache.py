@@ -0,0 +1,147 @@
+"""
+A local cache of simulation results, so protocols that haven't changed aren't simulated again.
+
+``tools/benchmark.py`` and ``tools/sweep.py`` simulate the same protocol files with the same plate maps over and over,
+and a purification protocol takes seconds to simulate. Every result is stored in ``.simulation_cache/`` under a key made
+from the hash of the protocol source (which includes the pasted plate map and parameter defaults), the hashes of the
+custom labware definitions in ``labware/``, the parameter values, and the version of the Opentrons package. Changing any
+of them simulates the protocol again. The cache keeps the entries that were used most recently and deletes the others
+once it holds more than ``MAX_ENTRIES``.
+
+Usage::
+
+    python tools/simulation_cache.py            # show how many results are cached
+    python tools/simulation_cache.py --clear    # delete them
+"""
+import argparse
+import functools
+import hashlib
+import importlib.metadata
+import json
+import os
+import pathlib
+import sys
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+CACHE_DIRECTORY = ROOT / ".simulation_cache"
+# the number of results to keep
+MAX_ENTRIES = 5000
+
+@functools.cache
+def labware_hash() -> str:
+    """
+    Returns a hash of the names and contents of the custom labware definitions in ``labware/``.
+    """
+    digest = hashlib.sha256()
+    for path in sorted((ROOT / "labware").glob("*.json")):
+        digest.update(path.name.encode() + b"\0" + hashlib.sha256(path.read_bytes()).digest())
+    return digest.hexdigest()
+
+@functools.cache
+def opentrons_version() -> str:
+    """
+    Returns the version of the Opentrons package the protocols are simulated with.
+    """
+    # from the package metadata, which is much faster than importing it
+    return importlib.metadata.version("opentrons")
+
+def cache_key(source: str, params=()) -> str:
+    """
+    Returns the key of the simulation result of a protocol.
+
+    :param source: The protocol source.
+    :param params: The (name, value) pairs of the runtime parameters the protocol is simulated with.
+    """
+    parts = [opentrons_version(), labware_hash(), hashlib.sha256(source.encode()).hexdigest(), json.dumps(sorted(params))]
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+class SimulationCache:
+    """
+    Simulation results stored as one JSON file per key. Reading a result marks it as used, and the results that were
+    used longest ago are deleted first.
+    """
+
+    def __init__(self, directory=CACHE_DIRECTORY, max_entries=MAX_ENTRIES):
+        """
+        :param directory: The directory to store the results in.
+        :param max_entries: The number of results to keep.
+        """
+        self.directory = pathlib.Path(directory)
+        self.max_entries = max_entries
+
+    def path(self, key: str) -> pathlib.Path:
+        """Returns the file of the result stored under a key."""
+        return self.directory / (key + ".json")
+
+    def get(self, key: str) -> dict | None:
+        """
+        Returns the result stored under a key, or None if there is none.
+
+        :param key: The key, from ``cache_key()``.
+        """
+        path = self.path(key)
+        try:
+            result = json.loads(path.read_text())
+            # the modification time records when the result was last used
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return result
+
+    def put(self, key: str, result: dict):
+        """
+        Stores a result, and deletes the results used longest ago if there are too many.
+
+        :param key: The key, from ``cache_key()``.
+        :param result: The result, which has to be JSON-serializable.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # write to a temporary file first, so worker processes never read half a result
+        temporary = self.directory / (key + "." + str(os.getpid()) + ".tmp")
+        temporary.write_text(json.dumps(result))
+        temporary.replace(self.path(key))
+        self.evict()
+
+    def entries(self) -> list[pathlib.Path]:
+        """
+        Returns the files of the stored results, the one used longest ago first.
+        """
+        paths = []
+        for path in self.directory.glob("*.json"):
+            try:
+                paths.append((path.stat().st_mtime, path))
+            except OSError:
+                # deleted by another worker process in the meantime
+                pass
+        return [path for mtime, path in sorted(paths)]
+
+    def evict(self):
+        """
+        Deletes the results used longest ago until no more than ``max_entries`` are left.
+        """
+        entries = self.entries()
+        for path in entries[:max(0, len(entries) - self.max_entries)]:
+            path.unlink(missing_ok=True)
+
+    def clear(self):
+        """
+        Deletes every stored result.
+        """
+        for path in self.entries():
+            path.unlink(missing_ok=True)
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--clear", action="store_true", help="delete every cached result")
+    args = parser.parse_args()
+
+    cache = SimulationCache()
+    if args.clear:
+        cache.clear()
+    entries = cache.entries()
+    size = sum(path.stat().st_size for path in entries)
+    print(str(len(entries)) + " cached results (" + str(round(size / 1e6, 1)) + " MB) in " + str(cache.directory))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+"""
+Simulates the protocols over a matrix of runtime parameters and plate maps, and reports the runs that fail.
+
+Every combination of the given parameter values, plate-map shapes and occupancies is simulated for every protocol (a
+parameter a protocol doesn't have is left out for it), spread over a pool of worker processes with one run per worker
+at a time. The failures are grouped by what went wrong, e.g. running out of tips, reservoirs or wells that can't hold
+the volume, or well names and parameter values that don't exist. A run that picks up tips another way than its tip plan
+counted them (the ``unplanned_pickups`` of ``tools/benchmark.py``) also fails, even if it ran to the end.
+
+Usage::
+
+    python tools/sweep.py --param multi_starting_col=1,6,12 --param single_starting_row=A,H
+    python tools/sweep.py --protocols pooling --param starting_tip_row=A,D,H --param starting_tip_col=1-12 --occupancies 1-96
+    python tools/sweep.py --param park_tips=false,true --json sweep.json
+    python tools/sweep.py --param partial_tips=false,true --shapes columns,rows,scattered --occupancies 1-96
+
+The plate maps, how the runs are simulated and the cache of their results are the same as in ``tools/benchmark.py``. The
+script exits with an error if any run failed.
+"""
+import argparse
+import collections
+import itertools
+import json
+import pathlib
+import sys
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent))
+
+from benchmark import INPUTS, ROOT, case_name, parse_occupancies, plate_wells, run_cases
+
+# what went wrong in a failed run, by the words in its error message, checked in this order
+FAILURE_KINDS = [
+    ("parameter", ["parametervalueerror", "has no parameter"]),
+    ("out of tips", ["outoftipserror", "out of tips"]),
+    ("volume", ["volume", "not enough room", "overflow", "exceeds"]),
+    ("well name", ["plate row", "plate column", "keyerror", "well name"]),
+    ("location", ["locationnotinwell", "below the bottom"]),
+]
+
+def failure_kind(error: str) -> str:
+    """
+    Returns what went wrong in a failed run (one of ``FAILURE_KINDS``, or "other").
+
+    :param error: The error message of the run.
+    """
+    error = error.lower()
+    for kind, words in FAILURE_KINDS:
+        if any(word in error for word in words):
+            return kind
+    return "other"
+
+def run_failure(result: dict) -> str:
+    """
+    Returns what went wrong in a run: the kind of its error (see ``failure_kind``), "unplanned pickup" if it picked up
+    tips another way than its tip plan counted them, or None if nothing did.
+
+    :param result: The result of the run, from ``benchmark.run_case``.
+    """
+    if "error" in result:
+        return failure_kind(result["error"])
+    if result.get("unplanned_pickups"):
+        return "unplanned pickup"
+    return None
+
+def parse_param(text: str) -> tuple[str, list[str]]:
+    """
+    Parses a parameter and its values like ``"multi_starting_col=1,6,12"``. Ranges of numbers like ``"1-12"`` are
+    expanded.
+
+    :param text: The variable name of the parameter, "=", and comma-separated values.
+    """
+    name, equals, values = text.partition("=")
+    if not equals or not values:
+        raise argparse.ArgumentTypeError("Expected name=value,value,..., got " + text + ".")
+    expanded = []
+    for value in values.split(","):
+        start, dash, end = value.partition("-")
+        if dash and start.isdigit() and end.isdigit():
+            expanded += [str(number) for number in range(int(start), int(end) + 1)]
+        else:
+            expanded.append(value)
+    return name, expanded
+
+def sweep_cases(protocols: list[str], shapes: list[str], occupancies: list[int], params: list[tuple[str, list[str]]]) -> list[tuple]:
+    """
+    Returns a case (see ``benchmark.run_case``) for every protocol and every combination of shape, occupancy and values
+    of the parameters the protocol has.
+
+    :param protocols: The names of the protocols.
+    :param shapes: The plate-map shapes (see ``benchmark.plate_wells``).
+    :param occupancies: The numbers of occupied wells.
+    :param params: The variable names of the parameters with the values to try.
+    """
+    cases = []
+    for protocol in protocols:
+        source = (ROOT / "protocols" / (protocol + ".py")).read_text()
+        own = [(name, values) for name, values in params if 'variable_name="' + name + '"' in source]
+        # protocols without a plate map always take their samples column by column
+        protocol_shapes = shapes if "grids" in INPUTS.get(protocol, {}) else ["columns"]
+        for shape, occupancy in itertools.product(protocol_shapes, occupancies):
+            for values in itertools.product(*[values for name, values in own]):
+                cases.append((protocol, shape, occupancy, tuple(zip([name for name, values in own], values))))
+    return cases
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--protocols", default=",".join(sorted(INPUTS)), help="comma-separated protocol names")
+    parser.add_argument("--shapes", default="columns", help="comma-separated plate-map shapes")
+    parser.add_argument("--occupancies", type=parse_occupancies, default=[1, 8, 12, 24, 48, 96], help="e.g. 1,8,24-48")
+    parser.add_argument("--param", type=parse_param, action="append", default=[], help="e.g. multi_starting_col=1,6,12")
+    parser.add_argument("--jobs", type=int, default=None, help="the number of worker processes (default: one per CPU)")
+    parser.add_argument("--no-cache", action="store_true", help="simulate again even if the protocols haven't changed")
+    parser.add_argument("--json", type=pathlib.Path, help="also write every result to this file")
+    args = parser.parse_args()
+
+    for shape in args.shapes.split(","):
+        plate_wells(shape, 1)
+    cases = sweep_cases(args.protocols.split(","), args.shapes.split(","), args.occupancies, args.param)
+    print("Simulating " + str(len(cases)) + " runs.")
+    start = time.monotonic()
+
+    def log(case: tuple, result: dict):
+        if run_failure(result) is not None:
+            print("FAILED " + case_name(case) + ": " + result.get("error", str(result.get("unplanned_pickups")) + " unplanned pickups"))
+    results = run_cases(cases, args.jobs, log, not args.no_cache)
+
+    failures = collections.defaultdict(list)
+    for case, result in zip(cases, results):
+        if run_failure(result) is not None:
+            failures[run_failure(result)].append(case_name(case))
+    print()
+    print(str(len(cases) - sum(map(len, failures.values()))) + " of " + str(len(cases)) + " runs succeeded in " + str(round(time.monotonic() - start)) + " s.")
+    for kind, names in sorted(failures.items()):
+        print(kind + ": " + str(len(names)) + " failed")
+        for name in names:
+            print("    " + name)
+    if args.json is not None:
+        records = []
+        for (protocol, shape, occupancy, params), result in zip(cases, results):
+            record = {"protocol": protocol, "shape": shape, "occupancy": occupancy, "params": dict(params)}
+            if run_failure(result) is not None:
+                record["failure"] = run_failure(result)
+            records.append({**record, **result})
+        args.json.write_text(json.dumps(records, indent=2) + "\n")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())